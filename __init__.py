@@ -30,6 +30,9 @@ from .gcc import mingw_x86
 from .gcc import linux_gcc_x86
 from .gcc import linux_gcc_x64
 
+from .clang import linux_clang_x86
+from .clang import linux_clang_x64
+
 all_compiler_list = [
     visual_cpp_2008_x86(),
     visual_cpp_2008_x64(),
@@ -39,7 +42,9 @@ all_compiler_list = [
     visual_cpp_2013_x64(),
     mingw_x86(),
     linux_gcc_x86(),
-    linux_gcc_x64()
+    linux_gcc_x64(),
+    linux_clang_x86(),
+    linux_clang_x64()
     ]
 
 def get_supported_compilers():
@@ -0,0 +1,172 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import re
+import json
+import time
+
+# Automatic precompiled headers. The dependency graph of a target records the
+# headers every source includes; the headers that most C++ sources include, and
+# that have not been edited lately, are gathered into a generated header. The
+# compiler precompiles it and force includes it ahead of every C++ source (see
+# gcc.compile and visual_cpp.compile).
+#
+# Only headers the sources include directly go in, so the generated header never
+# includes a library's internal headers. Each is included by the path it was
+# found at: the generated header is not where the sources are, so a quoted
+# include would not find headers beside the sources. Changing the generated header rebuilds
+# every source, so the selection is only made again when the set of common
+# headers has changed by more than revisit_fraction, a selected header is
+# edited, a header left out for being edited lately settles down, or sources
+# come and go.
+#
+# Everything lives in <intermediates>/autopch:
+#   autopch.h        the generated header (absent if nothing was selected)
+#   selection.json   what the selection was based on
+
+selection_file_version = 2
+
+min_sources = 4             # targets with fewer C++ sources get no precompiled header
+min_fraction = 0.5          # the fraction of C++ sources that must include a header
+stable_age = 60 * 60        # seconds since a header last changed before it can be selected
+revisit_fraction = 0.25     # how much change makes the selection worth making again
+
+include_pattern = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]', re.MULTILINE)
+
+def get_auto_pch_dir(c, name, output_dir):
+    return os.path.join(c.get_intermediates_dir(name, output_dir), 'autopch')
+
+def get_header_path(c, name, output_dir):
+    return os.path.abspath(os.path.join(get_auto_pch_dir(c, name, output_dir), 'autopch.h'))
+
+def get_direct_includes(source):
+    # The names a source file's #include directives include.
+    with open(source, 'r') as source_file:
+        source_text = source_file.read()
+    return [os.path.normpath(include_match.group(2)) for include_match in include_pattern.finditer(source_text)]
+
+def get_directive(header):
+    return '#include "%s"' % header.replace('\\', '/')
+
+def resolve_include(include_name, dep_list):
+    # The header a source's include directive found, from the source's deps.
+    suffix = os.sep + include_name
+    for dep in dep_list:
+        if dep.endswith(suffix) or os.path.normcase(dep).endswith(os.path.normcase(suffix)):
+            return dep
+    return None
+
+def get_common_headers(dep_graph, cpp_sources):
+    # The headers at least min_fraction of the sources include, directly or not.
+    counts = {}
+    for source in cpp_sources:
+        for header in dep_graph.get_deps(source):
+            counts[header] = counts.get(header, 0) + 1
+    threshold = max(1, min_fraction * len(cpp_sources))
+    return sorted(header for header, count in counts.items() if count >= threshold)
+
+def select_headers(c, dep_graph, cpp_sources, common_headers):
+    # Returns a list of (directive, header path) tuples, in first include order, and
+    # the list of headers left out only because they changed too recently.
+    common = set(common_headers)
+    now = time.time()
+    counts = {}
+    order = []
+    unstable = set()
+    for source in cpp_sources:
+        deps = dep_graph.get_deps(source)
+        for include_name in get_direct_includes(source):
+            header = resolve_include(include_name, deps)
+            if header is None or not header in common:
+                continue
+            if now - c.get_source_mtime(header) < stable_age:
+                unstable.add(header)
+                continue
+            if not header in counts:
+                counts[header] = 0
+                order.append(header)
+            counts[header] += 1
+
+    threshold = max(1, min_fraction * len(cpp_sources))
+    selected = [(get_directive(header), header) for header in order if counts[header] >= threshold]
+    return (selected, sorted(unstable))
+
+def needs_selection(c, previous, cpp_sources, common_headers):
+    if previous.get('version') != selection_file_version:
+        return True
+    old_sources = set(previous['sources'])
+    new_sources = set(cpp_sources)
+    if len(old_sources ^ new_sources) > revisit_fraction * max(1, len(old_sources)):
+        return True
+    old_common = set(previous['common'])
+    if len(old_common ^ set(common_headers)) > revisit_fraction * max(1, len(old_common)):
+        return True
+    for header, mtime in previous['mtimes'].items():
+        if not os.path.isfile(header) or c.get_source_mtime(header) != mtime:
+            return True
+    now = time.time()
+    for header in previous['unstable']:
+        if os.path.isfile(header) and now - c.get_source_mtime(header) >= stable_age:
+            return True
+    return False
+
+def update_auto_pch(c, name, output_dir, dep_graph, source_list):
+    # Bring the generated header up to date. Sources with no dependency information
+    # yet (a first build) do not count.
+    auto_pch_dir = get_auto_pch_dir(c, name, output_dir)
+    header_path = get_header_path(c, name, output_dir)
+    selection_path = os.path.join(auto_pch_dir, 'selection.json')
+
+    cpp_sources = [os.path.abspath(source) for source in source_list
+                   if os.path.splitext(source)[1] == '.cpp' and dep_graph.has_source(source)]
+    if len(cpp_sources) < min_sources:
+        return
+    common_headers = get_common_headers(dep_graph, cpp_sources)
+
+    try:
+        with open(selection_path, 'r') as selection_file:
+            previous = json.load(selection_file)
+    except (IOError, OSError, ValueError):
+        previous = {}
+    if not needs_selection(c, previous, cpp_sources, common_headers):
+        return
+
+    selected, unstable = select_headers(c, dep_graph, cpp_sources, common_headers)
+    if not os.path.exists(auto_pch_dir):
+        os.makedirs(auto_pch_dir)
+    if selected:
+        header_text = '// Generated from the headers most sources include. Do not edit.\n'
+        header_text += ''.join(directive + '\n' for directive, header in selected)
+        old_text = None
+        if os.path.isfile(header_path):
+            with open(header_path, 'r') as header_file:
+                old_text = header_file.read()
+        if header_text != old_text:
+            c.print_log("precompiling %d common headers" % len(selected))
+            with open(header_path, 'w') as header_file:
+                header_file.write(header_text)
+    elif os.path.isfile(header_path):
+        c.print_log("no common headers to precompile")
+        os.remove(header_path)
+
+    with open(selection_path, 'w') as selection_file:
+        json.dump({
+            'version': selection_file_version,
+            'sources': cpp_sources,
+            'common': common_headers,
+            'mtimes': dict((header, c.get_source_mtime(header)) for directive, header in selected),
+            'unstable': unstable
+            }, selection_file)
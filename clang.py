@@ -0,0 +1,249 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import re
+import json
+from .gcc import gcc
+from .gcc import linux_gcc
+from .gcc import linux_gcc_x86
+from .gcc import linux_gcc_x64
+from .gcc import parse_make_rules
+from .gcc import get_unique_headers
+
+# The number of entries in each section of the time trace report.
+time_trace_report_count = 20
+
+def find_tool(bin_path, name_list):
+    # The first of the named tools found in bin_path or on the PATH, or None.
+    path_list = [bin_path]
+    path_list.extend(os.environ['PATH'].split(':'))
+    for tool_name in name_list:
+        for path in path_list:
+            tool_path = os.path.join(path, tool_name)
+            if os.path.isfile(tool_path):
+                return tool_path
+    return None
+
+# clang takes the same command line as gcc, so it shares the gcc backend. The
+# differences are in optimization, LTO and modules.
+class linux_clang(linux_gcc):
+    # Build options, as for gcc, plus:
+    # "time_trace" = profile each compile with -ftime-trace, and write a report of
+    #     the most expensive headers and template instantiations in the target
+    # "scan_deps" = find the headers every source includes with one run of
+    #     clang-scan-deps before compiling, rather than have each compile write them
+    time_trace = False
+    scan_deps = False
+
+    # The headers clang-scan-deps found for each source being compiled, by source,
+    # until its compile succeeds (see handle_compile_result).
+    scanned_deps = None
+
+    def detect(self):
+        self.bin_path = None
+        path_split = os.environ['PATH'].split(':')
+        for path in path_split:
+            if os.path.exists(os.path.join(path, 'clang')):
+                self.bin_path = path
+                break
+        if not self.bin_path:
+            return False
+
+        # Prefer the LLVM binary tools; they understand LTO bitcode.
+        self.builtin_include_list = []
+        self.builtin_libpath_list = []
+        self.gcc = os.path.join(self.bin_path, 'clang')
+        self.gpp = os.path.join(self.bin_path, 'clang++')
+        self.ar = find_tool(self.bin_path, ['llvm-ar', 'ar'])
+        self.gcc_ar = self.ar
+        self.strip = find_tool(self.bin_path, ['llvm-strip', 'strip'])
+        self.objcopy = find_tool(self.bin_path, ['llvm-objcopy', 'objcopy'])
+        self.clang_scan_deps = find_tool(self.bin_path, ['clang-scan-deps'])
+        return True
+
+    def get_compile_flags(self, config, include_list, define_list):
+        compile_flags = gcc.get_compile_flags(self, config, include_list, define_list)
+        if self.get_option('lto', config):
+            compile_flags[compile_flags.index('-flto')] = '-flto=thin'
+        if self.get_option('time_trace', config):
+            compile_flags.append('-ftime-trace')    # Write <object name>.json beside the object
+        return compile_flags
+
+    def get_pgo_flags(self, config):
+        # clang's profiles are .profraw files merged with llvm-profdata; not yet.
+        if self.get_option('pgo_mode', config) != gcc.pgo_mode_none:
+            self.handle_error("error: profile guided optimization is not supported with clang")
+        return []
+
+    def optimization_flags(self, config):
+        if config == 'debug':
+            return ['-O0']
+        else:
+            return ['-O3', '-ffast-math']   # clang's -Ofast is deprecated
+
+    def get_language_command(self, name, output_dir, config, source_extension):
+        if source_extension != '.c' and self.get_option('modules', config):
+            self.handle_error("error: modules are not supported with clang")
+        return gcc.get_language_command(self, name, output_dir, config, source_extension)
+
+    def get_dep_flags(self, r, config):
+        if self.use_scan_deps(config):
+            return []
+        return gcc.get_dep_flags(self, r, config)
+
+    def acquire_link_jobs(self, config, budget, ld_flags):
+        # ThinLTO backend jobs; clang can not take them from a jobserver.
+        lto = self.get_option('lto', config)
+        if lto:
+            link_jobs = budget.acquire_up_to(budget.job_count if lto is True else lto)
+            ld_flags.extend(['-flto=thin', '-flto-jobs=%d' % link_jobs])
+            return link_jobs
+        return budget.acquire()
+
+    def get_unbudgeted_link_flags(self, config):
+        if self.get_option('lto', config):
+            return ['-flto=thin']
+        return []
+
+    def use_scan_deps(self, config):
+        return self.get_option('scan_deps', config) and self.clang_scan_deps is not None
+
+    def compile_object_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list):
+        try:
+            if self.use_scan_deps(config):
+                self.scan_dependencies(name, output_dir, config, rebuild_list, include_list, define_list)
+            built_list = gcc.compile_object_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list)
+        finally:
+            self.scanned_deps = None
+        if self.get_option('time_trace', config):
+            self.write_time_trace_report(name, output_dir, source_list)
+        return built_list
+
+    def scan_dependencies(self, name, output_dir, config, rebuild_list, include_list, define_list):
+        # Find the headers of all of the sources about to be compiled, from a
+        # compilation database run through clang-scan-deps in one go. Nothing is
+        # written until each compile succeeds, so a source that fails to compile
+        # keeps its old .dep file and dependency graph entry.
+        compile_flags = self.get_compile_flags(config, include_list, define_list)
+        database = []
+        for r in rebuild_list:
+            command = self.get_language_command(name, output_dir, config, os.path.splitext(r.source)[1])
+            command.extend(compile_flags)
+            command.extend(['-o' + self.prep_path(r.obj), self.prep_path(r.source)])
+            database.append({'directory': os.getcwd(),
+                             'file': os.path.abspath(r.source),
+                             'command': ' '.join(command)})
+        database_path = os.path.join(self.get_intermediates_dir(name, output_dir), 'compile_commands.json')
+        with open(database_path, 'w') as database_file:
+            json.dump(database, database_file, indent=1)
+
+        budget = self.get_job_budget()
+        scan_jobs = budget.acquire_up_to(budget.job_count)
+        try:
+            self.print_both("scanning dependencies")
+            i = self.invoke([self.prep_path(self.clang_scan_deps),
+                             '-compilation-database=' + self.prep_path(database_path),
+                             '-format=make',
+                             '-j=%d' % scan_jobs], 0)
+        finally:
+            budget.release(scan_jobs)
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
+
+        records = dict((os.path.abspath(r.obj), r) for r in rebuild_list)
+        self.scanned_deps = {}
+        for rule_targets, prerequisites in parse_make_rules(i.stdout):
+            for rule_target in rule_targets:
+                r = records.get(os.path.abspath(rule_target))
+                if r is not None:
+                    self.scanned_deps[r.source] = get_unique_headers(r, prerequisites)
+        # Nothing else writes a .dep file when scanning, so a source the scan missed
+        # would be compiled again on every build.
+        for r in rebuild_list:
+            if not r.source in self.scanned_deps:
+                self.handle_error("error: clang-scan-deps found no dependencies for %s" % r.source)
+
+    def handle_compile_result(self, i, r, process_deps=True, extra_deps=[]):
+        headers = self.scanned_deps.pop(r.source, None) if self.scanned_deps else None
+        if headers is None:
+            gcc.handle_compile_result(self, i, r, process_deps, extra_deps)
+            return
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
+        self.write_dep_file(r, get_unique_headers(r, headers + list(extra_deps)))
+
+    def write_time_trace_report(self, name, output_dir, source_list):
+        # Add up the -ftime-trace profiles of every source in the target. Header times
+        # include the headers they include in turn.
+        header_times = {}
+        instantiation_times = {}
+        source_times = []
+        for source in source_list:
+            r = self.get_rebuild_record(name, output_dir, source)
+            trace_path = os.path.splitext(r.obj)[0] + '.json'
+            if not os.path.isfile(trace_path):
+                continue
+            with open(trace_path, 'r') as trace_file:
+                try:
+                    events = json.load(trace_file).get('traceEvents', [])
+                except ValueError:
+                    continue
+            for event in events:
+                if event.get('ph') != 'X':
+                    continue
+                event_name = event.get('name')
+                duration = event.get('dur', 0)
+                detail = event.get('args', {}).get('detail')
+                if event_name == 'Source':
+                    totals = header_times.setdefault(detail, [0, 0])
+                elif event_name in ['InstantiateClass', 'InstantiateFunction']:
+                    totals = instantiation_times.setdefault(detail, [0, 0])
+                elif event_name == 'Total ExecuteCompiler':
+                    source_times.append((duration, source))
+                    continue
+                else:
+                    continue
+                totals[0] += duration
+                totals[1] += 1
+
+        report = ["-- Time trace report for %s --" % name]
+        report.append("Slowest sources:")
+        for duration, source in sorted(source_times, reverse=True)[:time_trace_report_count]:
+            report.append("%10.3f s  %s" % (duration / 1000000.0, source))
+        for title, times in [("Most expensive headers:", header_times),
+                             ("Most expensive template instantiations:", instantiation_times)]:
+            report.append(title)
+            ranked = sorted(times.items(), key=lambda item: item[1][0], reverse=True)
+            for detail, totals in ranked[:time_trace_report_count]:
+                report.append("%10.3f s %6d x  %s" % (totals[0] / 1000000.0, totals[1], detail))
+
+        report_path = os.path.join(self.get_intermediates_dir(name, output_dir), 'time-trace.txt')
+        with open(report_path, 'w') as report_file:
+            report_file.write('\n'.join(report) + '\n')
+        for line in report:
+            self.print_log(line)
+
+class linux_clang_x86(linux_clang, linux_gcc_x86):
+    pass
+
+class linux_clang_x64(linux_clang, linux_gcc_x64):
+    def detect_native_march(self):
+        # clang has no -Q --help=target; the driver passes the CPU on to the compiler.
+        i = self.run_command(' '.join([self.prep_path(self.gcc), '-march=native', '-###', '-c', '-xc', os.devnull]))
+        march_match = re.search(r'"-target-cpu" "([^"]+)"', i.stdout)
+        if i.return_val != 0 or not march_match:
+            self.handle_error("error: could not find out what -march=native means on this host")
+        return march_match.group(1)
@@ -15,8 +15,48 @@
 
 from __future__ import print_function
 import os
-import subprocess
+import sys
 import shlex
+import threading
+import atexit
+import hashlib
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .depgraph import dependency_graph
+from .timings import build_timings
+from .timings import build_history_entry
+from .fingerprints import header_fingerprints
+from .autopch import update_auto_pch
+from .autopch import get_header_path
+from .jobs import get_default_budget
+from .launcher import get_default_launcher
+from . import ramdir
+from . import telemetry
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as digest_file:
+        for block in iter(lambda: digest_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Set when a deferred job nothing waited for fails at exit. The process then exits
+# with a non-zero status; this handler is registered first so it runs after every
+# other one, including each compiler's wait_for_deferred_at_exit.
+deferred_job_failed = [False]
+
+def exit_if_deferred_job_failed():
+    if deferred_job_failed[0]:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+atexit.register(exit_if_deferred_job_failed)
 
 class cplusplus_error(Exception):
     def __init__(self, desc):
@@ -33,16 +73,117 @@ class invoke_result:
         self.stdout = stdout
         self.stderr = stderr
 
+# One command line for compiler.invoke_parallel. "on_result" is called with the
+# invoke_result on the thread that called invoke_parallel. If "source" is given,
+# the time the command took is recorded as that source's compile time.
+class invocation:
+    def __init__(self, message, command_line, on_result, source=None):
+        self.message = message
+        self.command_line = command_line
+        self.on_result = on_result
+        self.source = source
+
+# Work done on a worker thread after a build step (see compiler.defer).
+class deferred_job(threading.Thread):
+    def __init__(self, function):
+        threading.Thread.__init__(self)
+        self.function = function
+        self.error = None
+
+    def run(self):
+        try:
+            self.error = self.function()
+        except Exception as e:
+            self.error = "error: %s" % e
+
 # Each "build_" compiler method takes a list of source files. Before invoking
 # the compiler, each source file is checked against it's coresponding object
 # file to determine if it needs to be rebuilt. A "rebuild_record" records all of
 # the details; the source file, the object file the compiler would build, and
 # the .dep file, which is a list of the header files the source file depends on.
-class rebuild_record:
+# The update time check also records why the source needs to be rebuilt (one of
+# the compiler.rebuild_reason_ strings) and, where there is one, the file
+# responsible. There is one for every source of a target in some builds, and
+# targets can have hundreds of thousands of sources, so records have no
+# per-instance dictionary.
+class rebuild_record(object):
+    __slots__ = ['source', 'obj', 'dep', 'reason', 'reason_path']
+
     def __init__(self, source, obj, dep):
         self.source = source
         self.obj = obj
         self.dep = dep
+        self.reason = None
+        self.reason_path = None
+
+# Source and header files do not change while a build runs, so their time stamps
+# can be cached. Whoever attaches a cache to a compiler (compiler.stat_cache) is
+# responsible for invalidating entries when files change (see daemon.py).
+class stat_cache:
+    def __init__(self):
+        self.mtimes = {}
+
+    def getmtime(self, path):
+        mtime = self.mtimes.get(path)
+        if mtime is None:
+            mtime = os.path.getmtime(path)
+            self.mtimes[path] = mtime
+        return mtime
+
+    def invalidate(self, path_list=None):
+        if path_list is None:
+            self.mtimes.clear()
+        else:
+            for path in path_list:
+                self.mtimes.pop(path, None)
+
+# A "target" records the arguments to one of the "build_" methods, so the same
+# build can be described once and repeated later (see watch.py).
+class target:
+    type_static_lib = 0
+    type_shared_lib = 1
+    type_application = 2
+
+    type_descriptions = ['static library', 'shared library', 'application']
+
+    def __init__(self, target_type, name, output_dir, config, source_list, include_list, define_list, libpath_list=None, lib_list=None):
+        self.target_type = target_type
+        self.name = name
+        self.output_dir = output_dir
+        self.config = config
+        self.source_list = source_list
+        self.include_list = include_list
+        self.define_list = define_list
+        self.libpath_list = libpath_list if libpath_list is not None else []
+        self.lib_list = lib_list if lib_list is not None else []
+
+# Targets as JSON objects, for the build server and the command line tools that
+# read targets.json files. Paths are made absolute.
+def target_to_dict(t):
+    return {
+        'target_type': t.target_type,
+        'name': t.name,
+        'output_dir': os.path.abspath(t.output_dir),
+        'config': t.config,
+        'source_list': [os.path.abspath(source) for source in t.source_list],
+        'include_list': [os.path.abspath(include_dir) for include_dir in t.include_list],
+        'define_list': list(t.define_list),
+        'libpath_list': [os.path.abspath(libpath_dir) for libpath_dir in t.libpath_list],
+        'lib_list': list(t.lib_list)
+        }
+
+def target_from_dict(d):
+    return target(
+        d['target_type'],
+        d['name'],
+        d['output_dir'],
+        d['config'],
+        d['source_list'],
+        d['include_list'],
+        d['define_list'],
+        d['libpath_list'],
+        d['lib_list']
+        )
 
 # Each compiler object should expose the following methods publicly:
 # "host" = the name of the platform the tool runs on (Windows/Linux)
@@ -51,6 +192,8 @@ class rebuild_record:
 # "build_static_lib" = compile and link a static library (.lib/.a)
 # "build_shared_lib" = compile and link a shared library (.dll/.so)
 # "build_application" = compile and link a program (.exe)
+# "build_target" = compile and link a "target" description
+# "build_changed" = rebuild a "target" given a list of changed files
 
 # The derived compiler classes need to directly implement the "host",
 # "target_family" and "target_proc" methods. They also must implement the
@@ -69,8 +212,61 @@ class compiler:
     link_module_type_shared = 0
     link_module_type_application = 1
 
+    # Why a source needs to be compiled (see get_rebuild_reason).
+    rebuild_reason_object_missing = 'object missing'
+    rebuild_reason_output_missing = 'output missing'
+    rebuild_reason_source_newer = 'source newer'
+    rebuild_reason_input_newer = 'input newer'
+    rebuild_reason_deps_missing = 'dependencies missing'
+    rebuild_reason_header_newer = 'header newer'
+    rebuild_reason_header_missing = 'header missing'
+    rebuild_reason_changed = 'changed'
+
+    # Why a target needs to be linked (see get_link_reason).
+    link_reason_output_missing = 'output missing'
+    link_reason_objects_rebuilt = 'objects rebuilt'
+    link_reason_no_libraries = 'no libraries to check'
+    link_reason_library_newer = 'library newer'
+    link_reason_library_missing = 'library missing'
+
+    # Build options common to all compilers (see get_option):
+    # "auto_pch" = precompile the headers most sources include (see autopch.py)
+    # "ram_intermediates" = a RAM backed directory (/dev/shm, say) to keep the
+    #     intermediates directories in, or None (see ramdir.py); a single value, as
+    #     it applies to every config
+    # "ram_intermediates_limit" = the most space, in bytes, the intermediates
+    #     directories in RAM may take up; targets that do not fit stay on disk
+    # "header_fingerprints" = only count a header that is newer than an object as
+    #     a change if its tokens changed, not just its comments or white space
+    #     (see fingerprints.py)
+    # "header_fingerprint_lines" = with header_fingerprints, count lines added or
+    #     removed as a change too, for __LINE__ and debug information
+    auto_pch = False
+    ram_intermediates = None
+    ram_intermediates_limit = 1024 * 1024 * 1024
+    header_fingerprints = False
+    header_fingerprint_lines = True
+
+    # The name given to the builds recorded in each target's compile time history
+    # (see regressions.py), such as the commit being built, or None.
+    history_label = None
+
+    log_file = None
+    console_file = None
+    dep_graph = None
+    timings = None
+    fingerprints = None
+    stat_cache = None
+    deferred_jobs = None
+    job_budget = None
+    launcher = None
+    intermediates_dirs = None
+    record_dirs = None
+    event_hooks = None
+    metrics = None
+
     def print_console(self, string):
-        print(string)
+        print(string, file=self.console_file)
 
     def print_log(self, string):
         if self.log_file:
@@ -82,182 +278,694 @@ class compiler:
 
     def handle_error(self, error_string):
         self.print_both(error_string)
+        self.count(telemetry.counter_errors)
+        self.fire_event(telemetry.event_error, message=error_string)
         raise cplusplus_error(error_string)
 
-    def invoke(self, command_line):
+    def add_event_hook(self, hook):
+        # hook is called with a telemetry.build_event for everything that happens.
+        if self.event_hooks is None:
+            self.event_hooks = []
+        self.event_hooks.append(hook)
+
+    def fire_event(self, name, **fields):
+        if self.event_hooks:
+            event = telemetry.build_event(name, fields)
+            for hook in self.event_hooks:
+                hook(event)
+
+    def count(self, counter, amount=1):
+        if self.metrics is not None:
+            self.metrics.increment(counter, amount)
+
+    def report_invoke_end(self, command_line, elapsed, i):
+        self.count(telemetry.counter_invocations)
+        self.count(telemetry.counter_invoke_seconds, elapsed)
+        self.fire_event(telemetry.event_invoke_end, argv=command_line, elapsed=elapsed,
+                        return_val=i.return_val if i is not None else None)
+
+    def report_link_up_to_date(self, link_path):
+        self.print_both("%s is up to date" % os.path.basename(link_path))
+        self.count(telemetry.counter_links_skipped)
+        self.fire_event(telemetry.event_link_skip, output=link_path)
+
+    def invoke(self, command_line, job_count=1):
+        # The command runs once "job_count" jobs are free in the job budget. Callers that
+        # have already taken jobs from the budget for it pass 0.
         command_line_string = ' '.join(command_line)
         self.print_log(command_line_string)
-        proc = subprocess.Popen(
-            shlex.split(command_line_string),
-            shell=False,
-            stdin=None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True
-            )
-        console_out = proc.communicate()
-        return (invoke_result(proc.returncode, console_out[0], console_out[1]))
-
-    def build_object_code(self, name, output_dir, config, source_list, include_list, define_list):
-        object_code_dir = os.path.join(output_dir, name + '.intermediates', 'obj')
-        if not os.path.exists(object_code_dir):
-            os.makedirs(object_code_dir)
-
-        dep_dir = os.path.join(output_dir, name + '.intermediates', 'dep')
-        if not os.path.exists(dep_dir):
-            os.makedirs(dep_dir)
-
-        # Do a source file update time check to figure out if which source files, if any
-        # have been updated since the last compile.
+        budget = self.get_job_budget()
+        job_count = budget.acquire(job_count)     # No more than the budget holds
+        self.fire_event(telemetry.event_invoke_start, argv=command_line)
+        start = time.time()
+        i = None
+        try:
+            i = self.run_command(command_line_string)
+            return i
+        finally:
+            budget.release(job_count)
+            self.report_invoke_end(command_line, time.time() - start, i)
+
+    def run_command(self, command_line_string):
+        # No logging here; this may be called from a deferred job's thread. Child
+        # processes get the jobserver, if the job budget is one.
+        env, pass_fds = self.get_job_budget().get_child_settings()
+        tool_environment = self.get_tool_environment()
+        if tool_environment:
+            env = dict(env if env is not None else os.environ)
+            env.update(tool_environment)
+        return_val, stdout = self.get_launcher().run(shlex.split(command_line_string), env, pass_fds)
+        return (invoke_result(return_val, stdout, None))
+
+    def get_tool_environment(self):
+        # Environment variables to set for every tool run, on top of our own.
+        return {}
+
+    def get_identity(self):
+        # A string that changes whenever the compiler does (see jit.py).
+        return self.__class__.__name__
+
+    def record_compile_time(self, source, seconds):
+        if self.timings is not None:
+            self.timings.set_compile_time(source, seconds)
+
+    def record_history(self, built_list):
+        # Add the compiles of this build to the target's history: how long each took,
+        # the size of its object and the headers it included.
+        entries = {}
+        for r in built_list:
+            seconds = self.timings.get_build_compile_time(r.source)
+            if seconds is None:
+                continue
+            size = os.path.getsize(r.obj) if os.path.isfile(r.obj) else None
+            headers = tuple(self.dep_graph.get_deps(r.source)) if self.dep_graph is not None else ()
+            entries[os.path.abspath(r.source)] = build_history_entry(seconds, size, headers)
+        self.timings.add_build(self.history_label, entries)
+
+    def get_job_budget(self):
+        if self.job_budget is not None:
+            return self.job_budget
+        return get_default_budget()
+
+    def get_launcher(self):
+        if self.launcher is not None:
+            return self.launcher
+        return get_default_launcher()
+
+    def invoke_parallel(self, invocation_list):
+        # Run the invocations concurrently, as many at once as the job budget allows.
+        # If an on_result callback raises (through handle_error, say), nothing new is
+        # started, the running invocations are waited for and the error is re-raised.
+        budget = self.get_job_budget()
+        results = queue.Queue()
+        running = [0]
+
+        def run(inv, command_line_string):
+            start = time.time()
+            try:
+                results.put((inv, self.run_command(command_line_string), None, time.time() - start))
+            except Exception as e:
+                results.put((inv, None, e, 0))
+            finally:
+                budget.release()
+
+        def handle(inv, i, exception, elapsed):
+            running[0] -= 1
+            self.report_invoke_end(inv.command_line, elapsed, i)
+            if exception is not None:
+                raise exception
+            inv.on_result(i)
+            if inv.source is not None:
+                self.record_compile_time(inv.source, elapsed)
+
+        try:
+            for inv in invocation_list:
+                while not results.empty():
+                    handle(*results.get())
+                budget.acquire()
+                command_line_string = ' '.join(inv.command_line)
+                self.print_both(inv.message)
+                self.print_log(command_line_string)
+                self.fire_event(telemetry.event_invoke_start, argv=inv.command_line)
+                running[0] += 1
+                thread = threading.Thread(target=run, args=(inv, command_line_string))
+                thread.daemon = True
+                thread.start()
+            while running[0] > 0:
+                handle(*results.get())
+        except:
+            while running[0] > 0:
+                running[0] -= 1
+                results.get()
+            raise
+
+    def defer(self, key, function):
+        # Run function on a worker thread, off the build's critical path. "key" names
+        # the file the job works on; a new job for the same key, or anything about to
+        # overwrite that file, must wait_for_deferred(key) first. The function returns
+        # an error string, or None on success.
+        self.wait_for_deferred(key)
+        if self.deferred_jobs is None:
+            self.deferred_jobs = {}
+            atexit.register(self.wait_for_deferred_at_exit)
+        job = deferred_job(function)
+        job.start()
+        self.deferred_jobs[key] = job
+
+    def wait_for_deferred(self, key=None):
+        # Wait for one deferred job, or all of them, and report any errors.
+        if not self.deferred_jobs:
+            return
+        if key is None:
+            keys = list(self.deferred_jobs.keys())
+        elif key in self.deferred_jobs:
+            keys = [key]
+        else:
+            return
+        errors = []
+        for k in keys:
+            job = self.deferred_jobs.pop(k)
+            job.join()
+            if job.error:
+                errors.append(job.error)
+        if errors:
+            self.handle_error('\n'.join(errors))
+
+    def wait_for_deferred_at_exit(self):
+        # The error has been reported; the exit status is set once every other
+        # exit handler has run.
+        try:
+            self.wait_for_deferred()
+        except cplusplus_error:
+            deferred_job_failed[0] = True
+
+    def get_option(self, option, config):
+        # Build options are attributes of the compiler object. Each may be set to a
+        # single value, or to a dictionary of values keyed by config name.
+        value = getattr(self, option)
+        if isinstance(value, dict):
+            return value.get(config)
+        return value
+
+    def get_extra_outputs(self, r, config):
+        # Files, besides the object, that compiling a source file produces. A source
+        # file is rebuilt if any of them are missing.
+        return []
+
+    def get_extra_inputs(self, r, config):
+        # Files, besides the source and its headers, that compiling a source file
+        # reads when they exist (profiles, say). A source file is rebuilt if any of
+        # them are newer than the object.
+        return []
+
+    def get_source_mtime(self, path):
+        if self.stat_cache is not None:
+            if path in self.stat_cache.mtimes:
+                self.count(telemetry.counter_cache_hits)
+            else:
+                self.count(telemetry.counter_files_stated)
+            return self.stat_cache.getmtime(path)
+        self.count(telemetry.counter_files_stated)
+        return os.path.getmtime(path)
+
+    def get_intermediates_dir(self, name, output_dir):
+        disk_dir = os.path.join(output_dir, name + '.intermediates')
+        if not self.ram_intermediates:
+            return disk_dir
+        # Whether a target's intermediates go in RAM is decided once, the first time
+        # they are asked for.
+        key = (name, os.path.abspath(output_dir))
+        if self.intermediates_dirs is None:
+            self.intermediates_dirs = {}
+            self.record_dirs = None
+        intermediates_dir = self.intermediates_dirs.get(key)
+        if intermediates_dir is None:
+            intermediates_dir = self.choose_intermediates_dir(name, output_dir, disk_dir)
+            self.intermediates_dirs[key] = intermediates_dir
+        return intermediates_dir
+
+    def choose_intermediates_dir(self, name, output_dir, disk_dir):
+        # A target that did not fit in RAM once stays on disk, so its objects are
+        # not built all over again when room is made.
+        ram_dir = ramdir.get_ram_intermediates_dir(self.ram_intermediates, name, output_dir)
+        if os.path.isdir(ram_dir):
+            return ram_dir
+        if os.path.isfile(os.path.join(disk_dir, ramdir.fallback_file_name)):
+            return disk_dir
+        if ramdir.has_room(self.ram_intermediates, self.ram_intermediates_limit):
+            return ram_dir
+        self.print_log("no room for the intermediates of %s in %s; using %s" % (name, self.ram_intermediates, disk_dir))
+        return disk_dir
+
+    def get_record_dirs(self, name, output_dir):
+        # The object and dep directories of a target, each with a trailing separator,
+        # worked out once for all of its sources. Forgotten along with the
+        # intermediates directories.
+        key = (name, output_dir if os.path.isabs(output_dir) else os.path.abspath(output_dir))
+        if self.record_dirs is None or self.intermediates_dirs is None:
+            self.record_dirs = {}
+        record_dirs = self.record_dirs.get(key)
+        if record_dirs is None:
+            intermediates_dir = self.get_intermediates_dir(name, output_dir)
+            record_dirs = (os.path.join(intermediates_dir, 'obj', ''), os.path.join(intermediates_dir, 'dep', ''))
+            self.record_dirs[key] = record_dirs
+        return record_dirs
+
+    def get_rebuild_record(self, name, output_dir, source):
+        # Work out where the object and dep files for a source file live.
+        source_base_name, source_extension = os.path.splitext(os.path.basename(source))
+        object_details = self.object_details(source_extension)
+        obj_dir, dep_dir = self.get_record_dirs(name, output_dir)
+        return rebuild_record(source,
+                              obj_dir + source_base_name + object_details[compiler.object_details_extension_index],
+                              dep_dir + source_base_name + '.dep')
+
+    def make_intermediates_dirs(self, name, output_dir):
+        intermediates_dir = self.get_intermediates_dir(name, output_dir)
+        if self.ram_intermediates:
+            disk_dir = os.path.join(output_dir, name + '.intermediates')
+            if intermediates_dir != disk_dir and not os.path.exists(intermediates_dir):
+                # A new (or lost) RAM copy starts from what was written back.
+                ramdir.copy_metadata(disk_dir, intermediates_dir)
+            elif intermediates_dir == disk_dir:
+                fallback_path = os.path.join(disk_dir, ramdir.fallback_file_name)
+                if not os.path.isfile(fallback_path):
+                    if not os.path.exists(disk_dir):
+                        os.makedirs(disk_dir)
+                    open(fallback_path, 'w').close()
+        for sub_dir in ['obj', 'dep']:
+            full_dir = os.path.join(intermediates_dir, sub_dir)
+            if not os.path.exists(full_dir):
+                os.makedirs(full_dir)
+
+    def write_back_intermediates(self, name, output_dir):
+        # Keep a copy of the RAM copy's build metadata on disk.
+        if not self.ram_intermediates:
+            return
+        intermediates_dir = self.get_intermediates_dir(name, output_dir)
+        disk_dir = os.path.join(output_dir, name + '.intermediates')
+        if intermediates_dir != disk_dir and os.path.isdir(intermediates_dir):
+            ramdir.copy_metadata(intermediates_dir, disk_dir)
+
+    def get_dep_index_path(self, name, output_dir):
+        return os.path.join(self.get_intermediates_dir(name, output_dir), 'dep.index')
+
+    def load_dep_graph(self, name, output_dir):
+        graph = dependency_graph()
+        graph.load(self.get_dep_index_path(name, output_dir))
+        return graph
+
+    def save_dep_graph(self, name, output_dir, graph):
+        if graph.modified and os.path.isdir(self.get_intermediates_dir(name, output_dir)):
+            graph.save(self.get_dep_index_path(name, output_dir))
+
+    def get_timings_path(self, name, output_dir):
+        return os.path.join(self.get_intermediates_dir(name, output_dir), 'timings.json')
+
+    def load_timings(self, name, output_dir):
+        timings = build_timings()
+        timings.load(self.get_timings_path(name, output_dir))
+        return timings
+
+    def save_timings(self, name, output_dir, timings):
+        if timings.modified and os.path.isdir(self.get_intermediates_dir(name, output_dir)):
+            timings.save(self.get_timings_path(name, output_dir))
+
+    def get_fingerprints_path(self, name, output_dir):
+        return os.path.join(self.get_intermediates_dir(name, output_dir), 'fingerprints.json')
+
+    def load_fingerprints(self, name, output_dir, config):
+        # The target's header fingerprints, or None if the option is off.
+        if not self.get_option('header_fingerprints', config):
+            return None
+        fingerprints = header_fingerprints(self.get_option('header_fingerprint_lines', config))
+        fingerprints.load(self.get_fingerprints_path(name, output_dir))
+        return fingerprints
+
+    def save_fingerprints(self, name, output_dir, fingerprints):
+        if fingerprints is not None and fingerprints.modified and os.path.isdir(self.get_intermediates_dir(name, output_dir)):
+            fingerprints.save(self.get_fingerprints_path(name, output_dir))
+
+    def observe_headers(self, built_list):
+        # Fingerprint the headers the sources just compiled were compiled against.
+        for r in built_list:
+            if self.dep_graph is not None and self.dep_graph.has_source(r.source):
+                deps_list = self.dep_graph.get_deps(r.source)
+            elif os.path.isfile(r.dep):
+                with open(r.dep, 'r') as deps_file:
+                    deps_list = deps_file.read().splitlines()
+            else:
+                continue
+            for dep in deps_list:
+                try:
+                    self.fingerprints.observe(dep, self.get_source_mtime(dep))
+                except OSError:
+                    pass
+
+    def write_dep_file(self, r, header_list):
+        # Every .dep file is written through here so the target's dependency graph
+        # (and with it the reverse index) stays in step with the .dep files.
+        dep_text = '\n'.join(header_list)
+        with open(r.dep, 'w') as dep_file:
+            dep_file.write(dep_text)
+        self.count(telemetry.counter_bytes_written, len(dep_text))
+        if self.dep_graph is not None:
+            self.dep_graph.set_deps(r.source, header_list)
+
+    def get_rebuild_reason(self, name, output_dir, config, r):
+        # Do a source file update time check. Returns a (reason, path) tuple if the
+        # source file has been updated since the last compile, otherwise None and
+        # the list of headers the source depends on.
+        source = r.source
+        source_extension = os.path.splitext(source)[1]
+        object_details = self.object_details(source_extension)
+
+        if not os.path.exists(r.obj):
+            return ((compiler.rebuild_reason_object_missing, r.obj), None)
+        for extra in self.get_extra_outputs(r, config):
+            if not os.path.exists(extra):
+                return ((compiler.rebuild_reason_output_missing, extra), None)
+
+        obj_last_modified = os.path.getmtime(r.obj)
+        self.count(telemetry.counter_files_stated)
+        if self.get_source_mtime(source) >= obj_last_modified:
+            return ((compiler.rebuild_reason_source_newer, source), None)
+        for extra in self.get_extra_inputs(r, config):
+            if os.path.exists(extra) and os.path.getmtime(extra) >= obj_last_modified:
+                return ((compiler.rebuild_reason_input_newer, extra), None)
+        if not object_details[compiler.object_details_need_deps]:
+            return (None, [])
+        if not os.path.exists(r.dep):
+            return ((compiler.rebuild_reason_deps_missing, r.dep), None)
+
+        # Dep file: At this point, we know the source file exists, but is
+        # not out of date, and the dep file exists from a previous compile;
+        # it's still valid though, as the source file is not out of date.
+        # The dependency graph holds the same list if it is up to date.
+        if self.dep_graph is not None and self.dep_graph.has_source(source):
+            deps_list = self.dep_graph.get_deps(source)
+        else:
+            with open(r.dep, 'r') as deps_file:
+                deps_text = deps_file.read()
+                deps_list = deps_text.splitlines()
+            self.count(telemetry.counter_dep_files_read)
+        for dep in deps_list:
+            try:
+                dep_last_modified = self.get_source_mtime(dep)
+            except OSError:
+                # A header that is gone (or a generated header that
+                # was withdrawn); the source has to be compiled to
+                # find out what it includes now.
+                return ((compiler.rebuild_reason_header_missing, dep), None)
+            if dep_last_modified >= obj_last_modified:
+                if self.fingerprints is not None and self.fingerprints.is_unchanged(dep, dep_last_modified, obj_last_modified):
+                    continue
+                return ((compiler.rebuild_reason_header_newer, dep), None)
+        return (None, deps_list)
+
+    def check_for_rebuild(self, name, output_dir, config, source_list):
+        # Figure out which source files, if any, have been updated since the last
+        # compile. Each rebuild_record returned says why.
         rebuild_list = []
         for source in source_list:
-            source_split = os.path.split(source)
-            source_name_split = os.path.splitext(source_split[1])
-            source_base_name = source_name_split[0]
-            source_extension = source_name_split[1]
-
-            object_details = self.object_details(source_extension)
+            r = self.get_rebuild_record(name, output_dir, source)
+            reason, deps_list = self.get_rebuild_reason(name, output_dir, config, r)
+            if reason is not None:
+                r.reason, r.reason_path = reason
+                rebuild_list.append(r)
+            elif self.dep_graph is not None:
+                self.dep_graph.set_deps(source, deps_list)
+            self.fire_event(telemetry.event_rebuild_check, source=source, reason=r.reason, reason_path=r.reason_path)
+
+        return rebuild_list
+
+    def get_affected_records(self, t, changed_list, graph=None):
+        # Use the target's reverse index to find the objects a list of changed files
+        # affects, without looking at any time stamps. Returns None if the index does
+        # not cover every source file of the target (never built, a failed compile,
+        # etc...), in which case only the full update time check will do.
+        if graph is None:
+            graph = self.load_dep_graph(t.name, t.output_dir)
+        for source in t.source_list:
+            if not graph.has_source(source):
+                return None
+
+        affected = graph.get_affected_sources(changed_list)
+        rebuild_list = []
+        for source in t.source_list:
+            if os.path.abspath(source) in affected:
+                r = self.get_rebuild_record(t.name, t.output_dir, source)
+                r.reason = compiler.rebuild_reason_changed
+                rebuild_list.append(r)
+        return rebuild_list
 
-            source_obj_file_name = source_base_name + object_details[compiler.object_details_extension_index]
-            source_obj = os.path.join(object_code_dir, source_obj_file_name)
+    def build_object_code(self, name, output_dir, config, source_list, include_list, define_list, rebuild_list=None):
+        self.make_intermediates_dirs(name, output_dir)
 
-            source_dep_file_name = source_base_name + '.dep'
-            source_dep = os.path.join(dep_dir, source_dep_file_name)
+        # A change to the automatic precompiled header shows up as a changed header
+        # in the update time check.
+        if self.get_option('auto_pch', config):
+            self.update_auto_pch(name, output_dir, source_list)
 
-            rebuild = False
-            if not os.path.exists(source_obj):
-                rebuild = True
-            else:
-                obj_last_modified = os.path.getmtime(source_obj)
-                if os.path.getmtime(source) >= obj_last_modified:
-                    rebuild = True
-                elif object_details[compiler.object_details_need_deps]:
-                    if not os.path.exists(source_dep):
-                        rebuild = True
-                    else:
-                        # Dep file: At this point, we know the source file exists, but is
-                        # not out of date, and the dep file exists from a previous compile;
-                        # it's still valid though, as the source file is not out of date.
-                        with open(source_dep, 'r') as deps_file:
-                            deps_list = []
-                            deps_text = deps_file.read()
-                            deps_list += deps_text.splitlines()
-                            for dep in deps_list:
-                                if os.path.getmtime(dep) >= obj_last_modified:
-                                    rebuild = True
-                                    break
-
-            if rebuild:
-                rebuild_list.append(rebuild_record(source, source_obj, source_dep))
+        if rebuild_list is None:
+            rebuild_list = self.check_for_rebuild(name, output_dir, config, source_list)
 
         # Run the compiler.
         if len(rebuild_list) > 0:
-            self.compile(name, config, output_dir, rebuild_list, include_list, define_list)
+            # Sources being rebuilt leave the index until their new .dep file is written,
+            # so a failed compile forces a full update time check next time.
+            if self.dep_graph is not None:
+                for r in rebuild_list:
+                    self.dep_graph.remove_source(r.source)
+                self.save_dep_graph(name, output_dir, self.dep_graph)
+
+            rebuild_list = self.compile_object_code(name, output_dir, config, source_list, rebuild_list, include_list, define_list)
+            self.count(telemetry.counter_objects_rebuilt, len(rebuild_list))
+            self.count(telemetry.counter_objects_up_to_date, max(0, len(source_list) - len(rebuild_list)))
+            self.count(telemetry.counter_bytes_written,
+                       sum(os.path.getsize(r.obj) for r in rebuild_list if os.path.isfile(r.obj)))
+
+            # Sources that have no .dep file (resources, etc...) depend on nothing else.
+            if self.dep_graph is not None:
+                for r in rebuild_list:
+                    if not self.dep_graph.has_source(r.source):
+                        self.dep_graph.set_deps(r.source, [])
+            if self.timings is not None:
+                self.record_history(rebuild_list)
+            if self.fingerprints is not None:
+                self.observe_headers(rebuild_list)
             return True
         else:
             self.print_log("No source files have been updated; skipping compilation")
+            self.count(telemetry.counter_objects_up_to_date, len(source_list))
             return False
 
+    def compile_object_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list):
+        # Compile the sources in rebuild_list and return the records of every source
+        # compiled. Where sources depend on each other (C++20 modules) more may be
+        # compiled than was asked for.
+        self.compile(name, config, output_dir, list(rebuild_list), include_list, define_list)
+        return rebuild_list
+
+    def update_auto_pch(self, name, output_dir, source_list):
+        # A hand written precompiled header source takes precedence.
+        for source in source_list:
+            if os.path.splitext(os.path.basename(source))[0].lower() == 'precomp':
+                header_path = get_header_path(self, name, output_dir)
+                if os.path.isfile(header_path):
+                    os.remove(header_path)
+                return
+        dep_graph = self.dep_graph
+        if dep_graph is None:
+            dep_graph = self.load_dep_graph(name, output_dir)
+        update_auto_pch(self, name, output_dir, dep_graph, source_list)
+
+    def get_auto_pch_header(self, name, output_dir, config):
+        # The generated header to precompile and force include, or None.
+        if not self.get_option('auto_pch', config):
+            return None
+        header_path = get_header_path(self, name, output_dir)
+        if not os.path.isfile(header_path):
+            return None
+        return header_path
+
+    def get_link_reason(self, link_path, libpath_list, lib_list):
+        # Examine the libraries that will be linked in order to determine if a re-link
+        # is necessary. Returns a (reason, path) tuple, or None. The object code is
+        # up to date unless the caller has compiled some.
+        if not os.path.isfile(link_path):
+            return (compiler.link_reason_output_missing, link_path)
+        if len(lib_list) == 0:
+            return (compiler.link_reason_no_libraries, None)
+
+        link_last_modified = os.path.getmtime(link_path)
+        found_lib = False
+        # Each library has to be located in the search paths; libraries that are
+        # not (system libraries, say) are not checked.
+        for lib in lib_list:
+            current_lib_path = self.find_library(libpath_list, lib)
+            if current_lib_path is not None:
+                found_lib = True
+                if os.path.getmtime(current_lib_path) >= link_last_modified:
+                    return (compiler.link_reason_library_newer, current_lib_path)
+        if not found_lib:
+            return (compiler.link_reason_library_missing, None)
+        return None
+
+    def get_library_paths(self, libpath_list, lib):
+        # Every file a library in lib_list could be linked from, in the order they
+        # are looked for: in each search path, the static (or import) library, then
+        # the shared library.
+        lib_names = [self.get_lib_name(lib), self.get_link_name(lib, compiler.link_module_type_shared)]
+        return [os.path.join(path, lib_name) for path in libpath_list for lib_name in lib_names]
+
+    def find_library(self, libpath_list, lib):
+        for lib_path in self.get_library_paths(libpath_list, lib):
+            if os.path.isfile(lib_path):
+                return lib_path
+        return None
+
     def check_for_link_update(self, link_path, libpath_list, lib_list):
-        # Examine all of the object code and libraries that will be linked in order
-        # to determine if a re-link is necessary.
-        if (not os.path.isfile(link_path)) or (len(lib_list) == 0):
-            return True
+        reason = self.get_link_reason(link_path, libpath_list, lib_list)
+        if reason is not None and reason[0] == compiler.link_reason_library_missing:
+            self.handle_error("error: Could not stat library for time stamp check")
+        return reason is not None
+
+    def build_target(self, t, rebuild_list=None, dep_graph=None):
+        # Build a target. If rebuild_list is given, the source file update time check
+        # is skipped and exactly those rebuild_records are compiled before linking.
+        # The target's dependency graph is loaded from its index unless the caller
+        # already holds it in memory (see watch.py).
+        if not os.path.exists(t.output_dir):
+            os.makedirs(t.output_dir)
+        self.make_intermediates_dirs(t.name, t.output_dir)
+
+        if dep_graph is None:
+            dep_graph = self.load_dep_graph(t.name, t.output_dir)
+        self.dep_graph = dep_graph
+        timings = self.load_timings(t.name, t.output_dir)
+        self.timings = timings
+        fingerprints = self.load_fingerprints(t.name, t.output_dir, t.config)
+        self.fingerprints = fingerprints
+
+        log_file_name = os.path.join(t.output_dir, t.name + '.log')
+        self.fire_event(telemetry.event_build_start, target=t)
+        build_start = time.time()
+        succeeded = False
+        try:
+            with open(log_file_name, 'w+') as self.log_file:
+                self.print_both("-- Building %s %s -- " % (target.type_descriptions[t.target_type], t.name))
+
+                built_code = self.build_object_code(
+                    t.name,
+                    t.output_dir,
+                    t.config,
+                    t.source_list,
+                    t.include_list,
+                    t.define_list,
+                    rebuild_list
+                    )
+
+                # Only a link that wrote the output counts toward the link time.
+                output_path = self.get_output_path(t)
+                old_mtime = os.path.getmtime(output_path) if os.path.isfile(output_path) else None
+                start = time.time()
+                self.link_target(t, built_code)
+                if os.path.isfile(output_path) and os.path.getmtime(output_path) != old_mtime:
+                    timings.set_link_time(time.time() - start)
+                    self.count(telemetry.counter_bytes_written, os.path.getsize(output_path))
+                succeeded = True
+        finally:
+            self.log_file = None
+            self.dep_graph = None
+            self.timings = None
+            self.fingerprints = None
+            self.save_dep_graph(t.name, t.output_dir, dep_graph)
+            self.save_timings(t.name, t.output_dir, timings)
+            self.save_fingerprints(t.name, t.output_dir, fingerprints)
+            self.write_back_intermediates(t.name, t.output_dir)
+            self.fire_event(telemetry.event_build_end, target=t, succeeded=succeeded, elapsed=time.time() - build_start)
+
+    def build_changed(self, t, changed_list):
+        # Rebuild a target given the list of files known to have changed since its
+        # last build (from version control, say), skipping the update time check
+        # whenever the target's index allows it.
+        dep_graph = self.load_dep_graph(t.name, t.output_dir)
+        rebuild_list = self.get_affected_records(t, changed_list, dep_graph)
+        self.build_target(t, rebuild_list, dep_graph)
+
+    def get_output_path(self, t):
+        if t.target_type == target.type_static_lib:
+            return os.path.join(t.output_dir, self.get_lib_name(t.name))
+        elif t.target_type == target.type_shared_lib:
+            return os.path.join(t.output_dir, self.get_link_name(t.name, compiler.link_module_type_shared))
         else:
-            link_last_modified = os.path.getmtime(link_path)
-            lib_last_modified = None
-            # Each library has to be located in the search paths.
-            for lib in lib_list:
-                lib_name = self.get_lib_name(lib)
-                for path in libpath_list:
-                    current_lib_path = os.path.join(path, lib_name)
-                    if os.path.isfile(current_lib_path):
-                        lib_last_modified = os.path.getmtime(current_lib_path)
-                        break
-                if lib_last_modified:
-                    break
-            if lib_last_modified:
-                if lib_last_modified >= link_last_modified:
-                    return True
-                else:
-                    return False
-            else:
-                self.handle_error("error: Could not stat library for time stamp check")
+            return os.path.join(t.output_dir, self.get_link_name(t.name, compiler.link_module_type_application))
 
-    def build_static_lib(self, name, output_dir, config, source_list, include_list, define_list):
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        log_file_name = os.path.join(output_dir, name + '.log')
-        with open(log_file_name, 'w+') as self.log_file:
-            self.print_both("-- Building static library %s -- " % name)
-
-            built_code = self.build_object_code(
-                name,
-                output_dir,
-                config,
-                source_list,
-                include_list,
-                define_list
-                )
+    def link_target(self, t, built_code):
+        if t.target_type == target.type_static_lib:
             self.link_static_lib(
-                name,
-                output_dir,
-                config,
+                t.name,
+                t.output_dir,
+                t.config,
                 built_code
                 )
-        self.log_file = None
-
-    def build_shared_lib(self, name, output_dir, config, source_list, include_list, define_list, libpath_list, lib_list):
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        log_file_name = os.path.join(output_dir, name + '.log')
-        with open(log_file_name, 'w+') as self.log_file:
-            self.print_both("-- Building shared library %s -- " % name)
-
-            built_code = self.build_object_code(
-                name,
-                output_dir,
-                config,
-                source_list,
-                include_list,
-                define_list
-                )
+        elif t.target_type == target.type_shared_lib:
             self.link_module(
-                name,
-                output_dir,
-                config,
+                t.name,
+                t.output_dir,
+                t.config,
                 built_code,
                 compiler.link_module_type_shared,
-                libpath_list,
-                lib_list
-                )
-        self.log_file = None
-
-    def build_application(self, name, output_dir, config, source_list, include_list, define_list, libpath_list, lib_list):
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        log_file_name = os.path.join(output_dir, name + '.log')
-        with open(log_file_name, 'w+') as self.log_file:
-            self.print_both("-- Building application %s -- " % name)
-
-            built_code = self.build_object_code(
-                name,
-                output_dir,
-                config,
-                source_list,
-                include_list,
-                define_list
+                t.libpath_list,
+                t.lib_list
                 )
+        elif t.target_type == target.type_application:
             self.link_module(
-                name,
-                output_dir,
-                config,
+                t.name,
+                t.output_dir,
+                t.config,
                 built_code,
                 compiler.link_module_type_application,
-                libpath_list,
-                lib_list
+                t.libpath_list,
+                t.lib_list
                 )
-        self.log_file = None
+        else:
+            self.handle_error("error: invalid target type")
+
+    def build_static_lib(self, name, output_dir, config, source_list, include_list, define_list):
+        self.build_target(target(
+            target.type_static_lib,
+            name,
+            output_dir,
+            config,
+            source_list,
+            include_list,
+            define_list
+            ))
+
+    def build_shared_lib(self, name, output_dir, config, source_list, include_list, define_list, libpath_list, lib_list):
+        self.build_target(target(
+            target.type_shared_lib,
+            name,
+            output_dir,
+            config,
+            source_list,
+            include_list,
+            define_list,
+            libpath_list,
+            lib_list
+            ))
+
+    def build_application(self, name, output_dir, config, source_list, include_list, define_list, libpath_list, lib_list):
+        self.build_target(target(
+            target.type_application,
+            name,
+            output_dir,
+            config,
+            source_list,
+            include_list,
+            define_list,
+            libpath_list,
+            lib_list
+            ))
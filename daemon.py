@@ -0,0 +1,274 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from __future__ import print_function
+import os
+import sys
+import json
+import socket
+import argparse
+
+from . import get_compiler
+from .compiler import cplusplus_error
+from .compiler import stat_cache
+from .compiler import target
+from .compiler import target_to_dict
+from .compiler import target_from_dict
+from .watch import create_file_monitor
+
+# A resident build server. Detected compilers, a time stamp cache and the
+# dependency graph of every target built so far are kept in memory between
+# requests. A file monitor tells the server which files changed since the last
+# request, so a target with no changed inputs is reported up to date without
+# looking at the file system at all. Libraries a target links are watched too,
+# so one rebuilt outside the server still has the target relinked.
+#
+# The protocol is one JSON object per line over a Unix domain socket. The client
+# sends a single request:
+#   {"command": "build", "compiler": "linux_gcc_x64", "targets": [...]}
+#   {"command": "ping"} or {"command": "stop"}
+# and the server answers with any number of {"output": "..."} lines followed by
+# a final {"exit": code} line.
+
+exit_success = 0
+exit_build_error = 1
+exit_bad_request = 2
+
+# The errors that mean the client went away.
+try:
+    connection_errors = (BrokenPipeError, ConnectionResetError)
+except NameError:
+    connection_errors = (socket.error,)     # Python 2
+
+# Sends everything the compiler prints back to the client as it happens.
+class client_stream:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, text):
+        if text and text != '\n':
+            send_message(self.connection, {'output': text})
+
+    def flush(self):
+        pass
+
+def send_message(connection, message):
+    connection.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+def read_messages(connection):
+    pending = b''
+    while True:
+        data = connection.recv(65536)
+        if not data:
+            break
+        pending += data
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            yield json.loads(line.decode('utf-8'))
+
+# Everything the server remembers about one target between requests.
+class target_state:
+    def __init__(self, description, dep_graph, library_paths):
+        self.description = description
+        self.dep_graph = dep_graph
+        self.library_paths = library_paths
+        self.changed = set()
+        self.up_to_date = False
+
+class build_server:
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.compilers = {}
+        self.targets = {}
+        self.stat_cache = stat_cache()
+        self.monitor = create_file_monitor()
+
+    def get_compiler(self, compiler_name):
+        if not compiler_name in self.compilers:
+            c = get_compiler(compiler_name)
+            if c:
+                c.stat_cache = self.stat_cache
+            self.compilers[compiler_name] = c
+        return self.compilers[compiler_name]
+
+    def collect_changes(self):
+        changed = self.monitor.wait(0)
+        while changed:
+            self.stat_cache.invalidate(changed)
+            for state in self.targets.values():
+                state.changed.update(path for path in changed
+                                     if state.dep_graph.has_path(path) or path in state.library_paths)
+            changed = self.monitor.wait(0)
+
+    def get_library_paths(self, c, t):
+        # Every file each library could be linked from; a change to any of them is
+        # a change to the target. Static libraries link nothing.
+        library_paths = set()
+        if t.target_type != target.type_static_lib:
+            libpath_list = list(t.libpath_list) + list(c.builtin_libpath_list)
+            for lib in t.lib_list:
+                library_paths.update(os.path.abspath(lib_path) for lib_path in c.get_library_paths(libpath_list, lib))
+        return library_paths
+
+    def build(self, c, compiler_name, t):
+        key = (compiler_name, t.output_dir, t.name)
+        description = target_to_dict(t)
+        state = self.targets.get(key)
+        if state is None or state.description != description:
+            state = target_state(description, c.load_dep_graph(t.name, t.output_dir), self.get_library_paths(c, t))
+            self.targets[key] = state
+
+        if state.up_to_date and not state.changed and os.path.exists(c.get_output_path(t)):
+            c.print_console("%s is up to date" % os.path.basename(c.get_output_path(t)))
+            return
+
+        # Only the affected objects are compiled when the last build of this target
+        # succeeded; otherwise fall back to the full update time check.
+        rebuild_list = None
+        if state.up_to_date:
+            rebuild_list = c.get_affected_records(t, state.changed, state.dep_graph)
+
+        # The time stamps a failed build cached may be of files nothing watches yet,
+        # such as the headers of a source that did not compile, so they are dropped.
+        state.up_to_date = False
+        try:
+            c.build_target(t, rebuild_list, state.dep_graph)
+        except cplusplus_error:
+            self.stat_cache.invalidate()
+            raise
+        finally:
+            self.monitor.watch(state.dep_graph.get_paths())
+            self.monitor.watch(state.library_paths)
+        state.up_to_date = True
+        state.changed.clear()
+
+        # Anything linking this target by name has to check its link again.
+        for other in self.targets.values():
+            if t.name in other.description['lib_list']:
+                other.up_to_date = False
+
+    def handle_request(self, connection, request):
+        command = request.get('command')
+        if command == 'ping' or command == 'stop':
+            return exit_success
+        elif command != 'build':
+            send_message(connection, {'output': "error: unknown command %s" % command})
+            return exit_bad_request
+
+        compiler_name = request.get('compiler')
+        c = self.get_compiler(compiler_name)
+        if not c:
+            send_message(connection, {'output': "error: compiler %s not found" % compiler_name})
+            return exit_bad_request
+
+        self.collect_changes()
+        c.console_file = client_stream(connection)
+        try:
+            for d in request.get('targets', []):
+                self.build(c, compiler_name, target_from_dict(d))
+        except cplusplus_error:
+            return exit_build_error
+        finally:
+            c.console_file = None
+        return exit_success
+
+    def serve_connection(self, connection):
+        # Answer the request on a connection. The client always gets an exit code,
+        # whatever goes wrong, unless it is gone. Returns False after a stop request.
+        try:
+            for request in read_messages(connection):
+                try:
+                    exit_code = self.handle_request(connection, request)
+                except connection_errors:
+                    raise
+                except Exception as e:
+                    self.stat_cache.invalidate()
+                    send_message(connection, {'output': "error: %s" % e})
+                    exit_code = exit_build_error
+                send_message(connection, {'exit': exit_code})
+                return request.get('command') != 'stop'
+        except ValueError:
+            send_message(connection, {'output': "error: the request is not JSON"})
+            send_message(connection, {'exit': exit_bad_request})
+        return True
+
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        try:
+            running = True
+            while running:
+                connection = listener.accept()[0]
+                try:
+                    running = self.serve_connection(connection)
+                except connection_errors:
+                    pass
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+            self.monitor.close()
+            os.remove(self.socket_path)
+
+def send_request(socket_path, request, output_file=None):
+    # Send one request to a running server, echo its output as it arrives and
+    # return the exit code.
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    try:
+        send_message(connection, request)
+        for message in read_messages(connection):
+            if 'output' in message:
+                print(message['output'], file=output_file)
+            elif 'exit' in message:
+                return message['exit']
+    finally:
+        connection.close()
+    return exit_bad_request
+
+def request_build(socket_path, compiler_name, target_list, output_file=None):
+    return send_request(
+        socket_path,
+        {'command': 'build', 'compiler': compiler_name, 'targets': [target_to_dict(t) for t in target_list]},
+        output_file
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='pycplusplus build server')
+    parser.add_argument('socket', help='path of the Unix domain socket')
+    sub_parsers = parser.add_subparsers(dest='command')
+    sub_parsers.add_parser('serve', help='run the build server')
+    sub_parsers.add_parser('ping', help='check that the server is running')
+    sub_parsers.add_parser('stop', help='stop the server')
+    build_parser = sub_parsers.add_parser('build', help='build targets described in a JSON file')
+    build_parser.add_argument('compiler', help='compiler name, as returned by get_supported_compilers()')
+    build_parser.add_argument('targets', help='JSON file holding a list of target descriptions')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        build_server(args.socket).serve()
+        return exit_success
+    elif args.command == 'build':
+        with open(args.targets, 'r') as targets_file:
+            target_list = [target_from_dict(d) for d in json.load(targets_file)]
+        return request_build(args.socket, args.compiler, target_list)
+    else:
+        return send_request(args.socket, {'command': args.command})
+
+if __name__ == "__main__":
+    sys.exit(main())
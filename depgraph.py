@@ -0,0 +1,172 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import json
+
+try:
+    from sys import intern
+except ImportError:
+    pass    # A builtin in Python 2
+
+# An in-memory version of the information kept in the .dep files. Each source
+# file maps to the list of headers it includes, and each header maps back to
+# the set of source files that include it, so the sources affected by a change
+# can be found without opening any .dep files. All paths are stored absolute.
+#
+# The compiler keeps one graph per target up to date as it writes .dep files,
+# and saves it in the target's intermediates directory (see
+# compiler.load_dep_graph) so the reverse index survives between builds.
+#
+# Targets can have hundreds of thousands of sources, most of them including the
+# same few thousand headers, so every path is interned: each header's path is
+# held once however many sources include it. The reverse index is only built
+# once something asks for it; the update time check alone never does.
+class dependency_graph:
+    file_version = 2
+
+    def __init__(self):
+        self.source_deps = {}
+        self.dependents = None
+        self.absolute_paths = {}
+        self.modified = False
+
+    def get_absolute_path(self, path):
+        # Only paths that are already absolute are remembered; what a relative path
+        # refers to changes with the working directory.
+        absolute_path = self.absolute_paths.get(path)
+        if absolute_path is None:
+            absolute_path = intern(os.path.abspath(path))
+            if os.path.isabs(path):
+                self.absolute_paths[path] = absolute_path
+        return absolute_path
+
+    def get_dependents(self):
+        if self.dependents is None:
+            self.dependents = {}
+            for source, headers in self.source_deps.items():
+                for header in headers:
+                    self.dependents.setdefault(header, set()).add(source)
+        return self.dependents
+
+    def set_deps(self, source, header_list):
+        source = self.get_absolute_path(source)
+        headers = [self.get_absolute_path(header) for header in header_list]
+        if self.source_deps.get(source) == headers:
+            return
+        self.remove_source(source)
+        self.source_deps[source] = headers
+        if self.dependents is not None:
+            for header in headers:
+                self.dependents.setdefault(header, set()).add(source)
+        self.modified = True
+
+    def remove_source(self, source):
+        source = self.get_absolute_path(source)
+        if not source in self.source_deps:
+            return
+        headers = self.source_deps.pop(source)
+        if self.dependents is not None:
+            for header in headers:
+                sources = self.dependents.get(header)
+                if sources is not None:
+                    sources.discard(source)
+                    if len(sources) == 0:
+                        del self.dependents[header]
+        self.modified = True
+
+    def has_source(self, source):
+        return self.get_absolute_path(source) in self.source_deps
+
+    def get_deps(self, source):
+        return self.source_deps.get(self.get_absolute_path(source), [])
+
+    def get_affected_sources(self, changed_list):
+        dependents = self.get_dependents()
+        affected = set()
+        for changed in changed_list:
+            changed = self.get_absolute_path(changed)
+            if changed in self.source_deps:
+                affected.add(changed)
+            affected.update(dependents.get(changed, ()))
+        return affected
+
+    def has_path(self, path):
+        return path in self.source_deps or path in self.get_dependents()
+
+    def get_paths(self):
+        paths = set(self.source_deps)
+        paths.update(self.get_dependents())
+        return paths
+
+    def load(self, path):
+        # Fill in an empty graph. A missing or unreadable index just means an empty
+        # graph; the next full update time check fills it in again.
+        try:
+            with open(path, 'r') as index_file:
+                index = json.loads(index_file.read())
+        except (IOError, OSError, ValueError):
+            return False
+        if index.get('version') != dependency_graph.file_version:
+            return False
+        headers = [intern(header) for header in index['headers']]
+        for source, header_indexes in index['sources'].items():
+            self.source_deps[intern(source)] = [headers[header_index] for header_index in header_indexes]
+        self.dependents = None
+        self.modified = False
+        return True
+
+    def save(self, path):
+        # Each header is written once, and sources refer to headers by their index.
+        header_indexes = {}
+        sources = {}
+        for source, headers in self.source_deps.items():
+            sources[source] = [header_indexes.setdefault(header, len(header_indexes)) for header in headers]
+        index = {
+            'version': dependency_graph.file_version,
+            'headers': sorted(header_indexes, key=header_indexes.get),
+            'sources': sources
+            }
+        with open(path, 'w') as index_file:
+            index_file.write(json.dumps(index))
+        self.modified = False
+
+def get_affected_targets(compiler, target_list, changed_list):
+    # Map a list of changed files to the targets, and the objects within them,
+    # that have to be rebuilt. Returns a list of (target, rebuild_record list)
+    # tuples. A record list of None means the target's index is incomplete and
+    # the full update time check is needed. Targets that link a library target
+    # by name are affected (with no objects to rebuild) when that library is.
+    affected = []
+    affected_names = set()
+    for t in target_list:
+        rebuild_list = compiler.get_affected_records(t, changed_list)
+        if rebuild_list is None or len(rebuild_list) > 0:
+            affected.append((t, rebuild_list))
+            affected_names.add(t.name)
+
+    found_more = True
+    while found_more:
+        found_more = False
+        for t in target_list:
+            if not t.name in affected_names and affected_names.intersection(t.lib_list):
+                affected.append((t, []))
+                affected_names.add(t.name)
+                found_more = True
+
+    # Keep the order targets were given in, which is the order they build in.
+    order = dict((id(t), index) for index, t in enumerate(target_list))
+    affected.sort(key=lambda a: order[id(a[0])])
+    return affected
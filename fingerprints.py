@@ -0,0 +1,144 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import re
+import json
+import hashlib
+
+# Header fingerprints, for the compiler's "header_fingerprints" option. A header
+# that is newer than an object only makes the object out of date if the
+# header's tokens changed; editing a comment or re-indenting does not. The
+# fingerprint is a digest of the header's tokens, line by line, so line breaks
+# between tokens still count (line splices are kept as they are), and with line
+# numbers (the default) so do lines added or removed: __LINE__, assert and the
+# debug information all see them.
+#
+# A header's fingerprint is taken whenever it is seen with a new time stamp,
+# after compiling a source that includes it or when it turns out newer than an
+# object. Each target keeps the fingerprints its headers have had in its
+# intermediates directory (fingerprints.json); the version of a header an
+# object was compiled against is the last one seen before the object was
+# written. An object compiled against a version never seen is out of date.
+#
+# White space is kept in one place: between a macro's name and "(" in a
+# #define, where it makes the difference between a function-like macro and an
+# object-like one.
+#
+# Raw string literals are not understood; a header using them is just taken to
+# have changed a little more often than it did.
+
+fingerprint_file_version = 2
+version_limit = 16          # fingerprints kept per header
+
+comment_pattern = re.compile(r'//(?:[^\n\\]|\\.)*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+token_pattern = re.compile(
+    r'[A-Za-z_]\w*'                         # identifiers and keywords
+    r'|\.?\d(?:[eEpP][+-]|[\w.\'])*'        # numbers
+    r'|"(?:\\.|[^"\\])*"'                   # string literals
+    r"|'(?:\\.|[^'\\])*'"                   # character literals
+    r'|->\*?|<<=|>>=|\.\.\.|##|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^]=|::|\.\*'
+    r'|\S')
+function_macro_pattern = re.compile(r'^\s*#\s*define\s+[A-Za-z_]\w*\(')
+
+def remove_comment(comment_match):
+    # Comments become a space, keeping any line breaks; literals stay as they are.
+    text = comment_match.group(0)
+    if text[0] == '/':
+        return ' ' + '\n' * text.count('\n')
+    return text
+
+def get_fingerprint_text(text, lines=True):
+    # The header's tokens, one line of text per line that has any; with "lines",
+    # each starts with its line number.
+    text = comment_pattern.sub(remove_comment, text)
+    token_lines = []
+    for line_number, line in enumerate(text.split('\n')):
+        tokens = token_pattern.findall(line)
+        if function_macro_pattern.match(line):
+            tokens[2:4] = [tokens[2] + '(']     # #define F(x), not #define F (x)
+        if tokens:
+            if lines:
+                tokens.insert(0, '%d:' % line_number)
+            token_lines.append(' '.join(tokens))
+    return '\n'.join(token_lines)
+
+def get_fingerprint(path, lines=True):
+    with open(path, 'rb') as header_file:
+        text = header_file.read().decode('latin-1')
+    return hashlib.sha1(get_fingerprint_text(text, lines).encode('latin-1')).hexdigest()
+
+# The fingerprints of a target's headers. Header paths are as the compiler gives
+# them, which is absolute.
+class header_fingerprints:
+    def __init__(self, lines=True):
+        # Each header maps to [time stamp last seen, [[time stamp, fingerprint], ...]],
+        # with a new entry in the list each time the fingerprint changes.
+        self.lines = lines
+        self.headers = {}
+        self.modified = False
+
+    def observe(self, header, mtime):
+        # Note the header's fingerprint at its current time stamp, if it is new, and
+        # return it. None if the header can not be read.
+        entry = self.headers.get(header)
+        if entry is not None and entry[0] == mtime:
+            return entry[1][-1][1]
+        try:
+            fingerprint = get_fingerprint(header, self.lines)
+        except (IOError, OSError):
+            return None
+        if entry is None:
+            self.headers[header] = [mtime, [[mtime, fingerprint]]]
+        else:
+            entry[0] = mtime
+            versions = entry[1]
+            if versions[-1][1] != fingerprint:
+                versions.append([mtime, fingerprint])
+                del versions[:-version_limit]
+        self.modified = True
+        return fingerprint
+
+    def is_unchanged(self, header, mtime, since):
+        # True if the header, now at time stamp mtime, has the same fingerprint it
+        # had at time "since".
+        fingerprint = self.observe(header, mtime)
+        if fingerprint is None:
+            return False
+        for version_mtime, version_fingerprint in reversed(self.headers[header][1]):
+            if version_mtime <= since:
+                return version_fingerprint == fingerprint
+        return False
+
+    def load(self, path):
+        # Fingerprints taken with the other "lines" setting do not count.
+        try:
+            with open(path, 'r') as fingerprints_file:
+                fingerprints = json.load(fingerprints_file)
+        except (IOError, OSError, ValueError):
+            return False
+        if fingerprints.get('version') != fingerprint_file_version or fingerprints.get('lines') != self.lines:
+            return False
+        self.headers = fingerprints['headers']
+        self.modified = False
+        return True
+
+    def save(self, path):
+        with open(path, 'w') as fingerprints_file:
+            fingerprints_file.write(json.dumps({
+                'version': fingerprint_file_version,
+                'lines': self.lines,
+                'headers': self.headers
+                }))
+        self.modified = False
@@ -14,22 +14,162 @@
 #   limitations under the License.
 
 import os
+import time
 import copy
 import re
+import json
+import platform
 from .compiler import compiler
+from .compiler import invocation
+from .compiler import file_digest
+from .modules import build_module_code
+from .modules import get_mapper_path
+from .modules import read_p1689_file
+from . import telemetry
+
+def get_version_script(pattern_list):
+    # A version script exporting the symbols matching the patterns and nothing
+    # else. Patterns holding "::" are matched against demangled C++ names, the rest
+    # against symbol names as they are. A pattern with no wildcards is matched
+    # exactly, so it may hold spaces, as C++ argument lists do.
+    def quote(pattern):
+        if any(wildcard in pattern for wildcard in '*?['):
+            return pattern
+        return '"' + pattern + '"'
+    cpp_patterns = [pattern for pattern in pattern_list if '::' in pattern]
+    c_patterns = [pattern for pattern in pattern_list if not '::' in pattern]
+    lines = ['{']
+    if pattern_list:
+        lines.append('  global:')
+    if cpp_patterns:
+        lines.append('    extern "C++" {')
+        lines.extend('      %s;' % quote(pattern) for pattern in cpp_patterns)
+        lines.append('    };')
+    lines.extend('    %s;' % quote(pattern) for pattern in c_patterns)
+    lines.extend(['  local:', '    *;', '};', ''])
+    return '\n'.join(lines)
+
+def get_profile_path(r):
+    # gcc names the profile after the object.
+    return os.path.splitext(r.obj)[0] + '.gcda'
+
+def split_make_words(text):
+    # Split a make prerequisite list on whitespace, except where it is escaped.
+    words = re.findall(r'(?:\\.|[^\s\\])+', text)
+    return [word.replace('\\ ', ' ').replace('\\#', '#').replace('$$', '$') for word in words]
+
+def parse_make_rules(text):
+    # Returns a (target list, prerequisite list) tuple for each rule in a make
+    # dependency file. Order only prerequisites, special targets (.PHONY) and
+    # variable assignments are left out.
+    rules = []
+    for line in text.replace('\\\n', ' ').splitlines():
+        rule_targets, colon, prerequisites = line.partition(': ')
+        if not colon or rule_targets.startswith('.'):
+            continue
+        rules.append((split_make_words(rule_targets),
+                      [word for word in split_make_words(prerequisites.partition('|')[0]) if not word.endswith('.c++m')]))
+    return rules
+
+def get_unique_headers(r, header_list):
+    # Absolute header paths in include order, without duplicates or the source.
+    headers = []
+    unique_headers = set([os.path.abspath(r.source)])
+    for header in header_list:
+        abs_header = os.path.abspath(header)
+        if not abs_header in unique_headers:
+            unique_headers.add(abs_header)
+            headers.append(abs_header)
+    return headers
 
 class gcc(compiler):
-    def compile(self, name, config, output_dir, rebuild_list, include_list, define_list):
+    # Build options. Set these on the compiler object returned by get_compiler(),
+    # either to a single value or to a dictionary keyed by config name.
+    # "linker" = None for gcc's default, or 'bfd', 'gold', 'lld' or 'mold'
+    # "lto" = link time optimization; True, or the most link jobs to use
+    # "split_dwarf" = write debug information to .dwo files beside the objects
+    # "compress_debug_sections" = zlib compress the debug sections
+    # "strip_mode" = what to do with linked modules; see the strip_mode_ values
+    # "strip_in_background" = strip on a worker thread, overlapping whatever is built
+    #     next; the build_ methods then return before the stripped files are written,
+    #     so call wait_for_deferred() before using them (see compiler.defer)
+    # "modules" = compile C++ as C++20 with modules (see modules.py)
+    # "reproducible" = make the same sources build to the same bytes wherever they are
+    #     checked out (see get_reproducible_flags); this also fixes SOURCE_DATE_EPOCH
+    #     for every tool run, so it takes a single value rather than one per config;
+    #     it can not be combined with split_dwarf
+    # "source_root" = the directory reproducible builds record paths relative to;
+    #     None for the current directory
+    # "pgo_mode" = profile guided optimization; see the pgo_mode_ values and pgo.py
+    # "link_profile" = how shared libraries and applications are linked; see the
+    #     link_profile_ values
+    # "bind_now" = resolve every symbol when a module is loaded rather than on first
+    #     call (-z now); ELF targets only
+    # "gc_sections" = give each function and variable its own section, and have the
+    #     linker drop the ones nothing refers to
+    strip_mode_none = 0         # nothing
+    strip_mode_copy = 1         # write a stripped <name>_stripped copy
+    strip_mode_debuglink = 2    # as above, with the debug information in <name>.debug
+
+    pgo_mode_none = 0           # nothing
+    pgo_mode_generate = 1       # instrument the code to write a profile (<object name>.gcda) when run
+    pgo_mode_use = 2            # optimize each object with the profile beside it, where there is one
+
+    # link_profile_startup is for shared libraries that are loaded often or hold a
+    # lot of code. Symbols are hidden unless declared with default visibility, so
+    # the dynamic symbol table only holds the library's interface and calls within
+    # the library need no relocation; libraries nothing refers to are not made
+    # dependencies; and the symbol tables are hashed the GNU way, which is quicker
+    # to look up. It applies to ELF targets; elsewhere it is the default profile.
+    link_profile_default = 0    # every symbol exported, the linker's defaults
+    link_profile_startup = 1    # hidden visibility, --as-needed, -O1 and --hash-style=gnu
+
+    linker = None
+    lto = False
+    split_dwarf = False
+    compress_debug_sections = False
+    strip_mode = strip_mode_copy
+    strip_in_background = False
+    modules = False
+    reproducible = False
+    source_root = None
+    pgo_mode = pgo_mode_none
+    link_profile = link_profile_default
+    bind_now = False
+    gc_sections = False
+
+    # Shared library name to the version script to link it with, or to a list of
+    # symbol patterns to write one from (see get_version_script); ELF targets only.
+    # Only the symbols the script names are exported, which is as far as a library
+    # not written with visibility in mind can be narrowed.
+    export_maps = None
+
+    module_deps = None
+    p1689_support = {}
+
+    def get_compile_flags(self, config, include_list, define_list):
         compile_flags = ['-c',                 # compile only. No link on gcc/g++ invoke
                          '-Werror',            # treat warnings as errors
                          '-Wall',              # turn all all warnings
                          '-Wno-long-long',
                          '-g']                 # Produce debug output
+        if self.get_option('split_dwarf', config):
+            compile_flags.append('-gsplit-dwarf')     # Debug output goes to a .dwo beside the object
+        if self.get_option('compress_debug_sections', config):
+            compile_flags.append('-gz')               # Compress debug sections
         compile_flags.extend(self.target_compile_flags())
-        if config == 'debug':
-            compile_flags.append('-O0')      # Generate best possible code for debugging
-        else:
-            compile_flags.append('-Ofast')   # Generate fast code, including fastest floats
+        if self.get_option('link_profile', config) == gcc.link_profile_startup and self.target_family() == 'posix':
+            compile_flags.extend(['-fvisibility=hidden',            # Only export what is declared to be
+                                  '-fvisibility-inlines-hidden'])   # Nor inline member functions
+        if self.get_option('gc_sections', config):
+            compile_flags.extend(['-ffunction-sections',   # A section for each function
+                                  '-fdata-sections'])      # and each variable
+        compile_flags.extend(self.optimization_flags(config))
+        if self.get_option('lto', config):
+            compile_flags.append('-flto')    # Link time optimization; code is generated at link
+        if self.reproducible:
+            compile_flags.extend(self.get_reproducible_flags(config))
+        compile_flags.extend(self.get_pgo_flags(config))
 
         for define in define_list:
             compile_flags.append('-D' + define)
@@ -39,8 +179,87 @@ class gcc(compiler):
 
         for include_dir in self.builtin_include_list:
             compile_flags.append('-I' + self.prep_path(include_dir))
+        return compile_flags
+
+    def get_reproducible_flags(self, config):
+        # Paths under the source root are recorded relative to it, in debug information
+        # and in __FILE__ alike, as is the directory the compiler runs in. Later maps
+        # take precedence. Split DWARF is out: each object records the absolute path
+        # of its .dwo, which no prefix map reaches.
+        if self.get_option('split_dwarf', config):
+            self.handle_error("error: reproducible builds can not use split_dwarf")
+        working_dir = os.path.abspath(os.getcwd())
+        source_root = os.path.abspath(self.source_root or working_dir)
+        reproducible_flags = []
+        if source_root != working_dir:
+            reproducible_flags.append('-fdebug-prefix-map=' + self.prep_path(working_dir) + '=.')
+        reproducible_flags.append('-ffile-prefix-map=' + self.prep_path(source_root) + '=.')
+        return reproducible_flags
+
+    def get_identity(self):
+        return '%s %s %d' % (self.__class__.__name__, self.gpp, os.path.getmtime(self.gpp))
+
+    def get_pgo_flags(self, config):
+        pgo_mode = self.get_option('pgo_mode', config)
+        if pgo_mode == gcc.pgo_mode_generate:
+            return ['-fprofile-generate',
+                    '-fprofile-update=prefer-atomic']   # Threads do not lose counts
+        elif pgo_mode == gcc.pgo_mode_use:
+            return ['-fprofile-use',
+                    '-fprofile-partial-training',       # Code the training missed stays optimized for speed
+                    '-Wno-missing-profile',             # Not every source runs in training
+                    '-Wno-error=coverage-mismatch']     # Sources edited since the training still build
+        return []
+
+    def get_tool_environment(self):
+        # A fixed time for __DATE__ and __TIME__ (and anything else that honours
+        # SOURCE_DATE_EPOCH), taken from our own environment if it is set there.
+        if self.reproducible:
+            return {'SOURCE_DATE_EPOCH': os.environ.get('SOURCE_DATE_EPOCH', '0')}
+        return {}
+
+    def optimization_flags(self, config):
+        if config == 'debug':
+            return ['-O0']      # Generate best possible code for debugging
+        else:
+            return ['-Ofast']   # Generate fast code, including fastest floats
+
+    def get_language_command(self, name, output_dir, config, source_extension):
+        # The compiler to run for a source file, and its language standard.
+        if source_extension == '.c':
+            return [self.prep_path(self.gcc),
+                    '-std=gnu89']               # C 90 with GNU extensions
+        elif self.get_option('modules', config):
+            return [self.prep_path(self.gpp),
+                    '-std=gnu++20',             # C++ 20 with GNU extensions
+                    '-fmodules-ts',             # and modules
+                    '-fmodule-mapper=' + self.prep_path(get_mapper_path(self, name, output_dir))]
+        else:
+            return [self.prep_path(self.gpp),
+                    '-std=gnu++0x']             # C++ x11 with GNU extensions
+
+    def get_dep_flags(self, r, config):
+        # Have the compiler write the headers a source file includes to a temporary
+        # file, for process_dep_file. An empty list if the .dep file is written some
+        # other way.
+        return ['-MD -MF' + self.prep_path(r.dep + '.temp')]
+
+    def compile(self, name, config, output_dir, rebuild_list, include_list, define_list):
+        compile_flags = self.get_compile_flags(config, include_list, define_list)
+
+        # The automatic precompiled header goes ahead of every C++ source. gcc leaves
+        # the headers that came from it out of the source's dependencies, so they are
+        # added back from the precompiled header's own.
+        auto_pch_flags = []
+        auto_pch_deps = []
+        auto_pch_header = self.get_auto_pch_header(name, output_dir, config)
+        if auto_pch_header and not self.get_option('modules', config) and \
+           any(os.path.splitext(r.source)[1] == '.cpp' for r in rebuild_list):
+            auto_pch_deps = self.build_auto_pch(name, output_dir, config, auto_pch_header, compile_flags)
+            auto_pch_flags = ['-include ' + self.prep_path(auto_pch_header)]
 
         did_pch = False
+        compile_list = []
         for r in rebuild_list:
             source_split = os.path.split(r.source)
             source_name_split = os.path.splitext(source_split[1])
@@ -61,135 +280,233 @@ class gcc(compiler):
                 if not precomp_match:
                     self.handle_error("error: Can not parse precompiled header source file")
 
-                precompiled_header = precomp_match.group(1)
-                precompiled_header_split = os.path.split(precompiled_header)
-
-                new_include_dir = os.path.join(output_dir, name + '.intermediates', 'gch')
-
-                precompiled_output_dir = os.path.join(new_include_dir, name)
+                new_include_dir, precompiled_binary = self.get_precompiled_header_paths(name, output_dir, r)
+                precompiled_output_dir = os.path.dirname(precompiled_binary)
                 if not os.path.exists(precompiled_output_dir):
                     os.makedirs(precompiled_output_dir)
 
-                precompiled_binary = os.path.join(precompiled_output_dir, source_split[1] + '.gch')
-
-                if source_extension == '.c':
-                    invocation_flags = [self.prep_path(self.gcc),
-                                        '-std=gnu89']         # C 90 with GNU extensions
-                elif source_extension == '.cpp':
-                    invocation_flags = [self.prep_path(self.gpp),
-                                        '-std=gnu++0x']       # C++ x11 with GNU extensions
-                invocation_flags.extend(compile_flags)
-                invocation_flags.extend(['-o' + self.prep_path(precompiled_binary),
-                                         '-MD -MF' + self.prep_path(r.dep + '.temp'),
-                                         self.prep_path(r.source)])
+                invocation_flags = self.get_compile_command(
+                    name, output_dir, config, r, precompiled_binary, compile_flags,
+                    ['-MD -MF' + self.prep_path(r.dep + '.temp')])
 
                 # Run it
                 self.print_both("building precompiled header")
+                self.fire_event(telemetry.event_pch_build, source=r.source, output=precompiled_binary)
+                start = time.time()
                 i = self.invoke(invocation_flags)
                 if i.return_val != 0:
                     self.handle_error(i.stdout)
+                self.record_compile_time(r.source, time.time() - start)
 
-                self.process_dep_file(r.dep)
+                self.process_dep_file(r)
 
                 # A bit of a procedural hack; no o file is generated by the gcc precompiled header
                 # but we still want the dependency checking. So touch a 0 byte o file.
                 precomp_obj = open(r.obj, 'a')
                 precomp_obj.close()
 
-                # Do not compile the precompiled header source file again
-                rebuild_list.remove(r)
                 compile_flags.append('-I' + self.prep_path(new_include_dir))
                 did_pch = True
+            else:
+                compile_list.append(r)
 
-        for r in rebuild_list:
+        # The precompiled header source file is not compiled again.
+        invocation_list = []
+        for r in compile_list:
             source_split = os.path.split(r.source)
-            source_name_split = os.path.splitext(source_split[1])
-            source_base_name = source_name_split[0]
-            source_extension = source_name_split[1]
+            source_extension = os.path.splitext(source_split[1])[1]
+
+            dep_flags = self.get_dep_flags(r, config)
+            extra_deps = auto_pch_deps if source_extension == '.cpp' else []
+            source_flags = list(compile_flags)
+            if source_extension == '.cpp':
+                source_flags.extend(auto_pch_flags)
+            invocation_flags = self.get_compile_command(name, output_dir, config, r, r.obj, source_flags, dep_flags)
+
+            invocation_list.append(invocation(
+                "compiling %s" % source_split[1],
+                invocation_flags,
+                lambda i, r=r, dep_flags=dep_flags, extra_deps=extra_deps: self.handle_compile_result(i, r, len(dep_flags) > 0, extra_deps),
+                r.source
+                ))
+
+        # Run them
+        self.invoke_parallel(invocation_list)
+
+    def get_compile_command(self, name, output_dir, config, r, output_path, compile_flags, dep_flags):
+        # The command line that compiles one source file; shared by compile and the
+        # ninja file generator (see ninja.py).
+        source_extension = os.path.splitext(r.source)[1]
+        command_line = self.get_language_command(name, output_dir, config, source_extension)
+        command_line.extend(compile_flags)
+        if self.reproducible:
+            # Seeds the names gcc makes up (LTO, anonymous namespaces) from the file
+            # name instead of a random number.
+            command_line.append('-frandom-seed=' + os.path.basename(r.source))
+        command_line.append('-o' + self.prep_path(output_path))
+        command_line.extend(dep_flags)
+        command_line.append(self.prep_path(r.source))
+        return command_line
+
+    def get_precompiled_header_paths(self, name, output_dir, r):
+        # The include directory the precompiled header goes in, and the precompiled
+        # header itself.
+        new_include_dir = os.path.join(self.get_intermediates_dir(name, output_dir), 'gch')
+        return (new_include_dir, os.path.join(new_include_dir, name, os.path.basename(r.source) + '.gch'))
+
+    def build_auto_pch(self, name, output_dir, config, header, compile_flags):
+        # Precompile the generated header to <header>.gch, where gcc looks for it, unless
+        # the .gch is newer than everything it was built from. Returns the header and
+        # everything it includes.
+        gch_path = header + '.gch'
+        dep_path = header + '.dep'
+        if os.path.isfile(gch_path) and os.path.isfile(dep_path):
+            gch_last_modified = os.path.getmtime(gch_path)
+            with open(dep_path, 'r') as dep_file:
+                deps_list = [header] + dep_file.read().splitlines()
+            if all(os.path.isfile(dep) and os.path.getmtime(dep) < gch_last_modified for dep in deps_list):
+                return deps_list
+
+        invocation_flags = self.get_language_command(name, output_dir, config, '.cpp')
+        invocation_flags.extend(compile_flags)
+        invocation_flags.extend(['-x c++-header',
+                                 '-o' + self.prep_path(gch_path),
+                                 '-MD -MF' + self.prep_path(dep_path + '.temp'),
+                                 self.prep_path(header)])
+
+        self.print_both("building precompiled header")
+        self.fire_event(telemetry.event_pch_build, source=header, output=gch_path)
+        i = self.invoke(invocation_flags)
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
 
-            if source_extension == '.c':
-                invocation_flags = [self.prep_path(self.gcc),
-                                    '-std=gnu89']         # C 90 with GNU extensions
-            elif source_extension == '.cpp':
-                invocation_flags = [self.prep_path(self.gpp),
-                                    '-std=gnu++0x']       # C++ x11 with GNU extensions
-            invocation_flags.extend(compile_flags)
-            invocation_flags.extend(['-o' + self.prep_path(r.obj),
-                                     '-MD -MF' + self.prep_path(r.dep + '.temp'),
-                                     self.prep_path(r.source)])
-
-            # Run it
-            self.print_both("compiling %s" % source_split[1])
-            i = self.invoke(invocation_flags)
-            if i.return_val != 0:
-                self.handle_error(i.stdout)
-
-            self.process_dep_file(r.dep)
-
-    def process_dep_file(self, dep_path):
-        dep_temp_list = []
         with open(dep_path + '.temp', 'r') as dep_temp_file:
             dep_temp_text = dep_temp_file.read()
-            dep_temp_list = dep_temp_text.splitlines()
         os.remove(dep_path + '.temp')
+        deps_list = []
+        for rule_targets, prerequisites in parse_make_rules(dep_temp_text):
+            deps_list.extend(os.path.abspath(dep) for dep in prerequisites if os.path.abspath(dep) != header)
+        with open(dep_path, 'w') as dep_file:
+            dep_file.write('\n'.join(deps_list))
+        return [header] + deps_list
 
-        dep_temp_list = dep_temp_list[1:]
-        # Parse out the dependent header file information. Remmove duplicates.
-        headers = []
-        unique_headers = set()
-        for line in dep_temp_list:
-            # There may be multiple headers on a single line, parse out the quote
-            # delimted paths before the space delimted ones.
-            headers_in_line = []
-            line = line.strip(' \t\r\n\\')
-
-            first_quote = line.find('"', 0)
-            while first_quote != -1:
-                last_found = line.find('"', first_quote)
-                if last_found == -1:
-                    self.handle_error("error: mismatch quotes when parsing header list")
-                headers_in_line.append(line[first_quote:last_found])
-                del line[first_quote:last_quote]
-                first_quote = line.find('"', 0)
-
-            headers_in_line.extend(line.split())
-
-            for header in headers_in_line:
-                if len(header) > 0:
-                    abs_header = os.path.abspath(header)
-                    if not abs_header in unique_headers:
-                        unique_headers.add(abs_header)
-                        headers.append(abs_header)
+    def handle_compile_result(self, i, r, process_deps=True, extra_deps=[]):
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
 
-        with open(dep_path, 'w') as dep_file:
-            dep_file.write('\n'.join(headers))
+        if process_deps:
+            self.process_dep_file(r, extra_deps)
+
+    def process_dep_file(self, r, extra_deps=[]):
+        with open(r.dep + '.temp', 'r') as dep_temp_file:
+            dep_temp_text = dep_temp_file.read()
+        os.remove(r.dep + '.temp')
+
+        # Parse out the dependent header file information from the prerequisites of
+        # each make rule. Remove duplicates, and the source file itself. With modules,
+        # gcc also writes rules for the module names themselves (name.c++m) and the
+        # CMI; none of those are files to depend on.
+        headers = []
+        for rule_targets, prerequisites in parse_make_rules(dep_temp_text):
+            if not any(rule_target.endswith('.c++m') for rule_target in rule_targets):
+                headers.extend(prerequisites)
+        headers.extend(extra_deps)
+        headers = get_unique_headers(r, headers)
+
+        # Sources importing modules depend on their CMIs too.
+        if self.module_deps:
+            headers.extend(self.module_deps.get(r.source, []))
+
+        self.write_dep_file(r, headers)
+
+    def compile_object_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list):
+        if self.get_option('modules', config):
+            return build_module_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list)
+        return compiler.compile_object_code(self, name, output_dir, config, source_list, rebuild_list, include_list, define_list)
+
+    def supports_p1689(self):
+        # gcc 14 and later can write P1689 module dependency files from the
+        # preprocessor. Older ones need the built-in scanner.
+        if not self.gpp in gcc.p1689_support:
+            i = self.run_command(' '.join([self.prep_path(self.gpp),
+                                           '-std=gnu++20',
+                                           '-fmodules-ts',
+                                           '-E',
+                                           '-x c++',
+                                           '-fdeps-format=p1689r5',
+                                           '-fdeps-file=' + self.prep_path(os.devnull),
+                                           '-fdeps-target=probe.o',
+                                           '-o ' + self.prep_path(os.devnull),
+                                           self.prep_path(os.devnull)]))
+            gcc.p1689_support[self.gpp] = (i.return_val == 0)
+        return gcc.p1689_support[self.gpp]
+
+    def scan_p1689(self, name, output_dir, config, source_list, include_list, define_list):
+        # Preprocess each source to find the modules it provides and imports. Returns a
+        # dictionary of source path to modules.module_unit.
+        scan_flags = ['-std=gnu++20', '-fmodules-ts', '-E', '-fdeps-format=p1689r5']
+        for define in define_list:
+            scan_flags.append('-D' + define)
+        for include_dir in include_list + self.builtin_include_list:
+            scan_flags.append('-I' + self.prep_path(include_dir))
+
+        units = {}
+        invocation_list = []
+        for source in source_list:
+            r = self.get_rebuild_record(name, output_dir, source)
+            ddi_path = os.path.splitext(r.dep)[0] + '.ddi'
+            invocation_flags = [self.prep_path(self.gpp)]
+            invocation_flags.extend(scan_flags)
+            invocation_flags.extend(['-fdeps-file=' + self.prep_path(ddi_path),
+                                     '-fdeps-target=' + self.prep_path(r.obj),
+                                     '-o ' + self.prep_path(os.devnull),
+                                     self.prep_path(source)])
+            invocation_list.append(invocation(
+                "scanning %s" % os.path.basename(source),
+                invocation_flags,
+                lambda i, source=source, ddi_path=ddi_path: self.handle_scan_result(i, units, source, ddi_path)
+                ))
+        self.invoke_parallel(invocation_list)
+        return units
+
+    def handle_scan_result(self, i, units, source, ddi_path):
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
+        units[source] = read_p1689_file(ddi_path)
+        os.remove(ddi_path)
 
     def link_static_lib(self, name, output_dir, config, built_code):
         lib_name = self.get_lib_name(name)
         lib_path = os.path.join(output_dir, lib_name)
 
         if not built_code and os.path.isfile(lib_path):
-            self.print_both("%s is up to date" % lib_name)
+            self.report_link_up_to_date(lib_path)
             return
 
+        ar_flags = self.get_archive_command(config, lib_path, self.get_object_files(name, output_dir))
+
+        self.print_both("linking %s" % lib_name)
+        i = self.invoke(ar_flags)
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
+
+    def get_archive_command(self, config, lib_path, object_files):
         # r = replace existing or insert new file(s) into the archive
         # c = do not warn if the library had to be created
         # s = create an archive index (cf. ranlib)
-        ar_flags = [self.prep_path(self.ar), '-rcs']
+        # gcc-ar loads the LTO plugin so the archive index covers LTO objects.
+        # D = deterministic; zero time stamps, user and group ids in the archive
+        ar_options = '-rcsD' if self.reproducible else '-rcs'
+        if self.get_option('lto', config):
+            ar_flags = [self.prep_path(self.gcc_ar), ar_options]
+        else:
+            ar_flags = [self.prep_path(self.ar), ar_options]
 
         ar_flags.append(self.prep_path(lib_path))
 
-        object_code_dir = os.path.join(output_dir, name + '.intermediates', "obj")
-        for root, dirs, files in os.walk(object_code_dir, topdown=True):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                if os.path.getsize(full_path) > 0:
-                    ar_flags.append(self.prep_path(full_path))
-
-        self.print_both("linking %s" % lib_name)
-        i = self.invoke(ar_flags)
-        if i.return_val != 0:
-            self.handle_error(i.stdout)
+        for object_file in object_files:
+            ar_flags.append(self.prep_path(object_file))
+        return ar_flags
 
     def link_module(self, name, output_dir, config, built_code, link_module_type, libpath_list, lib_list):
         link_name = self.get_link_name(name, link_module_type)
@@ -197,12 +514,57 @@ class gcc(compiler):
         link_libpath_list = copy.copy(libpath_list)
         link_libpath_list.extend(self.builtin_libpath_list)
 
+        # A different export map needs a new link as much as new code does. The map a
+        # shared library was last linked with (its path and digest, or nothing) is
+        # kept beside it, so adding, removing or editing one relinks.
+        export_map = None
+        exports_stamp_path = None
+        if link_module_type == compiler.link_module_type_shared:
+            export_map = self.get_export_map(name, output_dir)
+            exports_stamp = ''
+            if export_map:
+                exports_stamp = '%s\n%s' % (os.path.abspath(export_map), file_digest(export_map))
+            exports_stamp_path = os.path.join(self.get_intermediates_dir(name, output_dir), 'exports.stamp')
+            last_exports_stamp = None
+            if os.path.isfile(exports_stamp_path):
+                with open(exports_stamp_path, 'r') as stamp_file:
+                    last_exports_stamp = stamp_file.read()
+            if last_exports_stamp != exports_stamp:
+                built_code = True
+
         if not built_code and not self.check_for_link_update(link_path, link_libpath_list, lib_list):
-            self.print_both("%s is up to date" % link_name)
+            self.report_link_up_to_date(link_path)
             return
 
+        # A strip of the previous link may still be reading the file.
+        self.wait_for_deferred(link_path)
+
+        ld_flags = self.get_link_command(config, link_module_type, link_path, link_libpath_list, lib_list,
+                                         self.get_object_files(name, output_dir))
+        if export_map:
+            ld_flags.append('-Wl,--version-script=' + self.prep_path(export_map))
+
+        budget = self.get_job_budget()
+        link_jobs = self.acquire_link_jobs(config, budget, ld_flags)
+        try:
+            self.print_both("linking %s" % link_name)
+            i = self.invoke(ld_flags, 0)
+        finally:
+            budget.release(link_jobs)
+        if i.return_val != 0:
+            self.handle_error(i.stdout)
+
+        if exports_stamp_path:
+            with open(exports_stamp_path, 'w') as stamp_file:
+                stamp_file.write(exports_stamp)
+
+        self.strip_module(name, output_dir, config, link_path)
+
+    def get_link_command(self, config, link_module_type, link_path, link_libpath_list, lib_list, object_files):
+        # Everything but the LTO job flags (see acquire_link_jobs).
         ld_flags = [self.prep_path(self.gpp)]
         ld_flags.extend(self.target_link_flags(link_module_type))
+        ld_flags.extend(self.linker_flags(config))
 
         for libpath_dir in link_libpath_list:
             ld_flags.append('-L' + self.prep_path(libpath_dir))
@@ -211,22 +573,110 @@ class gcc(compiler):
 
         ld_flags.append('-o ' + self.prep_path(link_path))
 
-        object_code_dir = os.path.join(output_dir, name + '.intermediates', "obj")
-        for root, dirs, files in os.walk(object_code_dir, topdown=True):
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                if os.path.getsize(full_path) > 0:
-                    ld_flags.append(self.prep_path(full_path))
+        for object_file in object_files:
+            ld_flags.append(self.prep_path(object_file))
 
         for lib in lib_list:
             ld_flags.append('-l' + lib)
+        return ld_flags
+
+    def get_export_map(self, name, output_dir):
+        # The version script for a shared library, or None if it has none. One written
+        # from a list of patterns goes in the intermediates directory, and is only
+        # rewritten when the patterns change.
+        export_map = self.export_maps.get(name) if self.export_maps else None
+        if export_map is None:
+            return None
+        if self.target_family() != 'posix':
+            self.handle_error("error: export maps are only supported for ELF targets")
+        if not isinstance(export_map, (list, tuple)):
+            if not os.path.isfile(export_map):
+                self.handle_error("error: export map %s not found" % export_map)
+            return export_map
+
+        intermediates_dir = self.get_intermediates_dir(name, output_dir)
+        if not os.path.exists(intermediates_dir):
+            os.makedirs(intermediates_dir)      # Ahead of the build, for a ninja file
+        map_path = os.path.join(intermediates_dir, 'exports.map')
+        map_text = get_version_script(export_map)
+        if os.path.isfile(map_path):
+            with open(map_path, 'r') as map_file:
+                if map_file.read() == map_text:
+                    return map_path
+        with open(map_path, 'w') as map_file:
+            map_file.write(map_text)
+        return map_path
+
+    def acquire_link_jobs(self, config, budget, ld_flags):
+        # The LTRANS stage of an LTO link runs in parallel; it gets as many jobs as the
+        # job budget has free. With a jobserver, gcc takes the extra jobs itself.
+        # Returns the number of jobs taken from the budget.
+        lto = self.get_option('lto', config)
+        if lto and budget.is_jobserver():
+            ld_flags.append('-flto=jobserver')
+            return budget.acquire()
+        elif lto:
+            link_jobs = budget.acquire_up_to(budget.job_count if lto is True else lto)
+            ld_flags.append('-flto=%d' % link_jobs)
+            return link_jobs
+        else:
+            return budget.acquire()
+
+    def get_unbudgeted_link_flags(self, config):
+        # The LTO job flags for a link run outside of the job budget (see ninja.py);
+        # gcc works out how many jobs to use itself.
+        if self.get_option('lto', config):
+            return ['-flto=auto']
+        return []
+
+    def strip_module(self, name, output_dir, config, link_path):
+        # Generate a stripped version next to the linked module; with
+        # strip_in_background, on a worker thread so the next target can carry on
+        # compiling. The strip is skipped if the linked module is byte for byte the
+        # same as the last time it was stripped.
+        strip_mode = self.get_option('strip_mode', config)
+        if strip_mode == gcc.strip_mode_none:
+            return
+        strip_outputs, strip_commands = self.get_strip_commands(config, link_path)
+
+        stamp_path = os.path.join(self.get_intermediates_dir(name, output_dir), 'strip.stamp')
+        strip_command_strings = [' '.join(command_line) for command_line in strip_commands]
+        for command_line_string in strip_command_strings:
+            self.print_log(command_line_string)
+
+        budget = self.get_job_budget()
+
+        def strip_job():
+            stamp = '%d\n%s' % (strip_mode, file_digest(link_path))
+            if all(os.path.isfile(output) for output in strip_outputs) and os.path.isfile(stamp_path):
+                with open(stamp_path, 'r') as stamp_file:
+                    if stamp_file.read() == stamp:
+                        return None
+            budget.acquire()
+            try:
+                for command_line_string in strip_command_strings:
+                    i = self.run_command(command_line_string)
+                    if i.return_val != 0:
+                        # A tool that fails silently still has to fail the job.
+                        return i.stdout or "error: %s exited with %d" % (command_line_string, i.return_val)
+            finally:
+                budget.release()
+            with open(stamp_path, 'w') as stamp_file:
+                stamp_file.write(stamp)
+            return None
+
+        if self.get_option('strip_in_background', config):
+            self.defer(link_path, strip_job)
+        else:
+            error = strip_job()
+            if error:
+                self.handle_error(error)
 
-        self.print_both("linking %s" % link_name)
-        i = self.invoke(ld_flags)
-        if i.return_val != 0:
-            self.handle_error(i.stdout)
+    def get_strip_commands(self, config, link_path):
+        # The files a strip makes from the linked module, and the command lines that
+        # make them, in order.
+        strip_mode = self.get_option('strip_mode', config)
 
-        # Now, generate a stripped version
         link_path_split = os.path.split(link_path)
         link_path_name_split = os.path.splitext(link_path_split[1])
 
@@ -234,13 +684,94 @@ class gcc(compiler):
             link_path_split[0],
             link_path_name_split[0] + '_stripped' + link_path_name_split[1]
             )
-        strip_flags = [self.prep_path(self.strip),
-                       '-o' + self.prep_path(stripped_path),
-                       self.prep_path(link_path)
-                      ]
-        i = self.invoke(strip_flags)
-        if i.return_val != 0:
-            self.handle_error(i.stdout)
+        if strip_mode == gcc.strip_mode_copy:
+            strip_outputs = [stripped_path]
+            strip_commands = [[self.prep_path(self.strip),
+                               '-o' + self.prep_path(stripped_path),
+                               self.prep_path(link_path)
+                              ]]
+        elif strip_mode == gcc.strip_mode_debuglink:
+            # The debug information goes in a separate .debug file, which the stripped
+            # module refers to by name.
+            debug_path = link_path + '.debug'
+            strip_outputs = [stripped_path, debug_path]
+            strip_commands = [[self.prep_path(self.objcopy),
+                               '--only-keep-debug',
+                               self.prep_path(link_path),
+                               self.prep_path(debug_path)
+                              ],
+                              [self.prep_path(self.objcopy),
+                               '--strip-all',
+                               '--add-gnu-debuglink=' + self.prep_path(debug_path),
+                               self.prep_path(link_path),
+                               self.prep_path(stripped_path)
+                              ]]
+        else:
+            self.handle_error("error: invalid strip mode")
+        return (strip_outputs, strip_commands)
+
+    def linker_flags(self, config):
+        link_flags = []
+        linker = self.get_option('linker', config)
+        if linker and not self.find_linker(linker):
+            self.print_both("warning: linker %s not found; using the default linker" % linker)
+            linker = None
+        if linker:
+            link_flags.append('-fuse-ld=' + linker)
+            if self.get_option('split_dwarf', config) and linker != 'bfd':
+                link_flags.append('-Wl,--gdb-index')   # Index the .dwo files for the debugger
+        if self.get_option('compress_debug_sections', config):
+            link_flags.append('-gz')
+        if self.reproducible and self.target_family() == 'windows':
+            link_flags.append('-Wl,--no-insert-timestamp')   # PE headers hold the link time otherwise
+        if self.get_option('pgo_mode', config) == gcc.pgo_mode_generate:
+            link_flags.append('-fprofile-generate')          # Links the profiling runtime
+        if self.target_family() == 'posix':
+            if self.get_option('link_profile', config) == gcc.link_profile_startup:
+                link_flags.extend(['-Wl,--as-needed',        # Only depend on libraries that are used
+                                   '-Wl,-O1',                # Optimize the hash tables
+                                   '-Wl,--hash-style=gnu'])  # GNU hash tables; no lookups in the wrong library
+            if self.get_option('bind_now', config):
+                link_flags.append('-Wl,-z,now')              # Resolve every symbol at load time
+        if self.get_option('gc_sections', config):
+            link_flags.append('-Wl,--gc-sections')           # Drop the sections nothing refers to
+        return link_flags
+
+    def find_linker(self, linker):
+        # gcc's -fuse-ld=<linker> runs ld.<linker> from the PATH.
+        for path in os.environ['PATH'].split(os.pathsep):
+            for file_name in ['ld.' + linker, 'ld.' + linker + '.exe']:
+                if os.path.isfile(os.path.join(path, file_name)):
+                    return True
+        return False
+
+    def get_object_files(self, name, output_dir):
+        # Only the object files; the obj directory also holds .dwo files and the 0 byte
+        # placeholder for the precompiled header source. In a consistent order, so the
+        # same objects always link the same way.
+        object_files = []
+        object_code_dir = os.path.join(self.get_intermediates_dir(name, output_dir), 'obj')
+        for root, dirs, files in os.walk(object_code_dir, topdown=True):
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                if os.path.splitext(filename)[1] == '.o' and os.path.getsize(full_path) > 0:
+                    object_files.append(full_path)
+        return sorted(object_files)
+
+    def get_extra_outputs(self, r, config):
+        source_name_split = os.path.splitext(os.path.basename(r.source))
+        if self.get_option('split_dwarf', config) and \
+           source_name_split[1] in ['.c', '.cpp'] and \
+           source_name_split[0].lower() != 'precomp':
+            return [os.path.splitext(r.obj)[0] + '.dwo']
+        return []
+
+    def get_extra_inputs(self, r, config):
+        if self.get_option('pgo_mode', config) == gcc.pgo_mode_use:
+            source_name_split = os.path.splitext(os.path.basename(r.source))
+            if source_name_split[1] in ['.c', '.cpp'] and source_name_split[0].lower() != 'precomp':
+                return [get_profile_path(r)]
+        return []
 
     def get_lib_name(self, name):
         return 'lib' + name + '.a'
@@ -287,7 +818,9 @@ class mingw_x86(gcc):
         self.gpp = os.path.join(self.bin_path, 'mingw32-g++.exe')
         self.windres = os.path.join(self.bin_path, 'windres.exe')
         self.ar = os.path.join(self.bin_path, 'ar.exe')
+        self.gcc_ar = os.path.join(self.bin_path, 'gcc-ar.exe')
         self.strip = os.path.join(self.bin_path, 'strip.exe')
+        self.objcopy = os.path.join(self.bin_path, 'objcopy.exe')
         return True
 
     def compile(self, name, config, output_dir, rebuild_list, include_list, define_list):
@@ -305,6 +838,7 @@ class mingw_x86(gcc):
             windres_flags.append('-I"' + include_dir + '"')
 
         did_rc = False
+        compile_list = []
         for r in rebuild_list:
             source_split = os.path.split(r.source)
             source_name_split = os.path.splitext(source_split[1])
@@ -325,10 +859,11 @@ class mingw_x86(gcc):
                 if i.return_val != 0:
                     self.handle_error(i.stdout)
 
-                rebuild_list.remove(r)
                 did_rc = True
+            else:
+                compile_list.append(r)
 
-        gcc.compile(self, name, config, output_dir, rebuild_list, include_list, define_list)
+        gcc.compile(self, name, config, output_dir, compile_list, include_list, define_list)
 
     def get_link_name(self, name, link_module_type):
         if link_module_type == compiler.link_module_type_shared:
@@ -391,7 +926,9 @@ class linux_gcc(gcc):
         self.gcc = os.path.join(self.bin_path, 'gcc')
         self.gpp = os.path.join(self.bin_path, 'g++')
         self.ar = os.path.join(self.bin_path, 'ar')
+        self.gcc_ar = os.path.join(self.bin_path, 'gcc-ar')
         self.strip = os.path.join(self.bin_path, 'strip')
+        self.objcopy = os.path.join(self.bin_path, 'objcopy')
         return True
 
     def get_link_name(self, name, link_module_type):
@@ -417,9 +954,66 @@ class linux_gcc_x86(linux_gcc):
         return link_flags
 
 class linux_gcc_x64(linux_gcc):
+    # Build options, as for gcc, plus:
+    # "march" = the x86-64 microarchitecture level to build for (one of march_levels),
+    #     'native' for the CPU of the building host, or None for SSE3 tuned for any
+    #     CPU; a single value, as it applies to every config (see variants.py to
+    #     build several)
+    march_levels = ['x86-64', 'x86-64-v2', 'x86-64-v3', 'x86-64-v4']
+    march = None
+
+    # What -march=native means on each host is found once and kept here.
+    native_march_cache_path = os.path.join(os.path.expanduser('~'), '.cache', 'pycplusplus', 'native-march.json')
+    native_marches = {}
+
+    def target_proc(self):
+        return 'x64'
+
     def target_compile_flags(self):
-        # TODO: Instruction set/tuning flags here
-        return ['-m64 -mtune=generic', '-msse2', '-msse3', '-mfpmath=sse', '-fpic']
+        if not self.march:
+            return ['-m64 -mtune=generic', '-msse2', '-msse3', '-mfpmath=sse', '-fpic']
+        if self.march == 'native':
+            march = self.get_native_march()
+        elif self.march in linux_gcc_x64.march_levels:
+            march = self.march
+        else:
+            self.handle_error("error: unknown microarchitecture level %s" % self.march)
+        return ['-m64', '-march=' + march, '-mfpmath=sse', '-fpic']
+
+    def get_native_march(self):
+        # The CPU name -march=native stands for, so command lines (and logs) say what
+        # was built for. Cached by host name and compiler, in memory and on disk.
+        key = '%s %s %d' % (platform.node(), self.gcc, os.path.getmtime(self.gcc))
+        march = linux_gcc_x64.native_marches.get(key)
+        if march:
+            return march
+        try:
+            with open(linux_gcc_x64.native_march_cache_path, 'r') as cache_file:
+                linux_gcc_x64.native_marches.update(json.load(cache_file))
+        except (IOError, OSError, ValueError):
+            pass
+        march = linux_gcc_x64.native_marches.get(key)
+        if march:
+            return march
+
+        march = self.detect_native_march()
+        linux_gcc_x64.native_marches[key] = march
+        try:
+            cache_dir = os.path.dirname(linux_gcc_x64.native_march_cache_path)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(linux_gcc_x64.native_march_cache_path, 'w') as cache_file:
+                json.dump(linux_gcc_x64.native_marches, cache_file)
+        except (IOError, OSError):
+            pass
+        return march
+
+    def detect_native_march(self):
+        i = self.run_command(' '.join([self.prep_path(self.gcc), '-march=native', '-Q', '--help=target']))
+        march_match = re.search(r'^\s*-march=\s+(\S+)\s*$', i.stdout, re.MULTILINE)
+        if i.return_val != 0 or not march_match:
+            self.handle_error("error: could not find out what -march=native means on this host")
+        return march_match.group(1)
 
     def target_link_flags(self, link_module_type):
         link_flags = ['-m64']
@@ -0,0 +1,230 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import io
+import copy
+import time
+import shutil
+import ctypes
+import hashlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from . import get_compiler
+from . import get_supported_compilers
+from .compiler import compiler
+
+# Compiles C++ source text into a shared library and loads it with ctypes:
+#   lib = jit.load_source('extern "C" int add(int a, int b) { return a + b; }')
+#   lib.add(1, 2)
+# Libraries are kept in a cache directory, one directory per key, where the key
+# is a digest of the source, the compiler flags and the compiler itself. Loading
+# a library already in the cache does not run the compiler; loading one already
+# loaded by this process does not touch the file system either. When the cache
+# grows past its size limit, the libraries used least recently are removed.
+# Processes share the cache: each key is built under a lock (in .locks), into a
+# temporary directory that is renamed into place, so a library is only ever
+# seen whole. Loading holds .evict.lock shared and eviction holds it
+# exclusively, so a library is never removed between being found and loaded.
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'pycplusplus', 'jit')
+default_cache_limit = 256 * 1024 * 1024     # bytes
+
+library_name = 'kernel'
+
+# Detected compilers, and the libraries loaded so far, by key and by the
+# arguments they were loaded with.
+compilers = {}
+loaded = {}
+loaded_requests = {}
+
+class cache_lock:
+    # A lock on a file, held across processes; exclusive unless "shared". Windows
+    # has no shared locks, so there every lock is exclusive.
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        else:
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.lock_file.close()
+        self.lock_file = None
+
+def get_jit_compiler(compiler_name):
+    # The first compiler found that targets this Python's architecture, unless one
+    # is named. Detected once; JIT builds do not strip, and print nothing unless
+    # they fail.
+    c = compilers.get(compiler_name)
+    if c is None:
+        detected = None
+        if compiler_name is not None:
+            detected = get_compiler(compiler_name)
+        else:
+            target_proc = 'x64' if ctypes.sizeof(ctypes.c_void_p) == 8 else 'x86'
+            for supported_name in get_supported_compilers():
+                detected = get_compiler(supported_name)
+                if detected and detected.target_proc() == target_proc:
+                    break
+                detected = None
+        if not detected:
+            raise OSError("no compiler %s found for the JIT" % (compiler_name or ''))
+        c = copy.copy(detected)
+        c.deferred_jobs = None
+        if hasattr(c, 'strip_mode'):
+            c.strip_mode = c.strip_mode_none
+        compilers[compiler_name] = c
+    return c
+
+def get_key(c, source_text, config, include_list, define_list):
+    digest = hashlib.sha1()
+    digest.update(source_text.encode('utf-8'))
+    for part in [c.get_identity(), config] + c.get_compile_flags(config, include_list, define_list):
+        digest.update(b'\0' + part.encode('utf-8'))
+    return digest.hexdigest()
+
+def get_cache_size(cache_dir):
+    # A list of (last use, size, path) tuples, one per library in the cache.
+    entries = []
+    for entry_name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, entry_name)
+        if not os.path.isdir(entry_dir) or entry_name.startswith('.'):
+            continue
+        size = 0
+        last_used = 0
+        for root, dirs, files in os.walk(entry_dir):
+            for filename in files:
+                try:
+                    file_stat = os.stat(os.path.join(root, filename))
+                except OSError:
+                    continue
+                size += file_stat.st_size
+                last_used = max(last_used, file_stat.st_mtime)
+        entries.append((last_used, size, entry_dir))
+    return entries
+
+def evict(cache_dir, cache_limit, keep_dir=None):
+    # Remove the libraries used least recently until the cache fits its limit.
+    # Processes that have a removed library loaded keep it.
+    with cache_lock(os.path.join(cache_dir, '.evict.lock')):
+        entries = sorted(get_cache_size(cache_dir))
+        total = sum(size for last_used, size, entry_dir in entries)
+        for last_used, size, entry_dir in entries:
+            if total <= cache_limit:
+                break
+            if entry_dir == keep_dir:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+def build_library(c, key, entry_dir, source_text, config, include_list, define_list):
+    # Build in a directory of our own and rename it into place.
+    build_dir = '%s.%d.build' % (entry_dir, os.getpid())
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    source_path = os.path.join(build_dir, library_name + '.cpp')
+    with open(source_path, 'w') as source_file:
+        source_file.write(source_text)
+
+    build_compiler = copy.copy(c)
+    build_compiler.console_file = io.StringIO() if str is not bytes else io.BytesIO()
+    try:
+        build_compiler.build_shared_lib(library_name, build_dir, config, [source_path],
+                                        include_list, define_list, [], [])
+        build_compiler.wait_for_deferred()
+        # Only the library and its source are kept.
+        shutil.rmtree(build_compiler.get_intermediates_dir(library_name, build_dir), ignore_errors=True)
+        try:
+            os.rename(build_dir, entry_dir)
+        except OSError:
+            # Built by another process at the same time.
+            if not os.path.isdir(entry_dir):
+                raise
+    finally:
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+def load_source(source_text, compiler_name=None, config='release', include_list=None, define_list=None,
+                cache_dir=None, cache_limit=default_cache_limit):
+    # Returns a ctypes.CDLL for the source. Raises cplusplus_error if it does not
+    # compile, with the compiler's output.
+    include_list = [os.path.abspath(include_dir) for include_dir in (include_list or [])]
+    define_list = list(define_list or [])
+    request = (compiler_name, config, tuple(include_list), tuple(define_list), source_text)
+    lib = loaded_requests.get(request)
+    if lib is not None:
+        return lib
+
+    c = get_jit_compiler(compiler_name)
+    key = get_key(c, source_text, config, include_list, define_list)
+    lib = loaded.get(key)
+    if lib is not None:
+        loaded_requests[request] = lib
+        return lib
+
+    cache_dir = os.path.abspath(cache_dir or default_cache_dir)
+    entry_dir = os.path.join(cache_dir, key)
+    lib_path = os.path.join(entry_dir, c.get_link_name(library_name, compiler.link_module_type_shared))
+    lock_dir = os.path.join(cache_dir, '.locks')
+    if not os.path.exists(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            if not os.path.isdir(lock_dir):
+                raise
+
+    # Once loaded, the library can be removed; the process keeps it.
+    built = False
+    with cache_lock(os.path.join(cache_dir, '.evict.lock'), shared=True):
+        if not os.path.isfile(lib_path):
+            with cache_lock(os.path.join(lock_dir, key)):
+                if not os.path.isfile(lib_path):
+                    build_library(c, key, entry_dir, source_text, config, include_list, define_list)
+                    built = True
+        else:
+            # Mark it used, for eviction.
+            now = time.time()
+            os.utime(lib_path, (now, now))
+        lib = ctypes.CDLL(lib_path)
+    if built:
+        evict(cache_dir, cache_limit, entry_dir)
+
+    loaded[key] = lib
+    loaded_requests[request] = lib
+    return lib
+
+def load_file(path, **options):
+    # As load_source, for a source file; the key is the file's contents.
+    with open(path, 'r') as source_file:
+        return load_source(source_file.read(), **options)
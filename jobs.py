@@ -0,0 +1,234 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import re
+import errno
+import select
+import atexit
+import tempfile
+import threading
+import multiprocessing
+
+# A build-wide limit on the number of jobs (tool processes, or threads within
+# them) running at once. Every compiler shares the default budget unless given
+# its own, so parallel compiles and the parallel parts of a link (LTO) draw from
+# the same pool and can not oversubscribe the machine between them.
+class job_budget:
+    def __init__(self, job_count=None):
+        if job_count is None:
+            try:
+                job_count = multiprocessing.cpu_count()
+            except NotImplementedError:
+                job_count = 1
+        self.job_count = max(1, job_count)
+        self.available = self.job_count
+        self.condition = threading.Condition()
+
+    def acquire(self, count=1):
+        # Block until "count" jobs are free.
+        if count == 0:
+            return 0
+        count = min(count, self.job_count)
+        with self.condition:
+            while self.available < count:
+                self.condition.wait()
+            self.available -= count
+        return count
+
+    def acquire_up_to(self, count):
+        # Block until at least one job is free, then take as many as are free, up to
+        # "count". Returns the number taken.
+        with self.condition:
+            while self.available < 1:
+                self.condition.wait()
+            taken = max(1, min(count, self.available))
+            self.available -= taken
+        return taken
+
+    def release(self, count=1):
+        if count == 0:
+            return
+        with self.condition:
+            self.available += count
+            self.condition.notify_all()
+
+    def get_child_settings(self):
+        # The environment (None to inherit ours) and file descriptors to pass to child
+        # processes.
+        return (None, ())
+
+    def is_jobserver(self):
+        return False
+
+# A budget backed by a GNU make jobserver: a pipe (or fifo) holding one byte per
+# job slot, shared by every process taking part in the build. Each process owns
+# one implicit slot; any other job it runs needs a byte read from the pipe, and
+# the byte is written back when the job finishes. The same budget serves as a
+# client of a jobserver inherited from make (connect_jobserver) or as the server
+# for our own child processes (start_jobserver); either way child processes get
+# the jobserver through MAKEFLAGS, so gcc's LTO and sub-makes share the limit.
+class jobserver_budget(job_budget):
+    def __init__(self, job_count, read_fd, write_fd, auth, pass_fds, nonblocking_read_fd=None):
+        job_budget.__init__(self, job_count)
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.nonblocking_read_fd = nonblocking_read_fd
+        self.auth = auth
+        self.pass_fds = pass_fds
+        self.implicit_free = True
+        self.tokens = []
+        self.lock = threading.Lock()
+
+    def read_token(self, blocking):
+        if not blocking:
+            if self.nonblocking_read_fd is not None:
+                try:
+                    return os.read(self.nonblocking_read_fd, 1)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return None
+                    raise
+            if not select.select([self.read_fd], [], [], 0)[0]:
+                return None
+        while True:
+            try:
+                return os.read(self.read_fd, 1)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    def take_token(self, blocking):
+        with self.lock:
+            if self.implicit_free:
+                self.implicit_free = False
+                return True
+        token = self.read_token(blocking)
+        if not token:
+            if blocking:
+                raise OSError(errno.EIO, "jobserver closed")
+            return False
+        with self.lock:
+            self.tokens.append(token)
+        return True
+
+    def acquire(self, count=1):
+        for index in range(count):
+            self.take_token(True)
+        return count
+
+    def acquire_up_to(self, count):
+        self.take_token(True)
+        taken = 1
+        while taken < count and self.take_token(False):
+            taken += 1
+        return taken
+
+    def release(self, count=1):
+        # Pipe tokens go back before the implicit one.
+        with self.lock:
+            for index in range(count):
+                if self.tokens:
+                    os.write(self.write_fd, self.tokens.pop())
+                else:
+                    self.implicit_free = True
+
+    def get_child_settings(self):
+        env = dict(os.environ)
+        makeflags = re.sub(r'\s*--jobserver-(auth|fds)=\S+', '', env.get('MAKEFLAGS', ''))
+        makeflags = re.sub(r'(^|\s)-j\d*', '', makeflags)
+        env['MAKEFLAGS'] = ' -j%d --jobserver-auth=%s %s' % (self.job_count, self.auth, makeflags.strip())
+        return (env, self.pass_fds)
+
+    def is_jobserver(self):
+        return True
+
+def open_nonblocking(path, flags):
+    try:
+        return os.open(path, flags | os.O_NONBLOCK)
+    except OSError:
+        return None
+
+def connect_jobserver(makeflags=None):
+    # Join the jobserver of a parent make, as advertised in MAKEFLAGS. Returns None
+    # if there is none, or it can not be used (make did not pass the pipe on to us
+    # because the recipe is not marked with '+', or this is Windows).
+    if makeflags is None:
+        makeflags = os.environ.get('MAKEFLAGS', '')
+    auth_match = None
+    for auth_match in re.finditer(r'--jobserver-(?:auth|fds)=(\S+)', makeflags):
+        pass
+    if not auth_match or os.name != 'posix':
+        return None
+    auth = auth_match.group(1)
+
+    job_count = None
+    jobs_match = re.search(r'(?:^|\s)-j(\d+)', makeflags)
+    if jobs_match:
+        job_count = int(jobs_match.group(1))
+
+    if auth.startswith('fifo:'):
+        fifo_path = auth[len('fifo:'):]
+        try:
+            fd = os.open(fifo_path, os.O_RDWR)
+        except OSError:
+            return None
+        return jobserver_budget(job_count, fd, fd, auth, (), open_nonblocking(fifo_path, os.O_RDONLY))
+
+    fds_match = re.match(r'(\d+),(\d+)$', auth)
+    if not fds_match:
+        return None
+    read_fd = int(fds_match.group(1))
+    write_fd = int(fds_match.group(2))
+    try:
+        os.fstat(read_fd)
+        os.fstat(write_fd)
+    except OSError:
+        return None
+    # Re-opening the pipe through /proc gives a file description of our own that can
+    # be made non-blocking without affecting the other processes sharing the pipe.
+    nonblocking_read_fd = open_nonblocking('/proc/self/fd/%d' % read_fd, os.O_RDONLY)
+    return jobserver_budget(job_count, read_fd, write_fd, auth, (read_fd, write_fd), nonblocking_read_fd)
+
+def start_jobserver(job_count=None, use_fifo=False):
+    # Become the jobserver for our own child processes, with job_count slots in all
+    # (one of them our implicit slot), and make it the default budget.
+    job_count = job_budget(job_count).job_count
+    if use_fifo:
+        fifo_dir = tempfile.mkdtemp(prefix='pycplusplus-jobserver-')
+        fifo_path = os.path.join(fifo_dir, 'fifo')
+        os.mkfifo(fifo_path, 0o600)
+        atexit.register(lambda: (os.remove(fifo_path), os.rmdir(fifo_dir)))
+        read_fd = write_fd = os.open(fifo_path, os.O_RDWR)
+        budget = jobserver_budget(job_count, read_fd, write_fd, 'fifo:' + fifo_path, (), open_nonblocking(fifo_path, os.O_RDONLY))
+    else:
+        read_fd, write_fd = os.pipe()
+        budget = jobserver_budget(job_count, read_fd, write_fd, '%d,%d' % (read_fd, write_fd), (read_fd, write_fd),
+                                  open_nonblocking('/proc/self/fd/%d' % read_fd, os.O_RDONLY))
+    os.write(write_fd, b'+' * (job_count - 1))
+    set_default_budget(budget)
+    return budget
+
+default_budget = None
+
+def get_default_budget():
+    global default_budget
+    if default_budget is None:
+        default_budget = connect_jobserver() or job_budget()
+    return default_budget
+
+def set_default_budget(budget):
+    global default_budget
+    default_budget = budget
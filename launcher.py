@@ -0,0 +1,333 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import sys
+import json
+import errno
+import atexit
+import locale
+import struct
+import threading
+import subprocess
+from .jobs import get_default_budget
+
+# Launchers start the compiler, archiver, linker and strip processes for
+# compiler.run_command, and hand back their return code and output. Starting a
+# process from a Python process that has grown large (pycplusplus embedded in a
+# big service, say) can cost more than the tool run itself, so besides running
+# tools directly:
+#   spawn_launcher    uses posix_spawn, which does not copy the parent's address
+#                     space (glibc implements it with a vfork-style clone)
+#   server_launcher   a small helper process, started early while the parent is
+#                     still small, starts every tool and sends back the results
+#                     over a pipe
+# Every compiler shares the default launcher unless given its own.
+
+def decode_output(data):
+    # As subprocess does with universal_newlines.
+    text = data.decode(locale.getpreferredencoding(False))
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def get_return_val(status):
+    # As subprocess reports it: the exit code, or minus the signal that killed it.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def read_all(fd):
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+# Runs tools with subprocess, from this process.
+class direct_launcher:
+    def run(self, argv, env, pass_fds):
+        # Returns (return code, stdout and stderr text).
+        fd_args = {}
+        if pass_fds:
+            if sys.version_info[0] >= 3:
+                fd_args['pass_fds'] = pass_fds
+            else:
+                fd_args['close_fds'] = False
+        proc = subprocess.Popen(
+            argv,
+            shell=False,
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            env=env,
+            **fd_args
+            )
+        console_out = proc.communicate()
+        return (proc.returncode, console_out[0])
+
+# Runs tools with posix_spawn (Python 3.8 or later on POSIX; elsewhere, directly).
+class spawn_launcher:
+    def __init__(self):
+        self.fallback = direct_launcher()
+        # The passed file descriptors made inheritable for the spawns in progress,
+        # each with the number of spawns using it and whether it was inheritable
+        # before the first of them.
+        self.inherit_lock = threading.Lock()
+        self.inherited = {}
+
+    def inherit(self, pass_fds):
+        with self.inherit_lock:
+            for fd in pass_fds:
+                if not fd in self.inherited:
+                    self.inherited[fd] = [0, os.get_inheritable(fd)]
+                    os.set_inheritable(fd, True)
+                self.inherited[fd][0] += 1
+
+    def uninherit(self, pass_fds):
+        with self.inherit_lock:
+            for fd in pass_fds:
+                self.inherited[fd][0] -= 1
+                if self.inherited[fd][0] == 0:
+                    os.set_inheritable(fd, self.inherited.pop(fd)[1])
+
+    def run(self, argv, env, pass_fds):
+        if not hasattr(os, 'posix_spawnp'):
+            return self.fallback.run(argv, env, pass_fds)
+        # Our pipes are not inheritable, so only the file descriptors duplicated onto
+        # stdout and stderr, and those passed on purpose, reach the child; a tool
+        # started by another thread at the same time can not hold this pipe open.
+        # The passed ones are only inheritable while a spawn needs them.
+        self.inherit(pass_fds)
+        try:
+            read_fd, write_fd = os.pipe()
+            try:
+                pid = os.posix_spawnp(argv[0], argv, env if env is not None else os.environ,
+                                      file_actions=[(os.POSIX_SPAWN_DUP2, write_fd, 1),
+                                                    (os.POSIX_SPAWN_DUP2, write_fd, 2)])
+            except:
+                os.close(read_fd)
+                raise
+            finally:
+                os.close(write_fd)
+        finally:
+            self.uninherit(pass_fds)
+        try:
+            output = read_all(read_fd)
+        finally:
+            os.close(read_fd)
+        status = os.waitpid(pid, 0)[1]
+        return (get_return_val(status), decode_output(output))
+
+# The helper process run by server_launcher. It reads requests from one pipe and
+# writes replies to the other, each a frame of a JSON header and a byte payload
+# (a reply's payload is the tool's output), and runs each request on a thread of
+# its own so tools run as concurrently as the build asks for. It imports no more
+# than it needs, to stay small.
+server_source = r'''
+import os, sys, json, struct, threading, subprocess
+frame_header = struct.Struct('!II')
+requests = int(sys.argv[1])
+replies = int(sys.argv[2])
+reply_lock = threading.Lock()
+
+def read_exactly(size):
+    data = b''
+    while len(data) < size:
+        chunk = os.read(requests, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def send(header, payload):
+    header = json.dumps(header).encode('utf-8')
+    frame = frame_header.pack(len(header), len(payload)) + header + payload
+    with reply_lock:
+        while frame:
+            frame = frame[os.write(replies, frame):]
+
+def run(request):
+    reply = {'id': request['id']}
+    output = b''
+    try:
+        fd_args = {}
+        if request['pass_fds']:
+            if sys.version_info[0] >= 3:
+                fd_args['pass_fds'] = request['pass_fds']
+            else:
+                fd_args['close_fds'] = False
+        proc = subprocess.Popen(request['argv'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                env=request['env'], cwd=request['cwd'], **fd_args)
+        output = proc.communicate()[0]
+        reply['return_val'] = proc.returncode
+    except OSError as e:
+        reply['errno'] = e.errno
+        reply['error'] = str(e)
+    send(reply, output)
+
+while True:
+    frame = read_exactly(frame_header.size)
+    if frame is None:
+        break
+    header_size, payload_size = frame_header.unpack(frame)
+    request = json.loads(read_exactly(header_size).decode('utf-8'))
+    thread = threading.Thread(target=run, args=(request,))
+    thread.daemon = True
+    thread.start()
+'''
+
+frame_header = struct.Struct('!II')
+
+# Runs tools through the helper process. Tools that need file descriptors the
+# helper was not started with (a jobserver started after it) run directly. If the
+# helper goes away, tools already sent to it fail and later ones run directly.
+class server_launcher:
+    def __init__(self, pass_fds=(), python=None):
+        # "pass_fds" are file descriptors every tool may be given, like the pipe of a
+        # jobserver; the helper is started with them. "python" is the interpreter to
+        # run the helper with, if sys.executable is not one.
+        self.pass_fds = tuple(pass_fds)
+        self.fallback = direct_launcher()
+        self.write_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.replies = {}
+        self.next_id = 0
+        self.closed = False
+
+        request_read, self.request_fd = os.pipe()
+        self.reply_fd, reply_write = os.pipe()
+        helper_fds = (request_read, reply_write) + self.pass_fds
+        fd_args = {}
+        if sys.version_info[0] >= 3:
+            fd_args['pass_fds'] = helper_fds
+        else:
+            fd_args['close_fds'] = False
+        try:
+            self.proc = subprocess.Popen(
+                [python or sys.executable, '-S', '-c', server_source] + [str(fd) for fd in helper_fds],
+                shell=False,
+                stdin=None,
+                **fd_args
+                )
+        finally:
+            os.close(request_read)
+            os.close(reply_write)
+
+        self.reader = threading.Thread(target=self.read_replies)
+        self.reader.daemon = True
+        self.reader.start()
+        atexit.register(self.stop)
+
+    def read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = os.read(self.reply_fd, size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def read_replies(self):
+        try:
+            while True:
+                frame = self.read_exactly(frame_header.size)
+                if frame is None:
+                    break
+                header_size, payload_size = frame_header.unpack(frame)
+                header = self.read_exactly(header_size)
+                payload = self.read_exactly(payload_size) if payload_size else b''
+                if header is None or payload is None:
+                    break       # The helper went away part way through a reply.
+                header = json.loads(header.decode('utf-8'))
+                with self.condition:
+                    self.replies[header['id']] = (header, payload)
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            os.close(self.reply_fd)
+
+    def send(self, request):
+        header = json.dumps(request).encode('utf-8')
+        frame = frame_header.pack(len(header), 0) + header
+        with self.write_lock:
+            if self.request_fd is None:
+                raise OSError(errno.EPIPE, "the launch server was stopped")
+            while frame:
+                frame = frame[os.write(self.request_fd, frame):]
+
+    def run(self, argv, env, pass_fds):
+        if self.closed or not set(pass_fds) <= set(self.pass_fds):
+            return self.fallback.run(argv, env, pass_fds)
+        with self.condition:
+            request_id = self.next_id
+            self.next_id += 1
+        try:
+            self.send({'id': request_id,
+                       'argv': argv,
+                       'env': dict(env if env is not None else os.environ),
+                       'cwd': os.getcwd(),
+                       'pass_fds': list(pass_fds)})
+        except OSError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            return self.fallback.run(argv, env, pass_fds)
+
+        with self.condition:
+            while not request_id in self.replies:
+                if self.closed:
+                    raise OSError(errno.EPIPE, "the launch server exited while running %s" % argv[0])
+                self.condition.wait()
+            header, payload = self.replies.pop(request_id)
+        if 'errno' in header:
+            raise OSError(header['errno'], header['error'])
+        return (header['return_val'], decode_output(payload))
+
+    def stop(self):
+        # Closing the request pipe ends the helper once the tools it is running finish.
+        with self.write_lock:
+            if self.request_fd is None:
+                return
+            os.close(self.request_fd)
+            self.request_fd = None
+        self.proc.wait()
+        self.reader.join()
+        self.closed = True
+
+default_launcher = None
+
+def get_default_launcher():
+    global default_launcher
+    if default_launcher is None:
+        default_launcher = direct_launcher()
+    return default_launcher
+
+def set_default_launcher(launcher):
+    global default_launcher
+    default_launcher = launcher
+
+def start_launch_server(pass_fds=None, python=None):
+    # Start the helper process and make it the default launcher. Call this early,
+    # before the process grows, and after start_jobserver if there is to be one.
+    # Returns None on platforms without it (Windows).
+    if os.name != 'posix':
+        return None
+    if pass_fds is None:
+        pass_fds = get_default_budget().get_child_settings()[1]
+    launcher = server_launcher(pass_fds, python)
+    set_default_launcher(launcher)
+    return launcher
@@ -0,0 +1,115 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import sys
+import copy
+import time
+import threading
+
+from . import get_compiler
+from .compiler import cplusplus_error
+from .compiler import stat_cache
+
+# Builds the same list of targets for several configs and compilers at once.
+# Each (compiler, config) cell builds its targets in order on its own thread,
+# with its own copy of the compiler, into <output_dir>/<compiler>/<config>. All
+# cells draw their compiles from the same job budget, and share one time stamp
+# cache for the source tree, which does not change while the matrix builds.
+
+# The result of one cell of the matrix.
+class matrix_cell:
+    def __init__(self, compiler_name, config, target_list):
+        self.compiler_name = compiler_name
+        self.config = config
+        self.target_list = target_list
+        self.succeeded = False
+        self.error = None
+        self.elapsed = 0.0
+
+# Console output from several cells at once, one whole line at a time, each
+# tagged with the cell it came from.
+class cell_console:
+    lock = threading.Lock()
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def write(self, text):
+        if text and text != '\n':
+            with cell_console.lock:
+                for line in text.splitlines():
+                    sys.stdout.write(self.prefix + line + '\n')
+
+    def flush(self):
+        sys.stdout.flush()
+
+def get_cell_targets(target_list, compiler_name, config):
+    # Library paths that point at another target's output directory follow that
+    # target into the cell.
+    output_dirs = {}
+    for t in target_list:
+        output_dirs[os.path.abspath(t.output_dir)] = os.path.join(t.output_dir, compiler_name, config)
+
+    cell_target_list = []
+    for t in target_list:
+        cell_target = copy.copy(t)
+        cell_target.config = config
+        cell_target.output_dir = output_dirs[os.path.abspath(t.output_dir)]
+        cell_target.libpath_list = [output_dirs.get(os.path.abspath(libpath_dir), libpath_dir)
+                                    for libpath_dir in t.libpath_list]
+        cell_target_list.append(cell_target)
+    return cell_target_list
+
+def build_cell(c, cell):
+    start = time.time()
+    try:
+        for t in cell.target_list:
+            c.build_target(t)
+        c.wait_for_deferred()
+        cell.succeeded = True
+    except cplusplus_error as e:
+        cell.error = str(e)
+    except Exception as e:
+        # Anything else would end the thread with the cell looking built.
+        cell.error = "error: %s" % e
+    finally:
+        cell.elapsed = time.time() - start
+
+def build_matrix(target_list, config_list, compiler_name_list):
+    # Returns a list of matrix_cell results, one per (compiler, config) pair.
+    shared_stat_cache = stat_cache()
+    cell_list = []
+    thread_list = []
+    for compiler_name in compiler_name_list:
+        detected_compiler = get_compiler(compiler_name)
+        for config in config_list:
+            cell = matrix_cell(compiler_name, config, get_cell_targets(target_list, compiler_name, config))
+            cell_list.append(cell)
+            if not detected_compiler:
+                cell.error = "error: compiler %s not found" % compiler_name
+                continue
+
+            c = copy.copy(detected_compiler)
+            c.deferred_jobs = None
+            c.stat_cache = shared_stat_cache
+            c.console_file = cell_console('[%s %s] ' % (compiler_name, config))
+            thread = threading.Thread(target=build_cell, args=(c, cell))
+            thread.start()
+            thread_list.append(thread)
+
+    for thread in thread_list:
+        thread.join()
+    return cell_list
@@ -0,0 +1,285 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import re
+import json
+import hashlib
+
+# C++20 modules. Translation units that import a module can only be compiled
+# once the unit providing it has been compiled and has written its compiled
+# module interface (CMI). Sources are scanned for the modules they provide and
+# import, and compiled in waves: a unit builds in the wave after the last of the
+# units it imports from. Everything module related lives under the target's
+# intermediates directory:
+#   modules/scan.json   scan results, reused while a source is unchanged
+#   modules/cmi.json    the digest and time stamp of each CMI last written
+#   modules/mapper      module name to CMI path map, read by the compiler
+#   cmi/                the CMIs themselves
+#
+# Compilers write a new CMI every time an interface unit is compiled, even when
+# the interface is unchanged. A CMI whose contents did not change gets its old
+# time stamp back, so the units importing it are only compiled again when the
+# interface really changed.
+
+scan_file_version = 1
+
+# What a translation unit provides and imports. A unit "provides" a module if it
+# writes a CMI for it: interface units and partitions.
+class module_unit:
+    def __init__(self, provides=None, imports=None):
+        self.provides = provides
+        self.imports = imports if imports is not None else []
+
+comment_pattern = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+module_pattern = re.compile(r'^\s*(export\s+)?module\s+([\w.]+(?::[\w.]+)?)\s*(?:\[\[.*?\]\]\s*)?;', re.MULTILINE)
+import_pattern = re.compile(r'^\s*(?:export\s+)?import\s+(:?[\w.]+(?::[\w.]+)?)\s*(?:\[\[.*?\]\]\s*)?;', re.MULTILINE)
+
+def scan_source_text(text):
+    # The built-in scanner. Header units (import <header>;) are not supported, and
+    # module declarations and imports are expected outside of #if blocks.
+    text = comment_pattern.sub(' ', text)
+    unit = module_unit()
+    module_name = None
+    module_match = module_pattern.search(text)
+    if module_match:
+        module_name = module_match.group(2)
+        if module_match.group(1) or ':' in module_name:
+            unit.provides = module_name
+        else:
+            # An implementation unit implicitly imports its primary interface.
+            unit.imports.append(module_name)
+    for import_match in import_pattern.finditer(text):
+        imported = import_match.group(1)
+        if imported.startswith(':'):
+            # A partition of the module this unit belongs to.
+            if not module_name:
+                continue
+            imported = module_name.split(':')[0] + imported
+        if not imported in unit.imports:
+            unit.imports.append(imported)
+    return unit
+
+def scan_source(path):
+    with open(path, 'r') as source_file:
+        return scan_source_text(source_file.read())
+
+def read_p1689_file(path):
+    # Read the dependency information written by -fdeps-format=p1689r5.
+    with open(path, 'r') as p1689_file:
+        rules = json.load(p1689_file).get('rules', [])
+    unit = module_unit()
+    for rule in rules:
+        for provided in rule.get('provides', []):
+            unit.provides = provided['logical-name']
+        for required in rule.get('requires', []):
+            if not required['logical-name'] in unit.imports:
+                unit.imports.append(required['logical-name'])
+    return unit
+
+def get_modules_dir(c, name, output_dir):
+    return os.path.join(c.get_intermediates_dir(name, output_dir), 'modules')
+
+def get_cmi_dir(c, name, output_dir):
+    return os.path.join(c.get_intermediates_dir(name, output_dir), 'cmi')
+
+def get_mapper_path(c, name, output_dir):
+    return os.path.join(get_modules_dir(c, name, output_dir), 'mapper')
+
+def get_cmi_path(cmi_dir, module_name):
+    # Partition names hold a ':', which is not allowed in Windows file names.
+    return os.path.abspath(os.path.join(cmi_dir, module_name.replace(':', '-') + '.gcm'))
+
+def load_json(path):
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save_json(path, value):
+    with open(path, 'w') as json_file:
+        json.dump(value, json_file)
+
+# gcc's CMIs hold a README section with the time they were written.
+cmi_time_pattern = re.compile(br'(buildtime|localtime): [^\0]*')
+
+def get_cmi_digest(path):
+    # A digest of the CMI's contents, ignoring when it was written.
+    with open(path, 'rb') as cmi_file:
+        return hashlib.sha1(cmi_time_pattern.sub(b'', cmi_file.read())).hexdigest()
+
+def scan_sources(c, name, output_dir, config, source_list, include_list, define_list):
+    # Returns a dictionary of source path to module_unit. Sources are only scanned
+    # again once they change.
+    modules_dir = get_modules_dir(c, name, output_dir)
+    scan_path = os.path.join(modules_dir, 'scan.json')
+    scan_cache = load_json(scan_path)
+    if scan_cache.get('version') != scan_file_version:
+        scan_cache = {'version': scan_file_version, 'sources': {}}
+
+    units = {}
+    scan_list = []
+    for source in source_list:
+        if os.path.splitext(source)[1] != '.cpp':
+            units[source] = module_unit()
+            continue
+        mtime = c.get_source_mtime(source)
+        cached = scan_cache['sources'].get(os.path.abspath(source))
+        if cached and cached['mtime'] == mtime:
+            units[source] = module_unit(cached['provides'], cached['imports'])
+        else:
+            scan_list.append((source, mtime))
+
+    if scan_list:
+        if c.supports_p1689():
+            scanned = c.scan_p1689(name, output_dir, config, [source for source, mtime in scan_list], include_list, define_list)
+        else:
+            scanned = dict((source, scan_source(source)) for source, mtime in scan_list)
+        for source, mtime in scan_list:
+            unit = scanned[source]
+            units[source] = unit
+            scan_cache['sources'][os.path.abspath(source)] = {
+                'mtime': mtime,
+                'provides': unit.provides,
+                'imports': unit.imports
+                }
+        save_json(scan_path, scan_cache)
+    return units
+
+def write_mapper(path, cmi_paths):
+    # One "<module name> <CMI path>" line per module. Only written when it changes,
+    # so the file's time stamp means something.
+    mapper_text = ''.join('%s %s\n' % (module_name, cmi_paths[module_name]) for module_name in sorted(cmi_paths))
+    if os.path.isfile(path):
+        with open(path, 'r') as mapper_file:
+            if mapper_file.read() == mapper_text:
+                return
+    with open(path, 'w') as mapper_file:
+        mapper_file.write(mapper_text)
+
+def get_build_waves(c, source_list, units, providers):
+    # Number each source with the wave it builds in: 0 for units that import no
+    # module provided by this target, otherwise one more than the latest of the
+    # units providing its imports.
+    waves = {}
+    visiting = set()
+
+    def get_wave(source):
+        if source in waves:
+            return waves[source]
+        if source in visiting:
+            c.handle_error("error: module import cycle through %s" % source)
+        visiting.add(source)
+        wave = 0
+        for module_name in units[source].imports:
+            provider = providers.get(module_name)
+            if provider is not None and provider != source:
+                wave = max(wave, get_wave(provider) + 1)
+        visiting.discard(source)
+        waves[source] = wave
+        return wave
+
+    for source in source_list:
+        get_wave(source)
+    return waves
+
+def get_transitive_imports(units, providers, source):
+    # The modules a source imports, and those they import in turn; a CMI refers to
+    # the CMIs of the modules it imports, which are read along with it.
+    imported = []
+    pending = list(units[source].imports)
+    while pending:
+        module_name = pending.pop(0)
+        if module_name in imported or providers.get(module_name) == source:
+            continue
+        imported.append(module_name)
+        provider = providers.get(module_name)
+        if provider is not None:
+            pending.extend(units[provider].imports)
+    return imported
+
+def build_module_code(c, name, output_dir, config, source_list, rebuild_list, include_list, define_list):
+    # Compile the sources in rebuild_list, interfaces before their importers, and
+    # any importers of an interface whose CMI changed. Returns the records of every
+    # source compiled.
+    modules_dir = get_modules_dir(c, name, output_dir)
+    cmi_dir = get_cmi_dir(c, name, output_dir)
+    for full_dir in [modules_dir, cmi_dir]:
+        if not os.path.exists(full_dir):
+            os.makedirs(full_dir)
+
+    units = scan_sources(c, name, output_dir, config, source_list, include_list, define_list)
+
+    providers = {}
+    importers = {}
+    for source in source_list:
+        unit = units[source]
+        if unit.provides:
+            if unit.provides in providers:
+                c.handle_error("error: module %s is provided by both %s and %s" %
+                               (unit.provides, providers[unit.provides], source))
+            providers[unit.provides] = source
+    imported = dict((source, get_transitive_imports(units, providers, source)) for source in source_list)
+    for source in source_list:
+        for module_name in imported[source]:
+            importers.setdefault(module_name, []).append(source)
+
+    cmi_paths = dict((module_name, get_cmi_path(cmi_dir, module_name)) for module_name in providers)
+    write_mapper(get_mapper_path(c, name, output_dir), cmi_paths)
+    waves = get_build_waves(c, source_list, units, providers)
+
+    # Importers depend on the CMIs of the modules they import, directly or through
+    # another module's interface, as well as on their headers, so a CMI that
+    # changes outside of this build is noticed next time.
+    c.module_deps = {}
+    for source in source_list:
+        c.module_deps[source] = [cmi_paths[module_name] for module_name in imported[source]
+                                 if module_name in cmi_paths]
+
+    records = dict((r.source, r) for r in rebuild_list)
+    for module_name, source in providers.items():
+        if not source in records and not os.path.isfile(cmi_paths[module_name]):
+            records[source] = c.get_rebuild_record(name, output_dir, source)
+
+    cmi_path = os.path.join(modules_dir, 'cmi.json')
+    cmi_stamps = load_json(cmi_path)
+    built_list = []
+    try:
+        for wave in range(max(waves.values()) + 1 if waves else 0):
+            wave_list = [records[source] for source in source_list if waves[source] == wave and source in records]
+            if len(wave_list) == 0:
+                continue
+            c.compile(name, config, output_dir, list(wave_list), include_list, define_list)
+            built_list.extend(wave_list)
+
+            for r in wave_list:
+                module_name = units[r.source].provides
+                if not module_name:
+                    continue
+                module_cmi = cmi_paths[module_name]
+                digest = get_cmi_digest(module_cmi)
+                stamp = cmi_stamps.get(module_cmi)
+                if stamp and stamp[0] == digest:
+                    os.utime(module_cmi, (stamp[1], stamp[1]))
+                    continue
+                cmi_stamps[module_cmi] = [digest, os.path.getmtime(module_cmi)]
+                for importer in importers.get(module_name, []):
+                    if not importer in records:
+                        records[importer] = c.get_rebuild_record(name, output_dir, importer)
+    finally:
+        save_json(cmi_path, cmi_stamps)
+        c.module_deps = None
+    return built_list
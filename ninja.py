@@ -0,0 +1,210 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from __future__ import print_function
+import os
+import sys
+import copy
+import json
+import argparse
+
+from . import get_compiler
+from .compiler import compiler
+from .compiler import target
+from .gcc import gcc
+from .compiler import target_from_dict
+
+# Writes a build.ninja that builds a list of targets the way the gcc backend
+# would, so ninja can do the per-file work of a very large build. The command
+# lines come from the same methods gcc.compile, gcc.link_static_lib,
+# gcc.link_module and gcc.strip_module use. Usage:
+#   python -m pycplusplus.ninja <compiler> <targets.json> <build.ninja>
+# where targets.json holds a list of target descriptions (see
+# compiler.target_from_dict).
+#
+# Headers come from the compiler's own depfiles (deps = gcc). A hand written
+# precompiled header (precomp.cpp) is built before the sources that use it.
+# Not supported: C++20 modules, resource files and automatic precompiled headers,
+# which depend on what pycplusplus learnt from earlier builds.
+
+def escape_path(path):
+    return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+def escape_value(text):
+    return text.replace('$', '$$')
+
+ninja_rules = """ninja_required_version = 1.7
+
+rule compile
+  command = $cmd
+  description = $desc
+  depfile = $depfile
+  deps = gcc
+
+rule run
+  command = $cmd
+  description = $desc
+"""
+
+class ninja_file:
+    def __init__(self, c):
+        self.c = c
+        self.lines = [ninja_rules]
+        # Tool environment variables go in front of every command.
+        tool_environment = c.get_tool_environment()
+        self.command_prefix = ''
+        if tool_environment:
+            self.command_prefix = 'env ' + ''.join('%s=%s ' % item for item in sorted(tool_environment.items()))
+
+    def build(self, rule, outputs, inputs, command_lines, description, implicit=None, depfile=None, implicit_outputs=None):
+        line = 'build ' + ' '.join(escape_path(output) for output in outputs)
+        if implicit_outputs:
+            line += ' | ' + ' '.join(escape_path(path) for path in implicit_outputs)
+        line += ': %s %s' % (rule, ' '.join(escape_path(path) for path in inputs))
+        if implicit:
+            line += ' | ' + ' '.join(escape_path(path) for path in implicit)
+        self.lines.append(line)
+        command = ' && '.join(self.command_prefix + ' '.join(command_line) for command_line in command_lines)
+        self.lines.append('  cmd = ' + escape_value(command))
+        self.lines.append('  desc = ' + escape_value(description))
+        if depfile:
+            self.lines.append('  depfile = ' + escape_path(depfile))
+        self.lines.append('')
+
+    def get_text(self):
+        return '\n'.join(self.lines) + '\n'
+
+def get_absolute_target(t):
+    # ninja runs every command from the directory build.ninja is in.
+    absolute_target = copy.copy(t)
+    absolute_target.output_dir = os.path.abspath(t.output_dir)
+    absolute_target.source_list = [os.path.abspath(source) for source in t.source_list]
+    absolute_target.include_list = [os.path.abspath(include_dir) for include_dir in t.include_list]
+    absolute_target.libpath_list = [os.path.abspath(libpath_dir) for libpath_dir in t.libpath_list]
+    return absolute_target
+
+def add_target(c, f, t, lib_outputs):
+    # lib_outputs maps the names of the library targets already added to their
+    # output paths, so targets that link them are built after them.
+    if c.get_option('modules', t.config):
+        c.handle_error("error: modules are not supported in ninja files")
+    if c.get_option('auto_pch', t.config):
+        c.handle_error("error: automatic precompiled headers are not supported in ninja files")
+
+    compile_flags = c.get_compile_flags(t.config, t.include_list, t.define_list)
+    record_list = [c.get_rebuild_record(t.name, t.output_dir, source) for source in t.source_list]
+
+    precompiled_binary = None
+    for r in record_list:
+        if os.path.splitext(os.path.basename(r.source))[0].lower() == 'precomp':
+            if precompiled_binary:
+                c.handle_error("error: found multiple precompiled header source files")
+            new_include_dir, precompiled_binary = c.get_precompiled_header_paths(t.name, t.output_dir, r)
+            depfile = precompiled_binary + '.d'
+            f.build('compile', [precompiled_binary], [r.source],
+                    [c.get_compile_command(t.name, t.output_dir, t.config, r, precompiled_binary, compile_flags,
+                                           ['-MD -MF' + c.prep_path(depfile)])],
+                    "building precompiled header for %s" % t.name,
+                    depfile=depfile)
+            compile_flags.append('-I' + c.prep_path(new_include_dir))
+
+    object_files = []
+    for r in record_list:
+        source_name_split = os.path.splitext(os.path.basename(r.source))
+        if source_name_split[0].lower() == 'precomp':
+            continue
+        if not source_name_split[1] in ['.c', '.cpp']:
+            c.handle_error("error: %s can not be built from a ninja file" % r.source)
+        depfile = r.obj + '.d'
+        f.build('compile', [r.obj], [r.source],
+                [c.get_compile_command(t.name, t.output_dir, t.config, r, r.obj, compile_flags,
+                                       ['-MD -MF' + c.prep_path(depfile)])],
+                "compiling %s" % os.path.basename(r.source),
+                implicit=[precompiled_binary] if precompiled_binary else None,
+                depfile=depfile,
+                implicit_outputs=c.get_extra_outputs(r, t.config))
+        object_files.append(r.obj)
+    object_files.sort()
+
+    output_path = c.get_output_path(t)
+    if t.target_type == target.type_static_lib:
+        f.build('run', [output_path], object_files,
+                [c.get_archive_command(t.config, output_path, object_files)],
+                "linking %s" % os.path.basename(output_path))
+        lib_outputs[t.name] = output_path
+        return
+
+    if t.target_type == target.type_shared_lib:
+        link_module_type = compiler.link_module_type_shared
+    else:
+        link_module_type = compiler.link_module_type_application
+    link_libpath_list = list(t.libpath_list)
+    link_libpath_list.extend(c.builtin_libpath_list)
+    ld_flags = c.get_link_command(t.config, link_module_type, output_path, link_libpath_list, t.lib_list, object_files)
+    ld_flags.extend(c.get_unbudgeted_link_flags(t.config))
+    link_implicit = [lib_outputs[lib] for lib in t.lib_list if lib in lib_outputs]
+    if t.target_type == target.type_shared_lib:
+        export_map = c.get_export_map(t.name, t.output_dir)
+        if export_map:
+            ld_flags.append('-Wl,--version-script=' + c.prep_path(os.path.abspath(export_map)))
+            link_implicit.append(os.path.abspath(export_map))
+    f.build('run', [output_path], object_files, [ld_flags],
+            "linking %s" % os.path.basename(output_path),
+            implicit=link_implicit)
+    if t.target_type == target.type_shared_lib:
+        lib_outputs[t.name] = output_path
+
+    if c.get_option('strip_mode', t.config) != gcc.strip_mode_none:
+        strip_outputs, strip_commands = c.get_strip_commands(t.config, output_path)
+        f.build('run', strip_outputs, [output_path], strip_commands,
+                "stripping %s" % os.path.basename(output_path))
+
+def get_ninja_text(c, target_list):
+    if not isinstance(c, gcc):
+        c.handle_error("error: ninja files can only be written for gcc based compilers")
+    f = ninja_file(c)
+    lib_outputs = {}
+    for t in target_list:
+        add_target(c, f, get_absolute_target(t), lib_outputs)
+    return f.get_text()
+
+def write_ninja_file(c, target_list, path):
+    # Only written when it changes, so ninja does not regenerate needlessly.
+    ninja_text = get_ninja_text(c, target_list)
+    if os.path.isfile(path):
+        with open(path, 'r') as ninja_file_handle:
+            if ninja_file_handle.read() == ninja_text:
+                return
+    with open(path, 'w') as ninja_file_handle:
+        ninja_file_handle.write(ninja_text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='write a build.ninja for targets')
+    parser.add_argument('compiler', help='compiler name, as returned by get_supported_compilers()')
+    parser.add_argument('targets', help='JSON file holding a list of target descriptions')
+    parser.add_argument('output', help='the build.ninja to write')
+    args = parser.parse_args(argv)
+
+    c = get_compiler(args.compiler)
+    if not c:
+        print("error: compiler %s not found" % args.compiler)
+        return 2
+    with open(args.targets, 'r') as targets_file:
+        target_list = [target_from_dict(d) for d in json.load(targets_file)]
+    write_ninja_file(c, target_list, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import copy
+import shutil
+import subprocess
+
+from .gcc import gcc
+from .gcc import get_profile_path
+from .compiler import file_digest
+
+# Profile guided optimization with gcc, in three steps:
+#   1. build an instrumented copy of the targets, each into
+#      <output_dir>/pgo-instrumented, with its own intermediates
+#   2. run a training command that exercises the instrumented programs; every
+#      instrumented object writes a profile (<object name>.gcda) beside itself
+#   3. copy each object's profile beside the matching optimized object, and
+#      build the targets as usual with the profiles
+# A profile is only copied when its contents changed, and the optimized objects
+# depend on their profiles (see gcc.get_extra_inputs), so step 3 compiles just
+# the sources whose profiles changed. A source the training did not reach this
+# time loses its old profile, and its object, so it is compiled without one.
+
+instrumented_dir_name = 'pgo-instrumented'
+
+def get_instrumented_targets(target_list):
+    # Library paths that point at another target's output directory follow that
+    # target into its instrumented directory.
+    output_dirs = {}
+    for t in target_list:
+        output_dirs[os.path.abspath(t.output_dir)] = os.path.join(t.output_dir, instrumented_dir_name)
+
+    instrumented_target_list = []
+    for t in target_list:
+        instrumented_target = copy.copy(t)
+        instrumented_target.output_dir = output_dirs[os.path.abspath(t.output_dir)]
+        instrumented_target.libpath_list = [output_dirs.get(os.path.abspath(libpath_dir), libpath_dir)
+                                            for libpath_dir in t.libpath_list]
+        instrumented_target_list.append(instrumented_target)
+    return instrumented_target_list
+
+def get_pgo_compiler(c, pgo_mode):
+    pgo_compiler = copy.copy(c)
+    pgo_compiler.pgo_mode = pgo_mode
+    pgo_compiler.deferred_jobs = None
+    return pgo_compiler
+
+def remove_profiles(c, target_list):
+    # Profiles add up over runs; each training starts from nothing.
+    for t in target_list:
+        for source in t.source_list:
+            profile_path = get_profile_path(c.get_rebuild_record(t.name, t.output_dir, source))
+            if os.path.isfile(profile_path):
+                os.remove(profile_path)
+
+def collect_profiles(c, instrumented_target_list, target_list):
+    # Copy the profiles written in training beside the optimized objects, where
+    # they changed. Returns the number copied or removed.
+    copied = 0
+    for instrumented_target, t in zip(instrumented_target_list, target_list):
+        c.make_intermediates_dirs(t.name, t.output_dir)
+        for source in t.source_list:
+            trained_path = get_profile_path(c.get_rebuild_record(instrumented_target.name, instrumented_target.output_dir, source))
+            r = c.get_rebuild_record(t.name, t.output_dir, source)
+            profile_path = get_profile_path(r)
+            if not os.path.isfile(trained_path):
+                # The object was optimized with the old profile; a missing profile
+                # alone would not rebuild it.
+                if os.path.isfile(profile_path):
+                    os.remove(profile_path)
+                    if os.path.isfile(r.obj):
+                        os.remove(r.obj)
+                    copied += 1
+                continue
+            if os.path.isfile(profile_path) and file_digest(profile_path) == file_digest(trained_path):
+                continue
+            shutil.copyfile(trained_path, profile_path)
+            copied += 1
+    return copied
+
+def run_training(c, training_command, instrumented_target_list):
+    # training_command is a command line (a string, or a list of arguments) or a
+    # function taking the instrumented targets; either way it returns 0 on success.
+    c.print_both("-- Training --")
+    if callable(training_command):
+        return_val = training_command(instrumented_target_list)
+    else:
+        return_val = subprocess.call(training_command, shell=not isinstance(training_command, list))
+    if return_val != 0:
+        c.handle_error("error: training exited with %s" % return_val)
+
+def build_pgo(c, target_list, training_command):
+    # Run all three steps for a list of targets, in build order, with a gcc based
+    # compiler.
+    if not isinstance(c, gcc):
+        c.handle_error("error: profile guided optimization needs a gcc based compiler")
+
+    instrumented_target_list = get_instrumented_targets(target_list)
+    instrumented_compiler = get_pgo_compiler(c, gcc.pgo_mode_generate)
+    for t in instrumented_target_list:
+        instrumented_compiler.build_target(t)
+    instrumented_compiler.wait_for_deferred()
+
+    remove_profiles(c, instrumented_target_list)
+    run_training(c, training_command, instrumented_target_list)
+    c.print_both("%d profiles changed" % collect_profiles(c, instrumented_target_list, target_list))
+
+    optimized_compiler = get_pgo_compiler(c, gcc.pgo_mode_use)
+    for t in target_list:
+        optimized_compiler.build_target(t)
+    optimized_compiler.wait_for_deferred()
@@ -0,0 +1,198 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+
+from . import get_compiler
+from .compiler import compiler
+from .compiler import target
+from .compiler import stat_cache
+from .compiler import target_from_dict
+
+# Works out what building a list of targets would do, without running any
+# tools or writing any files: which sources would be compiled and which targets
+# linked, why, and roughly how long it would take, from the times recorded by
+# past builds (see timings.py). Only time stamps are read, and the dependency
+# index of each target, so planning is cheap enough to do before every build.
+# Usage:
+#   python -m pycplusplus.planner <compiler> <targets.json> [--json <plan.json>]
+# where targets.json holds a list of target descriptions (see
+# compiler.target_from_dict).
+#
+# The plan is a lower bound in two cases: with C++20 modules, an interface that
+# really changes also compiles its importers, and with automatic precompiled
+# headers, a new selection of headers compiles every C++ source.
+
+# A source that would be compiled. "estimate" is in seconds, or None if the
+# source has never been timed and nothing else in its target has been either.
+class compile_step:
+    def __init__(self, source, reason, reason_path, estimate):
+        self.source = source
+        self.reason = reason
+        self.reason_path = reason_path
+        self.estimate = estimate
+
+# What building one target would do. "link_reason" is None if the target would
+# not be linked.
+class target_plan:
+    def __init__(self, t):
+        self.target = t
+        self.compile_list = []
+        self.link_reason = None
+        self.link_reason_path = None
+        self.link_estimate = None
+
+    def get_estimate(self):
+        # The total of the estimates that are known.
+        estimates = [step.estimate for step in self.compile_list if step.estimate is not None]
+        if self.link_reason is not None and self.link_estimate is not None:
+            estimates.append(self.link_estimate)
+        return sum(estimates)
+
+    def has_work(self):
+        return len(self.compile_list) > 0 or self.link_reason is not None
+
+def plan_target(c, t, relinked_names):
+    # relinked_names is the set of names of the targets planned before this one
+    # that would be linked; linking against one of them means linking again too.
+    plan = target_plan(t)
+    timings = c.load_timings(t.name, t.output_dir)
+    mean_compile_time = timings.get_mean_compile_time()
+
+    for r in c.check_for_rebuild(t.name, t.output_dir, t.config, t.source_list):
+        estimate = timings.get_compile_time(r.source)
+        if estimate is None:
+            estimate = mean_compile_time
+        plan.compile_list.append(compile_step(r.source, r.reason, r.reason_path, estimate))
+
+    output_path = c.get_output_path(t)
+    if len(plan.compile_list) > 0:
+        link_reason = (compiler.link_reason_objects_rebuilt, None)
+    elif t.target_type == target.type_static_lib:
+        link_reason = None if os.path.isfile(output_path) else (compiler.link_reason_output_missing, output_path)
+    else:
+        relinked = [lib for lib in t.lib_list if lib in relinked_names]
+        if relinked:
+            link_reason = (compiler.link_reason_library_newer, relinked[0])
+        else:
+            libpath_list = list(t.libpath_list)
+            libpath_list.extend(c.builtin_libpath_list)
+            link_reason = c.get_link_reason(output_path, libpath_list, t.lib_list)
+    if link_reason is not None:
+        plan.link_reason, plan.link_reason_path = link_reason
+        plan.link_estimate = timings.link_time
+    return plan
+
+def plan_targets(c, target_list):
+    # Returns a list of target_plans, one per target, in build order.
+    old_stat_cache = c.stat_cache
+    if c.stat_cache is None:
+        c.stat_cache = stat_cache()
+    plans = []
+    relinked_names = set()
+    try:
+        for t in target_list:
+            c.dep_graph = c.load_dep_graph(t.name, t.output_dir)
+            c.fingerprints = c.load_fingerprints(t.name, t.output_dir, t.config)
+            plan = plan_target(c, t, relinked_names)
+            if plan.link_reason is not None:
+                relinked_names.add(t.name)
+            plans.append(plan)
+    finally:
+        c.dep_graph = None
+        c.fingerprints = None
+        c.stat_cache = old_stat_cache
+    return plans
+
+def plan_to_dict(plans):
+    target_dicts = []
+    for plan in plans:
+        t = plan.target
+        link = None
+        if plan.link_reason is not None:
+            link = {'reason': plan.link_reason, 'path': plan.link_reason_path, 'estimate': plan.link_estimate}
+        target_dicts.append({
+            'name': t.name,
+            'type': target.type_descriptions[t.target_type],
+            'config': t.config,
+            'output_dir': os.path.abspath(t.output_dir),
+            'compile': [{'source': os.path.abspath(step.source),
+                         'reason': step.reason,
+                         'path': step.reason_path,
+                         'estimate': step.estimate} for step in plan.compile_list],
+            'link': link,
+            'estimate': plan.get_estimate()
+            })
+    steps = [step for plan in plans for step in plan.compile_list]
+    return {
+        'targets': target_dicts,
+        'compile_count': len(steps),
+        'link_count': len([plan for plan in plans if plan.link_reason is not None]),
+        'untimed_count': len([step for step in steps if step.estimate is None]),
+        'estimate': sum(plan.get_estimate() for plan in plans)
+        }
+
+def save_plan(path, plans):
+    with open(path, 'w') as plan_file:
+        json.dump(plan_to_dict(plans), plan_file, indent=1)
+
+def describe_reason(reason, reason_path):
+    if reason_path is None:
+        return reason
+    return "%s: %s" % (reason, reason_path)
+
+def print_plan(plans, output_file=None):
+    for plan in plans:
+        t = plan.target
+        if not plan.has_work():
+            print("%s is up to date" % t.name, file=output_file)
+            continue
+        print("-- %s %s: %.1f s --" % (target.type_descriptions[t.target_type], t.name, plan.get_estimate()), file=output_file)
+        for step in plan.compile_list:
+            print("compile %s (%s)" % (os.path.basename(step.source), describe_reason(step.reason, step.reason_path)), file=output_file)
+        if plan.link_reason is not None:
+            print("link (%s)" % describe_reason(plan.link_reason, plan.link_reason_path), file=output_file)
+    plan_dict = plan_to_dict(plans)
+    print("%d compiles, %d links, about %.1f s of work" %
+          (plan_dict['compile_count'], plan_dict['link_count'], plan_dict['estimate']), file=output_file)
+    if plan_dict['untimed_count']:
+        print("(%d compiles could not be estimated)" % plan_dict['untimed_count'], file=output_file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='show what building targets would do')
+    parser.add_argument('compiler', help='compiler name, as returned by get_supported_compilers()')
+    parser.add_argument('targets', help='JSON file holding a list of target descriptions')
+    parser.add_argument('--json', help='also write the plan to this JSON file')
+    args = parser.parse_args(argv)
+
+    c = get_compiler(args.compiler)
+    if not c:
+        print("error: compiler %s not found" % args.compiler)
+        return 2
+    with open(args.targets, 'r') as targets_file:
+        target_list = [target_from_dict(d) for d in json.load(targets_file)]
+
+    plans = plan_targets(c, target_list)
+    print_plan(plans)
+    if args.json:
+        save_plan(args.json, plans)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import getpass
+import hashlib
+
+# Intermediates directories in RAM (see compiler.ram_intermediates). Each
+# target's intermediates tree lives under a RAM backed directory, such as
+# /dev/shm, at:
+#   <ram root>/pycplusplus-<user>/<digest of the output directory>/<name>.intermediates
+# Only the small files that describe past builds are written back to the usual
+# <output_dir>/<name>.intermediates, after each build; when the RAM copy is lost
+# (a reboot, say) they are copied back, and everything else is built again.
+# A target whose intermediates would take the RAM copies over their size limit
+# keeps them on disk instead, from then on.
+
+# Left in <output_dir>/<name>.intermediates when a target did not fit in RAM.
+fallback_file_name = 'on_disk'
+
+# The files written back, relative to the intermediates directory.
+metadata_files = [
+    'dep.index',
+    'timings.json',
+    'fingerprints.json',
+    os.path.join('autopch', 'selection.json'),
+    os.path.join('modules', 'scan.json')
+    ]
+
+def get_ram_intermediates_dir(ram_root, name, output_dir):
+    output_digest = hashlib.sha1(os.path.abspath(output_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(ram_root, 'pycplusplus-' + getpass.getuser(), output_digest, name + '.intermediates')
+
+def get_tree_size(path):
+    # The total size of the files under path, in bytes.
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+def has_room(ram_root, limit):
+    # Whether a new intermediates tree can go in RAM: the trees already there take
+    # up less than the limit, and the file system has at least that much free.
+    user_dir = os.path.join(ram_root, 'pycplusplus-' + getpass.getuser())
+    if get_tree_size(user_dir) >= limit:
+        return False
+    try:
+        stat = os.statvfs(ram_root)
+    except (AttributeError, OSError):
+        return False
+    return stat.f_bavail * stat.f_frsize >= limit
+
+def copy_metadata(from_dir, to_dir):
+    for relative_path in metadata_files:
+        from_path = os.path.join(from_dir, relative_path)
+        if not os.path.isfile(from_path):
+            continue
+        to_path = os.path.join(to_dir, relative_path)
+        if not os.path.exists(os.path.dirname(to_path)):
+            os.makedirs(os.path.dirname(to_path))
+        shutil.copy2(from_path, to_path)
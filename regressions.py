@@ -0,0 +1,240 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from __future__ import print_function
+import sys
+import json
+import time
+import argparse
+
+from . import get_compiler
+from .compiler import target_from_dict
+
+# Finds the sources of a target whose compiles got slower between two builds,
+# from the compile time history kept with the target's timings (see
+# timings.py), along with the headers each started to include in between.
+# Headers are recorded in include order, each followed by the headers it brings
+# in, so of a run of newly included headers the first is the one that was
+# added; the rest came with it. Added headers that slowed down several sources
+# at once come first in the report; they are the likely culprits. Usage:
+#   python -m pycplusplus.regressions <compiler> <targets.json> [--old <build>]
+#       [--new <build>] [--threshold <fraction>] [--min-seconds <seconds>]
+#       [--json <report.json>]
+# A build is given by its index in the history (-1 is the latest build and the
+# default for --new, -2 the one before and the default for --old) or by its
+# label (compiler.history_label), or the start of one, such as a commit hash.
+#
+# A source a build did not compile is taken as it was when last compiled, so
+# two builds can be compared even if neither compiled everything.
+
+default_threshold = 0.2     # the fraction a compile must slow down by to be reported
+default_min_seconds = 0.1   # and the seconds
+
+# A source that compiles slower in the new build. "old" and "new" are the
+# build_history_entry of each. "added_includes" are the headers added to the
+# source, or to the headers it already included, and "added_headers" those and
+# everything they include in turn.
+class compile_regression:
+    def __init__(self, source, old, new):
+        self.source = source
+        self.old = old
+        self.new = new
+        old_headers = set(old.headers)
+        self.added_headers = sorted(set(new.headers) - old_headers)
+        self.removed_headers = sorted(old_headers - set(new.headers))
+        self.added_includes = []
+        previous_added = False
+        for header in new.headers:
+            added = not header in old_headers
+            if added and not previous_added:
+                self.added_includes.append(header)
+            previous_added = added
+
+    def get_slowdown(self):
+        return self.new.seconds - self.old.seconds
+
+# A header added to the regressed sources, the sources, and the time they lost
+# between them.
+class header_blame:
+    def __init__(self, header):
+        self.header = header
+        self.sources = []
+        self.seconds = 0.0
+
+# The regressions of one target between two builds (indexes in the history).
+class target_report:
+    def __init__(self, t, old_index, new_index):
+        self.target = t
+        self.old_index = old_index
+        self.new_index = new_index
+        self.old_build = None
+        self.new_build = None
+        self.regressions = []
+        self.blame = []
+
+def find_build(timings, build):
+    # The index in the history of a build given by index or label, or None.
+    try:
+        index = int(build)
+    except ValueError:
+        index = None
+    if index is not None:
+        if -len(timings.history) <= index < len(timings.history):
+            return index % len(timings.history)
+        return None
+    for index in range(len(timings.history) - 1, -1, -1):
+        label = timings.history[index].label
+        if label is not None and label.startswith(build):
+            return index
+    return None
+
+def get_entries_at(timings, index):
+    # Every source compiled up to and including the build at index, as last compiled.
+    entries = {}
+    for build in timings.history[:index + 1]:
+        entries.update(build.entries)
+    return entries
+
+def compare_builds(timings, old_index, new_index, threshold=default_threshold, min_seconds=default_min_seconds):
+    # The compile_regression list, slowest first.
+    old_entries = get_entries_at(timings, old_index)
+    new_entries = get_entries_at(timings, new_index)
+    regressions = []
+    for source, new_entry in new_entries.items():
+        old_entry = old_entries.get(source)
+        if old_entry is None or old_entry is new_entry:
+            continue
+        slowdown = new_entry.seconds - old_entry.seconds
+        if slowdown >= min_seconds and new_entry.seconds > old_entry.seconds * (1.0 + threshold):
+            regressions.append(compile_regression(source, old_entry, new_entry))
+    regressions.sort(key=lambda regression: regression.get_slowdown(), reverse=True)
+    return regressions
+
+def blame_headers(regressions):
+    # The header_blame list for the headers added to regressed sources, the ones
+    # that slowed down the most sources first.
+    blame = {}
+    for regression in regressions:
+        for header in regression.added_includes:
+            header_entry = blame.get(header)
+            if header_entry is None:
+                header_entry = blame[header] = header_blame(header)
+            header_entry.sources.append(regression.source)
+            header_entry.seconds += regression.get_slowdown()
+    return sorted(blame.values(), key=lambda header_entry: (len(header_entry.sources), header_entry.seconds), reverse=True)
+
+def report_target(c, t, old_build='-2', new_build='-1', threshold=default_threshold, min_seconds=default_min_seconds):
+    # Returns a target_report, or None if the target's history does not hold both
+    # builds.
+    timings = c.load_timings(t.name, t.output_dir)
+    old_index = find_build(timings, old_build)
+    new_index = find_build(timings, new_build)
+    if old_index is None or new_index is None:
+        return None
+    report = target_report(t, old_index, new_index)
+    report.old_build = timings.history[old_index]
+    report.new_build = timings.history[new_index]
+    report.regressions = compare_builds(timings, old_index, new_index, threshold, min_seconds)
+    report.blame = blame_headers(report.regressions)
+    return report
+
+def describe_build(index, build):
+    description = "build %d (%s" % (index, time.strftime('%Y-%m-%d %H:%M', time.localtime(build.time)))
+    if build.label is not None:
+        description += ", %s" % build.label
+    return description + ")"
+
+def describe_size(entry):
+    return "?" if entry.size is None else "%d" % entry.size
+
+def print_report(reports, output_file=None):
+    for report in reports:
+        t = report.target
+        print("-- %s: %s to %s --" % (t.name, describe_build(report.old_index, report.old_build),
+                                      describe_build(report.new_index, report.new_build)), file=output_file)
+        if not report.regressions:
+            print("no compiles got slower", file=output_file)
+            continue
+        for regression in report.regressions:
+            print("%8.3f s -> %8.3f s  %s -> %s bytes  %s" %
+                  (regression.old.seconds, regression.new.seconds, describe_size(regression.old),
+                   describe_size(regression.new), regression.source), file=output_file)
+            for header in regression.added_includes:
+                print("        + %s" % header, file=output_file)
+            brought_in = len(regression.added_headers) - len(regression.added_includes)
+            if brought_in:
+                print("          (and %d headers they include)" % brought_in, file=output_file)
+        if report.blame:
+            print("Headers added to the slower sources:", file=output_file)
+            for header_entry in report.blame:
+                print("%8.3f s %6d x  %s" % (header_entry.seconds, len(header_entry.sources), header_entry.header),
+                      file=output_file)
+
+def build_to_dict(index, build):
+    return {'index': index, 'time': build.time, 'label': build.label}
+
+def report_to_dict(reports):
+    return [{
+        'name': report.target.name,
+        'old': build_to_dict(report.old_index, report.old_build),
+        'new': build_to_dict(report.new_index, report.new_build),
+        'regressions': [{'source': regression.source,
+                         'old_seconds': regression.old.seconds,
+                         'new_seconds': regression.new.seconds,
+                         'old_size': regression.old.size,
+                         'new_size': regression.new.size,
+                         'added_includes': regression.added_includes,
+                         'added_headers': regression.added_headers,
+                         'removed_headers': regression.removed_headers} for regression in report.regressions],
+        'headers': [{'header': header_entry.header,
+                     'sources': header_entry.sources,
+                     'seconds': header_entry.seconds} for header_entry in report.blame]
+        } for report in reports]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='find compiles that got slower between two builds')
+    parser.add_argument('compiler', help='compiler name, as returned by get_supported_compilers()')
+    parser.add_argument('targets', help='JSON file holding a list of target descriptions')
+    parser.add_argument('--old', default='-2', help='the build to compare against: an index or a label')
+    parser.add_argument('--new', default='-1', help='the build to compare: an index or a label')
+    parser.add_argument('--threshold', type=float, default=default_threshold,
+                        help='the fraction a compile must slow down by to be reported')
+    parser.add_argument('--min-seconds', type=float, default=default_min_seconds,
+                        help='the seconds a compile must slow down by to be reported')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    c = get_compiler(args.compiler)
+    if not c:
+        print("error: compiler %s not found" % args.compiler)
+        return 2
+    with open(args.targets, 'r') as targets_file:
+        target_list = [target_from_dict(d) for d in json.load(targets_file)]
+
+    reports = []
+    for t in target_list:
+        report = report_target(c, t, args.old, args.new, args.threshold, args.min_seconds)
+        if report is None:
+            print("%s: no builds %s and %s in its history" % (t.name, args.old, args.new))
+        else:
+            reports.append(report)
+    print_report(reports)
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report_to_dict(reports), report_file, indent=1)
+    return 1 if any(report.regressions for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
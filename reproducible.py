@@ -0,0 +1,116 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import sys
+import copy
+import json
+import shutil
+import filecmp
+import argparse
+
+from . import get_compiler
+from .compiler import cplusplus_error
+from .compiler import target_from_dict
+
+# Checks that a list of targets builds reproducibly: builds them from scratch
+# twice, into <scratch_dir>/a and <scratch_dir>/b, and compares the object files
+# and outputs of the two builds byte for byte. Usage:
+#   python -m pycplusplus.reproducible <compiler> <targets.json> <scratch_dir>
+# where targets.json holds a list of target descriptions (see
+# compiler.target_from_dict).
+
+def get_build_targets(target_list, build_dir):
+    # Library paths that point at another target's output directory follow that
+    # target into the build directory.
+    output_dirs = {}
+    for i, t in enumerate(target_list):
+        output_dirs[os.path.abspath(t.output_dir)] = os.path.join(build_dir, '%d' % i)
+
+    build_target_list = []
+    for t in target_list:
+        build_target = copy.copy(t)
+        build_target.output_dir = output_dirs[os.path.abspath(t.output_dir)]
+        build_target.libpath_list = [output_dirs.get(os.path.abspath(libpath_dir), libpath_dir)
+                                     for libpath_dir in t.libpath_list]
+        build_target_list.append(build_target)
+    return build_target_list
+
+def get_build_outputs(c, target_list, build_dir):
+    # A dictionary of each file the targets built, by its path relative to the
+    # build directory.
+    outputs = {}
+    for t in target_list:
+        object_code_dir = os.path.join(c.get_intermediates_dir(t.name, t.output_dir), 'obj')
+        paths = []
+        for root, dirs, files in os.walk(object_code_dir, topdown=True):
+            paths.extend(os.path.join(root, filename) for filename in files)
+        paths.append(c.get_output_path(t))
+        for path in paths:
+            if os.path.isfile(path):
+                outputs[os.path.relpath(path, build_dir)] = path
+    return outputs
+
+def verify_reproducible(c, target_list, scratch_dir):
+    # Returns the list of files that differ between the two builds, relative to the
+    # build directory, or that only one of them built.
+    build_outputs = []
+    for build_name in ['a', 'b']:
+        build_dir = os.path.abspath(os.path.join(scratch_dir, build_name))
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        build_target_list = get_build_targets(target_list, build_dir)
+        c.print_both("building %s" % build_dir)
+        for t in build_target_list:
+            c.build_target(t)
+        c.wait_for_deferred()
+        build_outputs.append(get_build_outputs(c, build_target_list, build_dir))
+
+    outputs_a, outputs_b = build_outputs
+    mismatch_list = []
+    for relative_path in sorted(set(outputs_a) | set(outputs_b)):
+        if not relative_path in outputs_a or not relative_path in outputs_b:
+            mismatch_list.append(relative_path)
+        elif not filecmp.cmp(outputs_a[relative_path], outputs_b[relative_path], shallow=False):
+            mismatch_list.append(relative_path)
+    return mismatch_list
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='check that targets build reproducibly')
+    parser.add_argument('compiler', help='compiler name, as returned by get_supported_compilers()')
+    parser.add_argument('targets', help='JSON file holding a list of target descriptions')
+    parser.add_argument('scratch', help='directory to build in')
+    args = parser.parse_args(argv)
+
+    c = get_compiler(args.compiler)
+    if not c:
+        print("error: compiler %s not found" % args.compiler)
+        return 2
+    c.reproducible = True
+    with open(args.targets, 'r') as targets_file:
+        target_list = [target_from_dict(d) for d in json.load(targets_file)]
+
+    try:
+        mismatch_list = verify_reproducible(c, target_list, args.scratch)
+    except cplusplus_error as e:
+        print(str(e))
+        return 2
+    for relative_path in mismatch_list:
+        print("differs: %s" % relative_path)
+    print("%d of the built files differ" % len(mismatch_list))
+    return 1 if mismatch_list else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
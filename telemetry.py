@@ -0,0 +1,109 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import time
+import threading
+
+# Build events and counters, for feeding builds into monitoring. Functions added
+# with compiler.add_event_hook are called with a build_event as things happen;
+# a build_metrics object attached to a compiler (compiler.metrics) counts them
+# up, and can be written out for the Prometheus node exporter's textfile
+# collector. Hooks are called on the thread that builds the target, which is
+# not the same thread for every target of a build matrix (see matrix.py).
+
+# Events, and the fields each carries:
+event_build_start = 'build_start'       # target
+event_build_end = 'build_end'           # target, succeeded, elapsed (seconds)
+event_rebuild_check = 'rebuild_check'   # source, reason, reason_path; a reason of None is up to date
+event_invoke_start = 'invoke_start'     # argv
+event_invoke_end = 'invoke_end'         # argv, elapsed (seconds), return_val
+event_pch_build = 'pch_build'           # source, output
+event_link_skip = 'link_skip'           # output
+event_error = 'error'                   # message
+
+class build_event:
+    def __init__(self, name, fields):
+        self.name = name
+        self.time = time.time()
+        self.fields = fields
+
+# Counters:
+counter_files_stated = 'files_stated'           # time stamps read from the file system
+counter_cache_hits = 'cache_hits'               # time stamps found in the stat cache instead
+counter_dep_files_read = 'dep_files_read'       # .dep files read by the update time check
+counter_objects_rebuilt = 'objects_rebuilt'
+counter_objects_up_to_date = 'objects_up_to_date'
+counter_bytes_written = 'bytes_written'         # objects, dependency lists and link outputs
+counter_invocations = 'invocations'
+counter_invoke_seconds = 'invoke_seconds'
+counter_links_skipped = 'links_skipped'
+counter_errors = 'errors'
+
+counter_descriptions = {
+    counter_files_stated: 'Time stamps read from the file system',
+    counter_cache_hits: 'Time stamps found in the stat cache',
+    counter_dep_files_read: 'Dependency files read by the update time check',
+    counter_objects_rebuilt: 'Objects compiled',
+    counter_objects_up_to_date: 'Objects found to be up to date',
+    counter_bytes_written: 'Bytes of objects, dependency lists and link outputs written',
+    counter_invocations: 'Tool processes run',
+    counter_invoke_seconds: 'Seconds spent waiting for tool processes',
+    counter_links_skipped: 'Links skipped as up to date',
+    counter_errors: 'Build errors'
+    }
+
+class build_metrics:
+    def __init__(self):
+        self.counters = dict((counter, 0) for counter in counter_descriptions)
+        self.lock = threading.Lock()
+
+    def increment(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def get(self, counter):
+        with self.lock:
+            return self.counters.get(counter, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def get_prometheus_text(metrics, labels=None):
+    # Each counter as pycplusplus_<counter>_total, with the given labels.
+    label_text = ''
+    if labels:
+        label_text = '{' + ','.join('%s="%s"' % (key, escape_label_value(labels[key])) for key in sorted(labels)) + '}'
+    lines = []
+    for counter, value in sorted(metrics.snapshot().items()):
+        metric_name = 'pycplusplus_%s_total' % counter
+        lines.append('# HELP %s %s' % (metric_name, counter_descriptions.get(counter, counter)))
+        lines.append('# TYPE %s counter' % metric_name)
+        lines.append('%s%s %s' % (metric_name, label_text, repr(float(value)) if isinstance(value, float) else value))
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus_textfile(metrics, path, labels=None):
+    # The collector may read the file at any time, so it is written beside its
+    # final name and renamed into place.
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'w') as textfile:
+        textfile.write(get_prometheus_text(metrics, labels))
+    if os.path.exists(path) and os.name == 'nt':
+        os.remove(path)
+    os.rename(temp_path, path)
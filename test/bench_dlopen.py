@@ -0,0 +1,195 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Compares a shared library linked with each link profile and export setting:
+# the symbols in its dynamic symbol table, its size, the time dlopen takes to
+# load it and the time to look up and call each of its interface functions.
+# The number of sources is on the command line.
+
+from __future__ import print_function
+import sys
+import os
+import re
+import shutil
+import subprocess
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus import get_compiler
+from pycplusplus.gcc import gcc
+
+default_source_count = 200
+load_repeat = 20
+
+loader_source = """
+#include <dlfcn.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+static double now()
+{
+    timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + t.tv_nsec * 1e-9;
+}
+
+int main(int argc, char ** argv)
+{
+    double start = now();
+    void * library = dlopen(argv[1], RTLD_LAZY | RTLD_LOCAL);
+    if (!library)
+    {
+        fprintf(stderr, "%s\\n", dlerror());
+        return 1;
+    }
+    double loaded = now();
+    int total = 0;
+    for (int index = 0; index < atoi(argv[2]); ++index)
+    {
+        char name[64];
+        snprintf(name, sizeof(name), "bench_api_%d", index);
+        int (*function)(int) = (int (*)(int))dlsym(library, name);
+        total += function(index);
+    }
+    double called = now();
+    printf("%f %f %d\\n", loaded - start, called - loaded, total);
+    return 0;
+}
+"""
+
+def write_sources(source_dir, source_count):
+    # Each source has one function in the library's interface, and a class and
+    # helpers that are only used inside the library.
+    source_list = []
+    for index in range(source_count):
+        source = os.path.join(source_dir, 'bench%d.cpp' % index)
+        with open(source, 'w') as source_file:
+            source_file.write(
+"""
+#include <map>
+#include <string>
+#include <vector>
+
+#define BENCH_API extern "C" __attribute__((visibility("default")))
+
+namespace bench%d
+{
+    struct widget
+    {
+        std::vector<std::string> names;
+        std::map<std::string, int> counts;
+
+        int add(const std::string & name)
+        {
+            names.push_back(name);
+            return ++counts[name];
+        }
+    };
+
+    int scale(int x)
+    {
+        return x * %d;
+    }
+
+    int unused(int x)
+    {
+        return x + %d;
+    }
+
+    int add_twice(widget & w, const std::string & name)
+    {
+        w.add(name);
+        return w.add(name);
+    }
+}
+
+BENCH_API int bench_api_%d(int x)
+{
+    bench%d::widget w;
+    return bench%d::scale(x) + bench%d::add_twice(w, "bench");
+}
+""" % (index, index, index, index, index, index, index)
+            )
+        source_list.append(source)
+    return source_list
+
+def count_dynamic_symbols(path):
+    output = subprocess.check_output(['readelf', '--dyn-syms', '-W', path]).decode('latin-1')
+    return len(re.findall(r'^\s*\d+:', output, re.MULTILINE))
+
+def time_load(loader_path, library_path, source_count):
+    # The best of several runs, each in a new process.
+    best_load = None
+    best_call = None
+    for repeat in range(load_repeat):
+        output = subprocess.check_output([loader_path, library_path, str(source_count)]).decode('latin-1')
+        load_time, call_time = [float(value) for value in output.split()[:2]]
+        best_load = load_time if best_load is None else min(best_load, load_time)
+        best_call = call_time if best_call is None else min(best_call, call_time)
+    return (best_load, best_call)
+
+def main():
+    source_count = int(argv[1]) if len(argv) > 1 else default_source_count
+    bench_dir = os.path.abspath(os.path.join(script_dir, 'bench_dlopen.tmp'))
+    if os.path.exists(bench_dir):
+        shutil.rmtree(bench_dir)
+    source_dir = os.path.join(bench_dir, 'src')
+    os.makedirs(source_dir)
+    source_list = write_sources(source_dir, source_count)
+    loader_path = os.path.join(source_dir, 'loader.cpp')
+    with open(loader_path, 'w') as loader_file:
+        loader_file.write(loader_source)
+
+    c = get_compiler('linux_gcc_x64')
+    if not c:
+        print("Compiler not found")
+        return
+
+    loader_dir = os.path.join(bench_dir, 'loader')
+    c.build_application('loader', loader_dir, 'release', [loader_path], [], [], [], ['dl'])
+
+    variants = [
+        ('default', gcc.link_profile_default, False, False, None),
+        ('export-map', gcc.link_profile_default, False, False, ['bench_api_*']),
+        ('startup', gcc.link_profile_startup, False, False, None),
+        ('startup-gc', gcc.link_profile_startup, False, True, None),
+        ('startup-gc-now', gcc.link_profile_startup, True, True, None)
+        ]
+    print("%-16s %9s %10s %10s %10s" % ("profile", "dynsyms", "bytes", "load ms", "call ms"))
+    for variant, link_profile, bind_now, gc_sections, exports in variants:
+        c.link_profile = link_profile
+        c.bind_now = bind_now
+        c.gc_sections = gc_sections
+        c.export_maps = {'bench': exports} if exports else None
+        output_dir = os.path.join(bench_dir, variant)
+        c.build_shared_lib('bench', output_dir, 'release', source_list, [], [], [], [])
+
+        library_path = os.path.join(output_dir, 'libbench.so')
+        load_time, call_time = time_load(os.path.join(loader_dir, 'loader'), library_path, source_count)
+        print("%-16s %9d %10d %10.3f %10.3f" % (variant, count_dynamic_symbols(library_path),
+                                                os.path.getsize(library_path), load_time * 1000.0, call_time * 1000.0))
+
+    c.link_profile = gcc.link_profile_default
+    c.bind_now = False
+    c.gc_sections = False
+    c.export_maps = None
+    shutil.rmtree(bench_dir)
+
+if __name__ == "__main__":
+    main()
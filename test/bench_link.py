@@ -0,0 +1,96 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Compares shared library link times for each available linker, with and without
+# split DWARF and compressed debug sections.
+
+from __future__ import print_function
+import sys
+import os
+import shutil
+import time
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus import get_compiler
+from pycplusplus.compiler import compiler
+
+source_count = 200
+link_repeat = 3
+
+def write_sources(source_dir):
+    source_list = []
+    for index in range(source_count):
+        source = os.path.join(source_dir, 'bench%d.cpp' % index)
+        with open(source, 'w') as source_file:
+            source_file.write(
+"""
+#include <map>
+#include <string>
+#include <vector>
+
+std::map<std::string, std::vector<int> > bench_table%d;
+
+int bench_function%d(const std::string & key)
+{
+    bench_table%d[key].push_back(%d);
+    return (int)bench_table%d[key].size();
+}
+""" % (index, index, index, index, index)
+            )
+        source_list.append(source)
+    return source_list
+
+def main():
+    bench_dir = os.path.abspath(os.path.join(script_dir, 'bench_link.tmp'))
+    if os.path.exists(bench_dir):
+        shutil.rmtree(bench_dir)
+    source_dir = os.path.join(bench_dir, 'src')
+    os.makedirs(source_dir)
+    source_list = write_sources(source_dir)
+
+    c = get_compiler('linux_gcc_x64')
+    if not c:
+        print("Compiler not found")
+        return
+
+    for linker in [None, 'bfd', 'gold', 'lld', 'mold']:
+        if linker and not c.find_linker(linker):
+            continue
+        for split_dwarf, compress in [(False, False), (True, False), (True, True)]:
+            c.linker = linker
+            c.split_dwarf = split_dwarf
+            c.compress_debug_sections = compress
+            variant = '%s%s%s' % (linker or 'default', '-split' if split_dwarf else '', '-gz' if compress else '')
+            output_dir = os.path.join(bench_dir, variant)
+            c.build_shared_lib('bench', output_dir, 'debug', source_list, [], [], [], [])
+
+            # Time the link step alone.
+            best = None
+            for repeat in range(link_repeat):
+                start = time.time()
+                c.link_module('bench', output_dir, 'debug', True, compiler.link_module_type_shared, [], [])
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            link_size = os.path.getsize(os.path.join(output_dir, 'libbench.so'))
+            print("%-24s link %8.3f s  %10d bytes" % (variant, best, link_size))
+
+    shutil.rmtree(bench_dir)
+
+if __name__ == "__main__":
+    main()
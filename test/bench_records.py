@@ -0,0 +1,108 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Measures how the build state scales with the number of sources in a target:
+# the time and memory taken by the update time check (for a target never built,
+# so it needs no files), and by the dependency graph: filled in, saved, loaded
+# again and its reverse index built. Source counts are on the command line.
+
+from __future__ import print_function
+import sys
+import os
+import gc
+import time
+import shutil
+import tracemalloc
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus.gcc import linux_gcc_x64
+from pycplusplus.depgraph import dependency_graph
+
+default_counts = [1000, 10000, 100000, 250000]
+header_count = 2000         # headers in the whole code base
+headers_per_source = 50
+
+def measure(function):
+    # Returns the function's result, the seconds it took and the MB it allocated
+    # and kept. Tracing allocations slows everything down, so the function is run
+    # twice: once for the time and once for the memory.
+    gc.collect()
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (result, elapsed, size / (1024.0 * 1024.0))
+
+def time_call(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+def main():
+    counts = [int(count) for count in argv[1:]] or default_counts
+    bench_dir = os.path.abspath(os.path.join(script_dir, 'bench_records.tmp'))
+    if os.path.exists(bench_dir):
+        shutil.rmtree(bench_dir)
+    os.makedirs(bench_dir)
+
+    c = linux_gcc_x64()
+    output_dir = os.path.join(bench_dir, 'out')
+    header_list = [os.path.join(bench_dir, 'include', 'module%d' % (index % 40), 'header%d.h' % index)
+                   for index in range(header_count)]
+    index_path = os.path.join(bench_dir, 'dep.index')
+
+    print("%8s %9s %9s %9s %9s %9s %9s %9s" %
+          ("sources", "check s", "check MB", "graph s", "graph MB", "save s", "load s", "index s"))
+    for count in counts:
+        source_list = [os.path.join(bench_dir, 'src', 'module%d' % (index % 100), 'source%d.cpp' % index)
+                       for index in range(count)]
+
+        rebuild_list, check_time, check_size = measure(
+            lambda: c.check_for_rebuild('bench', output_dir, 'release', source_list))
+        assert len(rebuild_list) == count
+        del rebuild_list
+
+        def fill_graph():
+            graph = dependency_graph()
+            for index, source in enumerate(source_list):
+                graph.set_deps(source, [header_list[(index * 7 + offset * 31) % header_count]
+                                        for offset in range(headers_per_source)])
+            return graph
+        graph, graph_time, graph_size = measure(fill_graph)
+
+        save_time = time_call(lambda: graph.save(index_path))
+        del graph
+        gc.collect()
+        graph = dependency_graph()
+        load_time = time_call(lambda: graph.load(index_path))
+        index_time = time_call(graph.get_dependents)
+        del graph
+
+        print("%8d %9.3f %9.1f %9.3f %9.1f %9.3f %9.3f %9.3f" %
+              (count, check_time, check_size, graph_time, graph_size, save_time, load_time, index_time))
+
+    shutil.rmtree(bench_dir)
+
+if __name__ == "__main__":
+    main()
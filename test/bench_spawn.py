@@ -0,0 +1,66 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Compares the time to start a trivial tool with each launcher as this process
+# grows. The launch server is started first, while the process is small, as a
+# service embedding pycplusplus would. Sizes are in MB, on the command line.
+
+from __future__ import print_function
+import sys
+import os
+import time
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus import launcher
+
+default_sizes = [0, 256, 1024, 2048]
+spawn_repeat = 100
+page_size = 4096
+
+def grow_to(ballast, size):
+    # Touch every page, so the memory is really mapped and has to be dealt with by
+    # fork.
+    while len(ballast) < size:
+        block = bytearray(64 * 1024 * 1024)
+        for offset in range(0, len(block), page_size):
+            block[offset] = 1
+        ballast.append(block)
+
+def main():
+    sizes = [int(size) for size in argv[1:]] or default_sizes
+    launchers = [('direct', launcher.direct_launcher()),
+                 ('posix_spawn', launcher.spawn_launcher()),
+                 ('server', launcher.server_launcher())]
+    true_path = '/bin/true' if os.path.isfile('/bin/true') else '/usr/bin/true'
+
+    ballast = []
+    print("%8s" % "MB" + ''.join("%14s" % launcher_name for launcher_name, l in launchers))
+    for size in sizes:
+        grow_to(ballast, size // 64)
+        line = "%8d" % size
+        for launcher_name, l in launchers:
+            l.run([true_path], None, ())
+            start = time.time()
+            for repeat in range(spawn_repeat):
+                l.run([true_path], None, ())
+            line += "%11.3f ms" % ((time.time() - start) * 1000.0 / spawn_repeat)
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Checks that the automatic precompiled header finds a header the sources
+# include from their own directory, which no include path leads to.
+
+from __future__ import print_function
+import sys
+import os
+import time
+import shutil
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus import get_compiler
+from pycplusplus.compiler import cplusplus_error
+from pycplusplus.autopch import get_header_path
+from pycplusplus.autopch import stable_age
+
+source_count = 5
+
+def check(condition, description):
+    if condition:
+        print("passed: %s" % description)
+    else:
+        print("FAILED: %s" % description)
+    return condition
+
+def main():
+    test_dir = os.path.abspath(os.path.join(script_dir, 'test_auto_pch.tmp'))
+    if os.path.exists(test_dir):
+        shutil.rmtree(test_dir)
+    source_dir = os.path.join(test_dir, 'src')
+    os.makedirs(source_dir)
+
+    c = get_compiler('linux_gcc_x64')
+    if not c:
+        print("Compiler not found")
+        return 0
+
+    # The header has to have settled down before it is selected.
+    common_header = os.path.join(source_dir, 'common.h')
+    with open(common_header, 'w') as header_file:
+        header_file.write("#ifndef COMMON_H\n#define COMMON_H\n"
+                          "#include <string>\ninline int common_value() { return 1; }\n"
+                          "#endif\n")
+    settled = time.time() - 2 * stable_age
+    os.utime(common_header, (settled, settled))
+
+    source_list = []
+    for index in range(source_count):
+        source = os.path.join(source_dir, 'source%d.cpp' % index)
+        with open(source, 'w') as source_file:
+            source_file.write('#include "common.h"\nint source%d() { return common_value(); }\n' % index)
+        source_list.append(source)
+
+    passed = True
+    c.auto_pch = True
+    output_dir = os.path.join(test_dir, 'out')
+    try:
+        # The first build records the dependencies; the second selects the header,
+        # and every source is compiled again with it.
+        for build in range(2):
+            c.build_static_lib('autopch', output_dir, 'debug', source_list, [], [])
+            if build == 0:
+                for source in source_list:
+                    os.utime(source, None)
+        error = None
+    except cplusplus_error as e:
+        error = str(e)
+    finally:
+        c.auto_pch = False
+    passed &= check(error is None, "builds with the precompiled header")
+
+    header_path = get_header_path(c, 'autopch', output_dir)
+    header_text = ''
+    if os.path.isfile(header_path):
+        with open(header_path, 'r') as header_file:
+            header_text = header_file.read()
+    passed &= check(('#include "%s"' % common_header) in header_text, "header included by its path")
+
+    shutil.rmtree(test_dir)
+    print("all passed" if passed else "some checks failed")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
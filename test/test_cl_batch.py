@@ -0,0 +1,144 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Checks that the output of a batched (/MP) cl is split back into the output
+# and dependencies of each source. A stand-in for cl replays recorded output, so
+# this runs anywhere, not just on Windows.
+
+from __future__ import print_function
+import sys
+import os
+import json
+import shutil
+import stat
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus.compiler import cplusplus_error
+from pycplusplus.visualcpp import visual_cpp_2013_x64
+
+# The stand-in: prints the recorded output and writes an object for each source
+# that did not fail.
+fake_cl_text = """#!%s
+import sys, os, json
+recording = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recording.json')))
+args = sys.argv[1:]
+object_dir = [arg[3:] for arg in args if arg.startswith('/Fo')][0]
+for source in [arg for arg in args if arg.endswith('.cpp')]:
+    base_name = os.path.splitext(os.path.basename(source))[0]
+    if not base_name in recording['failed']:
+        open(os.path.join(object_dir, base_name + '.obj'), 'w').close()
+sys.stdout.write(recording['output'])
+sys.exit(2 if recording['failed'] else 0)
+""" % sys.executable
+
+# Recorded from cl /MP /showIncludes, with one warning. When c.cpp fails, its
+# error arrives after b.cpp has started.
+recorded_output = """a.cpp
+Note: including file: {dir}/include/common.h
+Note: including file:  {dir}/include/other.h
+b.cpp
+Note: including file: {dir}/include/common.h
+{dir}/src/b.cpp(4): warning C4514: 'f': unreferenced inline function has been removed
+{error}c.cpp
+Note: including file: {dir}/include/other.h
+"""
+
+c_error = "{dir}/src/c.cpp(3): error C2065: 'y': undeclared identifier\n"
+
+def get_output(test_dir, failed):
+    return recorded_output.replace('{error}', c_error if failed else '').replace('{dir}', test_dir)
+
+def write_recording(test_dir, failed):
+    with open(os.path.join(test_dir, 'recording.json'), 'w') as recording_file:
+        json.dump({'output': get_output(test_dir, failed), 'failed': failed}, recording_file)
+
+def check(condition, description):
+    if condition:
+        print("passed: %s" % description)
+    else:
+        print("FAILED: %s" % description)
+    return condition
+
+def main():
+    test_dir = os.path.abspath(os.path.join(script_dir, 'test_cl_batch.tmp'))
+    if os.path.exists(test_dir):
+        shutil.rmtree(test_dir)
+    os.makedirs(os.path.join(test_dir, 'src'))
+
+    fake_cl = os.path.join(test_dir, 'cl')
+    with open(fake_cl, 'w') as fake_cl_file:
+        fake_cl_file.write(fake_cl_text)
+    os.chmod(fake_cl, os.stat(fake_cl).st_mode | stat.S_IEXEC)
+
+    source_list = []
+    for source_name in ['a.cpp', 'b.cpp', 'c.cpp']:
+        source = os.path.join(test_dir, 'src', source_name)
+        open(source, 'w').close()
+        source_list.append(source)
+
+    # Set up the compiler by hand; there is no Visual C++ to detect.
+    c = visual_cpp_2013_x64()
+    c.cl = fake_cl
+    c.rc = fake_cl
+    c.builtin_include_list = []
+    c.batch_compile = True
+    output_dir = os.path.join(test_dir, 'out')
+    c.make_intermediates_dirs('test', output_dir)
+
+    def deps_of(r):
+        with open(r.dep, 'r') as dep_file:
+            return [os.path.basename(dep) for dep in dep_file.read().splitlines()]
+
+    passed = True
+
+    # Everything compiles.
+    write_recording(test_dir, [])
+    rebuild_list = [c.get_rebuild_record('test', output_dir, source) for source in source_list]
+    c.compile('test', 'debug', output_dir, list(rebuild_list), [], [])
+    passed &= check(deps_of(rebuild_list[0]) == ['common.h', 'other.h'], "a.cpp dependencies")
+    passed &= check(deps_of(rebuild_list[1]) == ['common.h'], "b.cpp dependencies")
+    passed &= check(deps_of(rebuild_list[2]) == ['other.h'], "c.cpp dependencies")
+
+    # c.cpp fails: only its error is reported, and the others still get their
+    # dependencies.
+    write_recording(test_dir, ['c'])
+    for r in rebuild_list:
+        os.remove(r.dep)
+    error = None
+    try:
+        c.compile('test', 'debug', output_dir, list(rebuild_list), [], [])
+    except cplusplus_error as e:
+        error = str(e)
+    passed &= check(error is not None and 'C2065' in error, "c.cpp error reported")
+    passed &= check(error is not None and not 'C4514' in error, "b.cpp warning not reported as c.cpp's")
+    passed &= check(os.path.isfile(rebuild_list[1].dep) and not os.path.isfile(rebuild_list[2].dep),
+                    "dependencies written only for the sources that compiled")
+
+    # Output split directly.
+    source_outputs, unclaimed_text = c.split_cl_batch_output(get_output(test_dir, ['c']), source_list)
+    passed &= check('C4514' in source_outputs[source_list[1]][visual_cpp_2013_x64.split_includes_text_index],
+                    "warning attributed to b.cpp")
+    passed &= check(unclaimed_text == '', "no unclaimed output")
+
+    shutil.rmtree(test_dir)
+    print("all passed" if passed else "some checks failed")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Checks which header edits change a header's fingerprint.
+
+from __future__ import print_function
+import sys
+import os
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus.fingerprints import get_fingerprint_text
+
+base_header = """#ifndef HEADER_H
+#define HEADER_H
+#define F(x) x
+int f(int a); // the function
+#endif
+"""
+
+def check(condition, description):
+    if condition:
+        print("passed: %s" % description)
+    else:
+        print("FAILED: %s" % description)
+    return condition
+
+def same(old_text, new_text, lines=True):
+    return get_fingerprint_text(old_text, lines) == get_fingerprint_text(new_text, lines)
+
+def main():
+    passed = True
+    passed &= check(same(base_header, base_header.replace('// the function', '/* f */')), "comment edited")
+    passed &= check(same(base_header, base_header.replace('int f(int a);', '  int  f( int a ) ;')),
+                    "white space edited")
+    passed &= check(not same(base_header, base_header.replace('int a', 'long a')), "token changed")
+    passed &= check(not same(base_header, '\n' + base_header), "line added")
+    passed &= check(same(base_header, '\n' + base_header, False), "line added, lines not counted")
+    passed &= check(not same(base_header, base_header.replace('#define F(x)', '#define F (x)')),
+                    "function-like macro made object-like")
+    passed &= check(same(base_header, base_header.replace('#define F(x)', '#  define F(x)')),
+                    "white space before a function-like macro")
+    passed &= check(not same('#define S "a // b"\n', '#define S "a "\n'), "comment marker in a string")
+    print("all passed" if passed else "some checks failed")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Checks that reproducible builds do not depend on the directory they are built
+# in, or run from, and that split DWARF, which can not be made reproducible, is
+# refused.
+
+from __future__ import print_function
+import sys
+import os
+import shutil
+import filecmp
+
+argv = sys.argv
+script_dir = os.path.abspath(os.path.dirname(argv[0]))
+module_dir = os.path.abspath(os.path.join(script_dir, '..', '..'))
+sys.path.append(module_dir)
+
+from pycplusplus import get_compiler
+from pycplusplus.compiler import cplusplus_error
+from pycplusplus.compiler import target
+from pycplusplus.reproducible import get_build_outputs
+
+def check(condition, description):
+    if condition:
+        print("passed: %s" % description)
+    else:
+        print("FAILED: %s" % description)
+    return condition
+
+def main():
+    test_dir = os.path.abspath(os.path.join(script_dir, 'test_reproducible.tmp'))
+    if os.path.exists(test_dir):
+        shutil.rmtree(test_dir)
+    source_dir = os.path.join(test_dir, 'src')
+    os.makedirs(source_dir)
+    source = os.path.join(source_dir, 'repro.cpp')
+    with open(source, 'w') as source_file:
+        source_file.write('#include <stdio.h>\nvoid repro() { printf("%s %d\\n", __FILE__, __LINE__); }\n')
+
+    c = get_compiler('linux_gcc_x64')
+    if not c:
+        print("Compiler not found")
+        return 0
+
+    passed = True
+    c.reproducible = True
+    c.source_root = source_dir
+    old_cwd = os.getcwd()
+    try:
+        # Each build is in its own directory and run from its own directory, which
+        # is not the source root.
+        build_outputs = []
+        for build_name in ['a', 'b']:
+            build_dir = os.path.join(test_dir, build_name)
+            os.makedirs(build_dir)
+            os.chdir(build_dir)
+            t = target(target.type_static_lib, 'repro', build_dir, 'debug', [source], [], [])
+            c.build_target(t)
+            c.wait_for_deferred()
+            build_outputs.append(get_build_outputs(c, [t], build_dir))
+        outputs_a, outputs_b = build_outputs
+        passed &= check(len(outputs_a) > 0 and sorted(outputs_a) == sorted(outputs_b), "same files built")
+        passed &= check(all(filecmp.cmp(outputs_a[path], outputs_b[path], shallow=False)
+                            for path in outputs_a if path in outputs_b), "same bytes built")
+
+        c.split_dwarf = True
+        error = None
+        try:
+            c.build_target(target(target.type_static_lib, 'split', os.path.join(test_dir, 'split'), 'debug',
+                                  [source], [], []))
+        except cplusplus_error as e:
+            error = str(e)
+        passed &= check(error is not None and 'split_dwarf' in error, "split DWARF refused")
+    finally:
+        os.chdir(old_cwd)
+        c.reproducible = False
+        c.source_root = None
+        c.split_dwarf = False
+
+    shutil.rmtree(test_dir)
+    print("all passed" if passed else "some checks failed")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
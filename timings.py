@@ -0,0 +1,142 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import json
+import time
+
+# How long each source of a target took to compile the last time it was
+# compiled, and how long the target took to link, in seconds. The compiler
+# keeps one per target up to date as it builds, and saves it in the target's
+# intermediates directory (see compiler.load_timings); the build planner uses
+# it to estimate the cost of a build (see planner.py). Source paths are stored
+# absolute.
+#
+# A history of the last history_limit builds that compiled anything is kept
+# alongside, for finding compile time regressions (see regressions.py). Each
+# build holds a build_history_entry per source it compiled.
+class build_timings:
+    file_version = 2
+    history_limit = 100
+
+    def __init__(self):
+        self.compile_times = {}
+        self.build_compile_times = {}
+        self.link_time = None
+        self.history = []
+        self.modified = False
+
+    def set_compile_time(self, source, seconds):
+        source = os.path.abspath(source)
+        self.compile_times[source] = seconds
+        self.build_compile_times[source] = seconds
+        self.modified = True
+
+    def get_compile_time(self, source):
+        return self.compile_times.get(os.path.abspath(source))
+
+    def get_build_compile_time(self, source):
+        # The compile time recorded since the timings were loaded, or None.
+        return self.build_compile_times.get(os.path.abspath(source))
+
+    def get_mean_compile_time(self):
+        # A guess for sources that have never been timed, or None.
+        if not self.compile_times:
+            return None
+        return sum(self.compile_times.values()) / len(self.compile_times)
+
+    def set_link_time(self, seconds):
+        self.link_time = seconds
+        self.modified = True
+
+    def add_build(self, label, entries):
+        # "entries" is a dictionary of absolute source path to build_history_entry.
+        # "label" names the build (the commit built, say), or is None.
+        if not entries:
+            return
+        self.history.append(build_history(time.time(), label, entries))
+        del self.history[:-build_timings.history_limit]
+        self.modified = True
+
+    def load(self, path):
+        # As with the dependency graph, a missing or unreadable file just means no
+        # timings yet.
+        try:
+            with open(path, 'r') as timings_file:
+                timings = json.load(timings_file)
+        except (IOError, OSError, ValueError):
+            return False
+        if timings.get('version') != build_timings.file_version:
+            return False
+        self.compile_times = timings['compile']
+        self.link_time = timings['link']
+
+        # Headers, and the lists of headers sources include, are stored once each and
+        # referred to by index.
+        headers = timings['headers']
+        header_lists = [tuple(headers[header_index] for header_index in header_indexes)
+                        for header_indexes in timings['header_lists']]
+        self.history = []
+        for build in timings['history']:
+            entries = dict((source, build_history_entry(seconds, size, header_lists[header_list_index]))
+                           for source, (seconds, size, header_list_index) in build['entries'].items())
+            self.history.append(build_history(build['time'], build['label'], entries))
+        self.modified = False
+        return True
+
+    def save(self, path):
+        header_indexes = {}
+        header_list_indexes = {}
+        history = []
+        for build in self.history:
+            entries = {}
+            for source, entry in build.entries.items():
+                header_list_index = header_list_indexes.get(entry.headers)
+                if header_list_index is None:
+                    header_list_index = len(header_list_indexes)
+                    header_list_indexes[entry.headers] = header_list_index
+                    for header in entry.headers:
+                        header_indexes.setdefault(header, len(header_indexes))
+                entries[source] = [entry.seconds, entry.size, header_list_index]
+            history.append({'time': build.time, 'label': build.label, 'entries': entries})
+        with open(path, 'w') as timings_file:
+            timings_file.write(json.dumps({
+                'version': build_timings.file_version,
+                'compile': self.compile_times,
+                'link': self.link_time,
+                'headers': sorted(header_indexes, key=header_indexes.get),
+                'header_lists': [[header_indexes[header] for header in header_list]
+                                 for header_list in sorted(header_list_indexes, key=header_list_indexes.get)],
+                'history': history
+                }))
+        self.modified = False
+
+# One build in a target's history. "time" is when it finished compiling.
+class build_history:
+    def __init__(self, time, label, entries):
+        self.time = time
+        self.label = label
+        self.entries = entries
+
+# One source compiled by a build: the seconds the compile took, the size of the
+# object written (None if there was none) and the tuple of headers the source
+# included.
+class build_history_entry(object):
+    __slots__ = ['seconds', 'size', 'headers']
+
+    def __init__(self, seconds, size, headers):
+        self.seconds = seconds
+        self.size = size
+        self.headers = headers
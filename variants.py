@@ -0,0 +1,172 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import copy
+import threading
+
+from .compiler import target
+from .compiler import stat_cache
+from .gcc import linux_gcc_x64
+from .matrix import matrix_cell
+from .matrix import cell_console
+from .matrix import build_cell
+
+# Builds the same list of targets for several x86-64 microarchitecture levels
+# at once (see linux_gcc_x64.march), each into <output_dir>/<level> with its own
+# intermediates, as the build matrix does for configs. Each application target
+# also gets a launcher at <output_dir>/<name> that runs the variant for the best
+# level the CPU it runs on supports, with that level's directory first on the
+# library path so its shared libraries are found too.
+
+launcher_template = """// Generated to run the best variant of %(name)s for this CPU. Do not edit.
+#include <limits.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+static const char *select_level(void)
+{
+    __builtin_cpu_init();
+%(checks)s    return 0;
+}
+
+int main(int argc, char **argv)
+{
+    char dir[PATH_MAX];
+    char path[PATH_MAX];
+    char library_path[PATH_MAX * 2];
+    const char *level;
+    const char *old_library_path;
+    char *slash;
+    ssize_t length = readlink("/proc/self/exe", dir, sizeof(dir) - 1);
+    (void)argc;
+    if (length < 0) {
+        perror("%(name)s: /proc/self/exe");
+        return 127;
+    }
+    dir[length] = 0;
+    slash = strrchr(dir, '/');
+    *slash = 0;
+
+    level = select_level();
+    if (!level) {
+        fprintf(stderr, "%(name)s: no variant runs on this CPU\\n");
+        return 127;
+    }
+    if (snprintf(path, sizeof(path), "%%s/%%s/%%s", dir, level, slash + 1) >= (int)sizeof(path)) {
+        fprintf(stderr, "%(name)s: path too long\\n");
+        return 127;
+    }
+    old_library_path = getenv("LD_LIBRARY_PATH");
+    if (old_library_path && *old_library_path)
+        length = snprintf(library_path, sizeof(library_path), "%%s/%%s:%%s", dir, level, old_library_path);
+    else
+        length = snprintf(library_path, sizeof(library_path), "%%s/%%s", dir, level);
+    if (length >= (ssize_t)sizeof(library_path)) {
+        fprintf(stderr, "%(name)s: LD_LIBRARY_PATH too long\\n");
+        return 127;
+    }
+    setenv("LD_LIBRARY_PATH", library_path, 1);
+    execv(path, argv);
+    perror(path);
+    return 127;
+}
+"""
+
+def get_launcher_text(name, level_list):
+    # Best level first; x86-64 runs anywhere. -march=native builds are for the
+    # building host only and are never picked.
+    checks = []
+    for level in reversed(linux_gcc_x64.march_levels):
+        if not level in level_list:
+            continue
+        if level == 'x86-64':
+            checks.append('    return "x86-64";\n')
+            break
+        checks.append('    if (__builtin_cpu_supports("%s"))\n        return "%s";\n' % (level, level))
+    return launcher_template % {'name': name, 'checks': ''.join(checks)}
+
+def build_launcher(c, t, level_list):
+    # Only compiled when the generated source changes, or the launcher is missing.
+    launcher_dir = os.path.join(c.get_intermediates_dir(t.name, t.output_dir), 'launcher')
+    if not os.path.exists(launcher_dir):
+        os.makedirs(launcher_dir)
+    source_path = os.path.join(launcher_dir, 'launcher.c')
+    launcher_path = c.get_output_path(t)
+    launcher_text = get_launcher_text(t.name, level_list)
+    if os.path.isfile(source_path) and os.path.isfile(launcher_path):
+        with open(source_path, 'r') as source_file:
+            if source_file.read() == launcher_text:
+                return
+    with open(source_path, 'w') as source_file:
+        source_file.write(launcher_text)
+
+    c.print_both("linking launcher %s" % os.path.basename(launcher_path))
+    i = c.invoke([c.prep_path(c.gcc), '-std=gnu99', '-O2', '-Wall', '-Werror', '-m64',
+                  '-o' + c.prep_path(launcher_path), c.prep_path(source_path)])
+    if i.return_val != 0:
+        c.handle_error(i.stdout)
+
+def get_variant_targets(target_list, level):
+    # Library paths that point at another target's output directory follow that
+    # target into the variant's directory.
+    output_dirs = {}
+    for t in target_list:
+        output_dirs[os.path.abspath(t.output_dir)] = os.path.join(t.output_dir, level)
+
+    variant_target_list = []
+    for t in target_list:
+        variant_target = copy.copy(t)
+        variant_target.output_dir = output_dirs[os.path.abspath(t.output_dir)]
+        variant_target.libpath_list = [output_dirs.get(os.path.abspath(libpath_dir), libpath_dir)
+                                       for libpath_dir in t.libpath_list]
+        variant_target_list.append(variant_target)
+    return variant_target_list
+
+def build_variants(c, target_list, level_list, launchers=True):
+    # Returns a list of matrix_cell results, one per level, with the level as the
+    # cell's config. Launchers are only built if every level built; an error
+    # building one raises cplusplus_error.
+    if not isinstance(c, linux_gcc_x64):
+        c.handle_error("error: microarchitecture variants need an x64 gcc based compiler")
+
+    if 'native' in level_list:
+        # Found before the threads start, so only once.
+        c.get_native_march()
+
+    shared_stat_cache = stat_cache()
+    cell_list = []
+    thread_list = []
+    for level in level_list:
+        cell = matrix_cell(c.__class__.__name__, level, get_variant_targets(target_list, level))
+        cell_list.append(cell)
+        variant_compiler = copy.copy(c)
+        variant_compiler.march = level
+        variant_compiler.deferred_jobs = None
+        variant_compiler.stat_cache = shared_stat_cache
+        variant_compiler.console_file = cell_console('[%s] ' % level)
+        thread = threading.Thread(target=build_cell, args=(variant_compiler, cell))
+        thread.start()
+        thread_list.append(thread)
+    for thread in thread_list:
+        thread.join()
+
+    if launchers and all(cell.succeeded for cell in cell_list):
+        for t in target_list:
+            if t.target_type == target.type_application:
+                build_launcher(c, t, level_list)
+    return cell_list
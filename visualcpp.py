@@ -16,12 +16,34 @@
 import os
 import copy
 import re
+import time
 from .compiler import compiler
+from .compiler import invocation
+from . import telemetry
+
+# A diagnostic from cl: "<path>(<line>[,<column>]): <error|warning|note> ..."
+cl_diagnostic_pattern = re.compile(r'^\s*(.+?)\((\d+)(?:,\d+)?\)\s*:')
+
+# cl reports an error in a source with "error Cnnnn" or "fatal error Cnnnn".
+cl_error_pattern = re.compile(r'\berror [A-Z]+\d+', re.IGNORECASE)
 
 class visual_cpp(compiler):
+    # Build options (see compiler.get_option):
+    # "batch_compile" = compile many sources with each cl invocation, in parallel
+    #     (/MP), instead of starting a cl for every source
+    batch_compile = False
+
     split_includes_text_index = 0
     split_includes_deps_index = 1
 
+    # Windows command lines are limited to 32767 characters.
+    batch_command_limit = 30000
+
+    # Every cl of a target writes the same .pdb. With /FS (Visual C++ 2013 and
+    # later) the writes are serialized, so several cl can run at once; without it
+    # sources are compiled one at a time, outside of batch mode.
+    serialized_pdb_writes = False
+
     def host(self):
         return 'Windows'
 
@@ -223,6 +245,9 @@ class visual_cpp(compiler):
 
         return True
 
+    def get_identity(self):
+        return '%s %s %d' % (self.__class__.__name__, self.cl, os.path.getmtime(self.cl))
+
     def compile(self, name, config, output_dir, rebuild_list, include_list, define_list):
         # Build the basic compiler invocation command line arguments
         compile_flags = ['"' + self.cl + '"',
@@ -264,9 +289,24 @@ class visual_cpp(compiler):
             rc_flags.append('/I"' + include_dir + '"')
 
         compile_flags.append('/Fd"' + os.path.join(output_dir, name + '.pdb"'))
+        if self.serialized_pdb_writes:
+            compile_flags.append('/FS')        # serialize writes to the .pdb
+
+        # The automatic precompiled header is force included ahead of every source.
+        # cl leaves the headers that came from it out of /showIncludes, so they are
+        # added back from the precompiled header's own.
+        auto_pch_deps = []
+        auto_pch_header = self.get_auto_pch_header(name, output_dir, config)
+        if auto_pch_header and len(rebuild_list) > 0:
+            auto_pch_binary = os.path.splitext(auto_pch_header)[0] + '.pch'
+            auto_pch_deps = self.build_auto_pch(name, output_dir, auto_pch_header, auto_pch_binary, compile_flags)
+            compile_flags.extend(['/FI"' + auto_pch_header + '"',
+                                  '/Yu"' + auto_pch_header + '"',
+                                  '/Fp"' + auto_pch_binary + '"'])
 
         did_pch = False
         did_rc = False
+        compile_list = []
         for r in rebuild_list:
             source_split = os.path.split(r.source)
             source_name_split = os.path.splitext(source_split[1])
@@ -288,7 +328,7 @@ class visual_cpp(compiler):
                     self.handle_error("error: Can not parse precompiled header source file")
 
                 precompiled_header = precomp_match.group(1)
-                precompiled_binary = os.path.join(output_dir, name + '.intermediates', source_base_name + '.pch')
+                precompiled_binary = os.path.join(self.get_intermediates_dir(name, output_dir), source_base_name + '.pch')
 
                 invocation_flags = copy.copy(compile_flags)
                 invocation_flags.extend(['/Yc"' + precompiled_header + '"',
@@ -301,11 +341,12 @@ class visual_cpp(compiler):
 
                 # Run it
                 self.print_both("building precompiled header")
+                self.fire_event(telemetry.event_pch_build, source=r.source, output=precompiled_binary)
+                start = time.time()
                 i = self.invoke(invocation_flags)
-                self.handle_compiler_invoke_result(i, r.dep)
+                self.handle_compiler_invoke_result(i, r)
+                self.record_compile_time(r.source, time.time() - start)
 
-                # Do not compile the precompiled header source file again
-                rebuild_list.remove(r)
                 did_pch = True
             elif source_extension.lower() == '.rc':
                 if did_rc:
@@ -322,21 +363,151 @@ class visual_cpp(compiler):
                 if i.return_val != 0:
                     self.handle_error(i.stdout)
 
-                rebuild_list.remove(r)
                 did_rc = True
+            else:
+                compile_list.append(r)
 
-        for r in rebuild_list:
+        # The precompiled header and resource source files are not compiled again.
+        if self.get_option('batch_compile', config) and len(compile_list) > 1:
+            self.compile_batches(compile_flags, compile_list, auto_pch_deps)
+            return
+
+        invocation_list = []
+        for r in compile_list:
             # Finish the flags for this particular compiler invocation
             invocation_flags = copy.copy(compile_flags)
             invocation_flags.extend(['/Fo"' + r.obj + '"',
                                      '"' + r.source + '"'])
 
-            # Run it
-            self.print_both("compiling %s" % os.path.basename(r.source))
-            i = self.invoke(invocation_flags)
-            self.handle_compiler_invoke_result(i, r.dep)
+            invocation_list.append(invocation(
+                "compiling %s" % os.path.basename(r.source),
+                invocation_flags,
+                lambda i, r=r: self.handle_compiler_invoke_result(i, r, auto_pch_deps),
+                r.source
+                ))
+
+        # Run them
+        if self.serialized_pdb_writes:
+            self.invoke_parallel(invocation_list)
+            return
+        for inv in invocation_list:
+            self.print_both(inv.message)
+            start = time.time()
+            i = self.invoke(inv.command_line)
+            inv.on_result(i)
+            self.record_compile_time(inv.source, time.time() - start)
+
+    def get_compile_batches(self, compile_flags, rebuild_list):
+        # Split the sources into batches that fit on one command line.
+        flags_length = len(' '.join(compile_flags)) + 64
+        batches = []
+        batch = []
+        batch_length = flags_length
+        for r in rebuild_list:
+            source_length = len(r.source) + 3
+            if batch and batch_length + source_length > visual_cpp.batch_command_limit:
+                batches.append(batch)
+                batch = []
+                batch_length = flags_length
+            batch.append(r)
+            batch_length += source_length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def compile_batches(self, compile_flags, rebuild_list, extra_deps):
+        # One cl compiles each batch of sources, running as many of them at once (/MP)
+        # as the job budget has free. The objects go to the obj directory named after
+        # their sources, as they would one at a time.
+        budget = self.get_job_budget()
+        for batch in self.get_compile_batches(compile_flags, rebuild_list):
+            # Whether each source compiled is told by its object; remove the old ones.
+            for r in batch:
+                if os.path.isfile(r.obj):
+                    os.remove(r.obj)
+
+            # The doubled separator keeps the closing quote from being escaped.
+            invocation_flags = copy.copy(compile_flags)
+            invocation_flags.append('/Fo"' + os.path.dirname(batch[0].obj) + os.sep + os.sep + '"')
 
-    def handle_compiler_invoke_result(self, i, deps_file_name):
+            batch_jobs = budget.acquire_up_to(len(batch))
+            try:
+                invocation_flags.append('/MP%d' % batch_jobs)
+                for r in batch:
+                    invocation_flags.append('"' + r.source + '"')
+                    self.print_both("compiling %s" % os.path.basename(r.source))
+                start = time.time()
+                i = self.invoke(invocation_flags, 0)
+                elapsed = time.time() - start
+            finally:
+                budget.release(batch_jobs)
+            self.handle_batch_result(i, batch, extra_deps)
+
+            # Each source's share of the batch, as if compiled one at a time.
+            for r in batch:
+                self.record_compile_time(r.source, elapsed * batch_jobs / len(batch))
+
+    def handle_batch_result(self, i, batch, extra_deps):
+        source_outputs, unclaimed_text = self.split_cl_batch_output(i.stdout, [r.source for r in batch])
+
+        error_text = []
+        for r in batch:
+            stdout_split = source_outputs[r.source]
+            source_text = stdout_split[visual_cpp.split_includes_text_index]
+            if not os.path.isfile(r.obj) or cl_error_pattern.search(source_text):
+                error_text.append(source_text)
+                continue
+
+            # Write the dependent information into the .dep file
+            deps_list = stdout_split[visual_cpp.split_includes_deps_index].splitlines()
+            deps_list.extend(dep for dep in extra_deps if not dep in deps_list)
+            self.write_dep_file(r, deps_list)
+
+        if i.return_val != 0 or error_text:
+            if unclaimed_text:
+                error_text.insert(0, unclaimed_text)
+            self.handle_error('\n'.join(text for text in error_text if text))
+
+    def build_auto_pch(self, name, output_dir, header, pch_binary, compile_flags):
+        # cl builds a precompiled header while compiling a source: here a generated one
+        # holding nothing but the forced include. Its object holds the precompiled
+        # header's debug information, and is linked with the others. Returns the header
+        # and everything it includes.
+        source = os.path.splitext(header)[0] + '.cpp'
+        obj = os.path.join(self.get_intermediates_dir(name, output_dir), 'obj', 'autopch.obj')
+        dep_path = header + '.dep'
+        if os.path.isfile(pch_binary) and os.path.isfile(obj) and os.path.isfile(dep_path):
+            pch_last_modified = min(os.path.getmtime(pch_binary), os.path.getmtime(obj))
+            with open(dep_path, 'r') as dep_file:
+                deps_list = [header] + dep_file.read().splitlines()
+            if all(os.path.isfile(dep) and os.path.getmtime(dep) < pch_last_modified for dep in deps_list):
+                return deps_list
+
+        if not os.path.isfile(source):
+            with open(source, 'w') as source_file:
+                source_file.write('// Generated to build the automatic precompiled header.\n')
+
+        invocation_flags = copy.copy(compile_flags)
+        invocation_flags.extend(['/FI"' + header + '"',
+                                 '/Yc"' + header + '"',
+                                 '/Fp"' + pch_binary + '"',
+                                 '/Fo"' + obj + '"',
+                                 '"' + source + '"'])
+
+        self.print_both("building precompiled header")
+        self.fire_event(telemetry.event_pch_build, source=header, output=pch_binary)
+        i = self.invoke(invocation_flags)
+        stdout_split = self.split_cl_output(i.stdout)
+        if i.return_val != 0:
+            self.handle_error(stdout_split[visual_cpp.split_includes_text_index])
+
+        deps_list = [dep for dep in stdout_split[visual_cpp.split_includes_deps_index].splitlines()
+                     if dep != header.lower()]
+        with open(dep_path, 'w') as dep_file:
+            dep_file.write('\n'.join(deps_list))
+        return [header] + deps_list
+
+    def handle_compiler_invoke_result(self, i, r, extra_deps=[]):
         # Visual C++ interleaves the header list we use for deps files into the normal output
         stdout_split = self.split_cl_output(i.stdout)
 
@@ -344,8 +515,9 @@ class visual_cpp(compiler):
             self.handle_error(stdout_split[visual_cpp.split_includes_text_index])
 
         # Write the dependent information into the .dep file
-        with open(deps_file_name, 'w') as deps_file:
-            deps_file.write(stdout_split[visual_cpp.split_includes_deps_index])
+        deps_list = stdout_split[visual_cpp.split_includes_deps_index].splitlines()
+        deps_list.extend(dep for dep in extra_deps if not dep in deps_list)
+        self.write_dep_file(r, deps_list)
 
     def split_cl_output(self, compiler_output):
         # Parse out the dependent header file information. Remmove duplicates.
@@ -365,20 +537,67 @@ class visual_cpp(compiler):
 
         return ('\n'.join(text), '\n'.join(headers))
 
+    def split_cl_batch_output(self, compiler_output, source_list):
+        # Split the output of a cl compiling several sources into the output of each.
+        # cl echoes the name of each source on a line of its own before that source's
+        # output, so lines belong to the last source named. A diagnostic naming one of
+        # the sources themselves goes to that source wherever it appears, in case the
+        # output of parallel compiles is interleaved.
+        # Returns a dictionary of source to split_cl_output tuple, and the text that
+        # came before any source was named.
+        source_names = {}
+        source_paths = {}
+        source_lines = {}
+        for source in source_list:
+            source_names[os.path.basename(source).lower()] = source
+            source_paths[os.path.normcase(os.path.abspath(source))] = source
+            source_lines[source] = []
+
+        unclaimed_lines = []
+        current_source = None
+        for line in compiler_output.splitlines():
+            name = line.strip().lower()
+            if name in source_names:
+                current_source = source_names[name]
+                continue
+
+            line_source = current_source
+            diagnostic_match = cl_diagnostic_pattern.match(line)
+            if diagnostic_match:
+                path = os.path.normcase(os.path.abspath(diagnostic_match.group(1)))
+                line_source = source_paths.get(path, current_source)
+
+            if line_source is None:
+                unclaimed_lines.append(line)
+            else:
+                source_lines[line_source].append(line)
+
+        source_outputs = {}
+        for source in source_list:
+            source_outputs[source] = self.split_cl_output('\n'.join(source_lines[source]))
+        return (source_outputs, '\n'.join(unclaimed_lines))
+
+    def get_object_files(self, name, output_dir):
+        # In a consistent order, so the same objects always link the same way.
+        object_files = []
+        object_code_dir = os.path.join(self.get_intermediates_dir(name, output_dir), 'obj')
+        for root, dirs, files in os.walk(object_code_dir, topdown=True):
+            for filename in files:
+                object_files.append(os.path.join(root, filename))
+        return sorted(object_files)
+
     def link_static_lib(self, name, output_dir, config, built_code):
         lib_name = self.get_lib_name(name)
         lib_path = os.path.join(output_dir, lib_name)
 
         if not built_code and os.path.isfile(lib_path):
-            self.print_both("%s is up to date" % lib_name)
+            self.report_link_up_to_date(lib_path)
             return
 
         lib_flags = ['"' + self.lib + '"']
 
-        object_code_dir = os.path.join(output_dir, name + '.intermediates', "obj")
-        for root, dirs, files in os.walk(object_code_dir, topdown=True):
-            for filename in files:
-                lib_flags.append('"' + os.path.join(root, filename) + '"')
+        for object_file in self.get_object_files(name, output_dir):
+            lib_flags.append('"' + object_file + '"')
 
         lib_flags.append('/OUT:"' + lib_path + '"')
 
@@ -394,7 +613,7 @@ class visual_cpp(compiler):
         link_libpath_list.extend(self.builtin_libpath_list)
 
         if not built_code and not self.check_for_link_update(link_path, link_libpath_list, lib_list):
-            self.print_both("%s is up to date" % link_name)
+            self.report_link_up_to_date(link_path)
             return
 
         link_flags = ['"' + self.link + '"',
@@ -422,10 +641,8 @@ class visual_cpp(compiler):
 
         link_flags.append('/OUT:"' + link_path + '"')
 
-        object_code_dir = os.path.join(output_dir, name + '.intermediates', "obj")
-        for root, dirs, files in os.walk(object_code_dir, topdown=True):
-            for filename in files:
-                link_flags.append('"' + os.path.join(root, filename) + '"')
+        for object_file in self.get_object_files(name, output_dir):
+            link_flags.append('"' + object_file + '"')
 
         for lib in lib_list:
             link_flags.append(self.get_lib_name(lib))
@@ -534,6 +751,8 @@ class visual_cpp_2010_x64(visual_cpp_2010):
         return ['/MACHINE:X64']
 
 class visual_cpp_2013(visual_cpp):
+    serialized_pdb_writes = True
+
     def get_vs_common_tools_var(self):
         return 'VS120COMNTOOLS'
 
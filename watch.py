@@ -0,0 +1,251 @@
+#   Python C++ Compiler Invocation Library
+#   Copyright 2014 Joshua Buckman
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import platform
+import ctypes
+import ctypes.util
+
+from .compiler import cplusplus_error
+
+# Watch mode keeps the source/header graph of each target in memory (kept up to
+# date by the compiler as it writes .dep files) and waits for file system
+# change notifications. When a file changes, only the objects
+# that depend on it are recompiled before the target is relinked; nothing is
+# walked, stat'ed or read from the .dep files to find out what to rebuild.
+# Libraries targets link are watched too, wherever they are built, and a target
+# linking another target by name is relinked whenever that one is rebuilt.
+
+# Checks every watched file's time stamp periodically. Used where inotify is not
+# available.
+class polling_monitor:
+    def __init__(self, poll_interval=0.25):
+        self.poll_interval = poll_interval
+        self.mtimes = {}
+
+    def get_mtime(self, path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def watch(self, path_list):
+        for path in path_list:
+            path = os.path.abspath(path)
+            if not path in self.mtimes:
+                self.mtimes[path] = self.get_mtime(path)
+
+    def wait(self, timeout=None):
+        # Returns the set of watched files that changed; empty on timeout.
+        start = time.time()
+        while True:
+            changed = set()
+            for path, mtime in self.mtimes.items():
+                current = self.get_mtime(path)
+                if current != mtime:
+                    self.mtimes[path] = current
+                    changed.add(path)
+            if changed or (timeout is not None and time.time() - start >= timeout):
+                return changed
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        pass
+
+# Linux inotify, through ctypes. inotify watches directories, not files, so each
+# directory holding a watched file is watched and events for other files in it
+# are dropped.
+class inotify_monitor:
+    # See <sys/inotify.h>
+    in_attrib = 0x00000004
+    in_close_write = 0x00000008
+    in_moved_to = 0x00000080
+    in_create = 0x00000100
+    in_delete = 0x00000200
+    in_q_overflow = 0x00004000
+    in_nonblock = 0o4000
+    in_cloexec = 0o2000000
+
+    watch_mask = in_attrib | in_close_write | in_moved_to | in_create | in_delete
+    event_header = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(inotify_monitor.in_nonblock | inotify_monitor.in_cloexec)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dir_watches = {}
+        self.watch_dirs = {}
+        self.files = set()
+
+    def watch(self, path_list):
+        for path in path_list:
+            path = os.path.abspath(path)
+            self.files.add(path)
+            dir_name = os.path.dirname(path)
+            if not dir_name in self.dir_watches:
+                wd = self.libc.inotify_add_watch(
+                    self.fd,
+                    dir_name.encode(sys.getfilesystemencoding()),
+                    inotify_monitor.watch_mask
+                    )
+                if wd >= 0:
+                    self.dir_watches[dir_name] = wd
+                    self.watch_dirs[wd] = dir_name
+
+    def wait(self, timeout=None):
+        # Returns the set of watched files that changed; empty on timeout. Events
+        # for other files in the watched directories do not end the wait.
+        start = time.time()
+        while True:
+            remaining = None
+            if timeout is not None:
+                remaining = max(0.0, timeout - (time.time() - start))
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+            changed = self.read_changes()
+            if changed:
+                return changed
+
+    def read_changes(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+
+        offset = 0
+        while offset + inotify_monitor.event_header.size <= len(data):
+            wd, mask, cookie, name_length = inotify_monitor.event_header.unpack_from(data, offset)
+            offset += inotify_monitor.event_header.size
+            file_name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            if mask & inotify_monitor.in_q_overflow:
+                # Events were lost; assume everything changed.
+                changed.update(self.files)
+            elif wd in self.watch_dirs and file_name:
+                path = os.path.join(self.watch_dirs[wd], file_name.decode(sys.getfilesystemencoding()))
+                if path in self.files:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def create_file_monitor():
+    if platform.system() == 'Linux':
+        try:
+            return inotify_monitor()
+        except (OSError, AttributeError):
+            pass
+    return polling_monitor()
+
+class watcher:
+    def __init__(self, compiler, target_list, monitor=None, settle_time=0.01):
+        self.compiler = compiler
+        self.target_list = target_list
+        self.monitor = monitor if monitor else create_file_monitor()
+        # Editors usually save a file with several file operations; wait this long
+        # for the burst of events to end before rebuilding.
+        self.settle_time = settle_time
+
+        self.graphs = []
+        self.records = []
+        self.library_paths = []
+        self.stale = set()
+        for t in target_list:
+            self.graphs.append(compiler.load_dep_graph(t.name, t.output_dir))
+            records = []
+            for source in t.source_list:
+                records.append((os.path.abspath(source), compiler.get_rebuild_record(t.name, t.output_dir, source)))
+            self.records.append(records)
+            # Every file each library could be linked from, so one appearing in an
+            # earlier search path is noticed too.
+            libpath_list = list(t.libpath_list) + list(compiler.builtin_libpath_list)
+            library_paths = set()
+            for lib in t.lib_list:
+                library_paths.update(os.path.abspath(lib_path) for lib_path in compiler.get_library_paths(libpath_list, lib))
+            self.library_paths.append(library_paths)
+
+    def build(self, index, rebuild_list):
+        # A failed build leaves the target in an unknown state, so the next build of
+        # it goes back to the full update time check.
+        t = self.target_list[index]
+        if index in self.stale:
+            rebuild_list = None
+        try:
+            self.compiler.build_target(t, rebuild_list, self.graphs[index])
+            self.stale.discard(index)
+        except cplusplus_error:
+            self.stale.add(index)
+        finally:
+            self.monitor.watch(self.graphs[index].get_paths())
+            self.monitor.watch(self.library_paths[index])
+
+    def build_all(self):
+        for index in range(len(self.target_list)):
+            self.build(index, None)
+
+    def wait_for_changes(self, timeout=None):
+        changed = self.monitor.wait(timeout)
+        if changed:
+            more = self.monitor.wait(self.settle_time)
+            while more:
+                changed.update(more)
+                more = self.monitor.wait(self.settle_time)
+        return changed
+
+    def rebuild_changed(self, changed_list):
+        # Targets are in build order, so one pass reaches every target linking a
+        # rebuilt one.
+        changed = set(os.path.abspath(path) for path in changed_list)
+        rebuilt_names = set()
+        for index, t in enumerate(self.target_list):
+            affected = self.graphs[index].get_affected_sources(changed_list)
+            if affected or index in self.stale or not self.library_paths[index].isdisjoint(changed) or \
+               rebuilt_names.intersection(t.lib_list):
+                self.build(index, [r for source, r in self.records[index] if source in affected])
+                rebuilt_names.add(t.name)
+
+    def run(self, timeout=None):
+        # Build everything once, then rebuild on each change until interrupted or
+        # until nothing changes for "timeout" seconds.
+        self.build_all()
+        self.compiler.print_console("-- Watching for changes (Ctrl+C to stop) --")
+        try:
+            while True:
+                changed = self.wait_for_changes(timeout)
+                if not changed:
+                    if timeout is not None:
+                        break
+                    continue
+                self.rebuild_changed(changed)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.monitor.close()
+
+def watch(compiler, target_list, timeout=None):
+    watcher(compiler, target_list).run(timeout)